@@ -12,7 +12,6 @@ from typing import Optional, Dict, List
 from datetime import datetime, timezone
 from collections import defaultdict
 from gradio.routes import App
-from PIL import Image
 from fastapi import Depends
 from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
@@ -21,7 +20,7 @@ from pydantic import BaseModel
 
 from modules import shared, progress, sd_models, sd_samplers
 
-from .db import Task, TaskStatus, task_manager
+from .db import Task, TaskStatus, TaskStore, TaskEventType, AsyncTaskStore, run_blocking, encode_task_cursor
 from .models import (
     Txt2ImgApiTaskArgs,
     Img2ImgApiTaskArgs,
@@ -33,7 +32,12 @@ from .models import (
 )
 from .task_runner import TaskRunner
 from .helpers import log, request_with_retry
-from .task_helpers import encode_image_to_base64, img2img_image_args_by_mode
+from .task_helpers import (
+    encode_image_file_to_base64,
+    img2img_image_args_by_mode,
+    inline_image_blobs,
+)
+from .codec import encode_script_args, decode_script_args
 
 
 def api_callback(callback_url: str, task_id: str, status: TaskStatus, images: list):
@@ -78,7 +82,13 @@ def on_task_finished(
     request_with_retry(upload)
 
 
-def regsiter_apis(app: App, task_runner: TaskRunner):
+def regsiter_apis(app: App, task_runner: TaskRunner, store: TaskStore = None):
+    if store is None:
+        store = task_runner.store
+    events = task_runner.events
+    # the read and small write routes are async, waiting on the database takes no worker thread
+    astore = AsyncTaskStore(store)
+
     api_credentials = {}
     deps = None
 
@@ -127,7 +137,7 @@ def regsiter_apis(app: App, task_runner: TaskRunner):
         )
         if callback_url:
             task.api_task_callback = callback_url
-            task_manager.update_task(task)
+            store.update_task(task)
 
         task_runner.execute_pending_tasks_threading()
 
@@ -150,13 +160,17 @@ def regsiter_apis(app: App, task_runner: TaskRunner):
         )
         if callback_url:
             task.api_task_callback = callback_url
-            task_manager.update_task(task)
+            store.update_task(task)
 
         task_runner.execute_pending_tasks_threading()
 
         return QueueTaskResponse(task_id=task_id)
 
     def format_task_args(task):
+        # listed tasks come with their projected params stored at enqueue time, full params are parsed for single tasks
+        if task.summary:
+            return json.loads(task.summary)
+
         task_args = TaskRunner.instance.parse_task_args(task, deserialization=False)
         named_args = task_args.named_args
         named_args["checkpoint"] = task_args.checkpoint
@@ -169,36 +183,76 @@ def regsiter_apis(app: App, task_runner: TaskRunner):
                 named_args.pop(keys[0], None)
         return named_args
 
+    async def get_tasks_page(cursor: Optional[str] = None, **kwargs):
+        try:
+            return await astore.get_tasks(cursor=cursor, **kwargs)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    def get_next_cursor(tasks: List[Task], limit: int, prefix: str = ""):
+        if not limit or len(tasks) < limit:
+            return None
+
+        return prefix + encode_task_cursor(tasks[-1])
+
+    # history continues into the archived tasks once the task table is exhausted (sqlite store only)
+    archive = getattr(store, "archive", None)
+    archive_cursor_prefix = "archive:"
+
+    async def task_not_changed(id: str):
+        # archived tasks are read-only, they can only be deleted
+        if archive is not None and await run_blocking(archive.has_task, id):
+            return {"success": False, "message": "Task is archived and can't be changed"}
+
+        return {"success": False, "message": "Task not found"}
+
     @app.get("/agent-scheduler/v1/queue", response_model=QueueStatusResponse, dependencies=deps)
-    def queue_status_api(limit: int = 20, offset: int = 0):
+    async def queue_status_api(
+        limit: int = 20, offset: int = 0, cursor: Optional[str] = None, q: Optional[str] = None
+    ):
         current_task_id = progress.current_task
-        total_pending_tasks = task_manager.count_tasks(status="pending")
-        pending_tasks = task_manager.get_tasks(status=TaskStatus.PENDING, limit=limit, offset=offset)
+        total_pending_tasks = await astore.count_tasks(status=[TaskStatus.RUNNING, TaskStatus.PENDING], q=q)
+        # running tasks are listed on top of the first page
+        is_first_page = offset == 0 and not cursor
+        running_tasks = []
+        if is_first_page:
+            running_tasks = await astore.get_tasks(status=TaskStatus.RUNNING, load_payload=False, q=q)
+        pending_tasks = await get_tasks_page(
+            status=TaskStatus.PENDING, limit=limit, offset=offset, cursor=cursor, load_payload=False, q=q
+        )
         position = offset
+        if cursor and len(pending_tasks) > 0:
+            position = await astore.get_task_position(pending_tasks[0].id)
         parsed_tasks = []
-        for task in pending_tasks:
+        for task in running_tasks + pending_tasks:
             params = format_task_args(task)
             task_data = task.dict()
             task_data["params"] = params
-            if task.id == current_task_id:
-                task_data["status"] = "running"
+            if task.status == TaskStatus.PENDING:
+                # search results skip tasks, so positions can't be counted from the page start
+                task_data["position"] = await astore.get_task_position(task.id) if q else position
+                position += 1
 
-            task_data["position"] = position
             parsed_tasks.append(TaskModel(**task_data))
-            position += 1
 
         return QueueStatusResponse(
             current_task_id=current_task_id,
             pending_tasks=parsed_tasks,
             total_pending_tasks=total_pending_tasks,
             paused=TaskRunner.instance.paused,
+            next_cursor=get_next_cursor(pending_tasks, limit),
         )
 
     @app.get("/agent-scheduler/v1/export")
     def export_queue(limit: int = 1000, offset: int = 0):
-        pending_tasks = task_manager.get_tasks(status=TaskStatus.PENDING, limit=limit, offset=offset)
-        pending_tasks = [Task.from_table(t).to_json() for t in pending_tasks]
-        return pending_tasks
+        pending_tasks = store.get_tasks(status=TaskStatus.PENDING, limit=limit, offset=offset)
+        exported_tasks = []
+        for task in pending_tasks:
+            task_json = task.to_json()
+            task_json["params"] = inline_image_blobs(task_json["params"])
+            exported_tasks.append(task_json)
+
+        return exported_tasks
 
     class StringRequestBody(BaseModel):
         content: str
@@ -214,21 +268,22 @@ def regsiter_apis(app: App, task_runner: TaskRunner):
                 obj["result"] = None
                 obj["status"] = TaskStatus.PENDING
                 task = Task.from_json(obj)
+                # imported script args are untrusted, only plain values and arrays may be unpickled from them
+                task.script_params = encode_script_args(decode_script_args(task.script_params, trusted=False))
                 taskList.append(task)
 
+            store.upsert_tasks(taskList)
             for task in taskList:
-                exists = task_manager.get_task(task.id)
-                if exists:
-                    task_manager.update_task(task)
-                else:
-                    task_manager.add_task(task)
+                events.append(task.id, TaskEventType.QUEUED, "import")
             return {"success": True, "message": "Queue imported"}
         except Exception as e:
             print(e)
             return {"success": False, "message": "Import Failed"}
 
     @app.get("/agent-scheduler/v1/history", response_model=HistoryResponse, dependencies=deps)
-    def history_api(status: str = None, limit: int = 20, offset: int = 0):
+    async def history_api(
+        status: str = None, limit: int = 20, offset: int = 0, cursor: Optional[str] = None, q: Optional[str] = None
+    ):
         bookmarked = True if status == "bookmarked" else None
         if not status or status == "all" or bookmarked:
             status = [
@@ -237,14 +292,44 @@ def regsiter_apis(app: App, task_runner: TaskRunner):
                 TaskStatus.INTERRUPTED,
             ]
 
-        total = task_manager.count_tasks(status=status)
-        tasks = task_manager.get_tasks(
-            status=status,
-            bookmarked=bookmarked,
-            limit=limit,
-            offset=offset,
-            order="desc",
-        )
+        total = await astore.count_tasks(status=status, q=q)
+        tasks = []
+        next_cursor = None
+        is_archive_cursor = cursor is not None and cursor.startswith(archive_cursor_prefix)
+        if not is_archive_cursor:
+            tasks = await get_tasks_page(
+                status=status,
+                bookmarked=bookmarked,
+                limit=limit,
+                offset=offset,
+                cursor=cursor,
+                order="desc",
+                load_payload=False,
+                q=q,
+            )
+            next_cursor = get_next_cursor(tasks, limit)
+
+        # bookmarked tasks are never archived, and the archive has no search index
+        if archive is not None and not bookmarked and not q:
+            live_total = total
+            total += await run_blocking(archive.count_tasks, status=status)
+            if limit and len(tasks) < limit:
+                archive_limit = limit - len(tasks)
+                try:
+                    archived_tasks = await run_blocking(
+                        archive.get_tasks,
+                        status=status,
+                        limit=archive_limit,
+                        offset=max(offset - live_total, 0) if not cursor else None,
+                        cursor=cursor[len(archive_cursor_prefix) :] if is_archive_cursor else None,
+                        order="desc",
+                        load_payload=False,
+                    )
+                except ValueError as e:
+                    raise HTTPException(status_code=400, detail=str(e))
+                tasks += archived_tasks
+                next_cursor = get_next_cursor(archived_tasks, archive_limit, archive_cursor_prefix)
+
         parsed_tasks = []
         for task in tasks:
             params = format_task_args(task)
@@ -255,38 +340,41 @@ def regsiter_apis(app: App, task_runner: TaskRunner):
         return HistoryResponse(
             total=total,
             tasks=parsed_tasks,
+            next_cursor=next_cursor,
         )
 
     @app.get("/agent-scheduler/v1/task/{id}", dependencies=deps)
-    def get_task(id: str):
-        task = task_manager.get_task(id)
+    async def get_task(id: str):
+        task = await astore.get_task(id)
         if task is None:
             return {"success": False, "message": "Task not found"}
 
         params = format_task_args(task)
         task_data = task.dict()
         task_data["params"] = params
-        if task.id == progress.current_task:
-            task_data["status"] = "running"
         if task_data["status"] == TaskStatus.PENDING:
-            task_data["position"] = task_manager.get_task_position(id)
+            task_data["position"] = await astore.get_task_position(id)
 
         return {"success": True, "data": TaskModel(**task_data)}
 
     @app.get("/agent-scheduler/v1/task/{id}/position", dependencies=deps)
-    def get_task_position(id: str):
-        task = task_manager.get_task(id)
+    async def get_task_position(id: str):
+        task = await astore.get_task(id)
         if task is None:
             return {"success": False, "message": "Task not found"}
 
-        position = None if task.status != TaskStatus.PENDING else task_manager.get_task_position(id)
+        position = None if task.status != TaskStatus.PENDING else await astore.get_task_position(id)
         return {"success": True, "data": {"status": task.status, "position": position}}
 
+    @app.get("/agent-scheduler/v1/task/{id}/events", dependencies=deps)
+    def get_task_events(id: str):
+        return {"success": True, "data": [event.to_json() for event in events.get_events(task_id=id)]}
+
     @app.put("/agent-scheduler/v1/task/{id}", dependencies=deps)
-    def update_task(id: str, body: UpdateTaskArgs):
-        task = task_manager.get_task(id)
-        if task is None:
-            return {"success": False, "message": "Task not found"}
+    async def update_task(id: str, body: UpdateTaskArgs):
+        task = await astore.get_task(id)
+        if task is None or task.archived:
+            return await task_not_changed(id)
 
         should_save = False
         if body.name is not None:
@@ -304,26 +392,32 @@ def regsiter_apis(app: App, task_runner: TaskRunner):
             should_save = True
 
         if should_save:
-            task_manager.update_task(task)
+            await astore.update_task(task)
+            events.append(id, TaskEventType.UPDATED)
 
         return {"success": True, "message": "Task updated."}
 
     @app.post("/agent-scheduler/v1/run/{id}", dependencies=deps, deprecated=True)
     @app.post("/agent-scheduler/v1/task/{id}/run", dependencies=deps)
-    def run_task(id: str):
+    async def run_task(id: str):
         if progress.current_task is not None:
             if progress.current_task == id:
                 return {"success": False, "message": "Task is running"}
             else:
                 # move task up in queue
-                task_manager.prioritize_task(id, 0)
+                await astore.prioritize_task(id, 0)
+                events.append(id, TaskEventType.MOVED, "top")
                 return {
                     "success": True,
                     "message": "Task is scheduled to run next",
                 }
         else:
             # run task
-            task = task_manager.get_task(id)
+            task = await astore.claim_task(id)
+            if task is None:
+                return {"success": False, "message": "Task is not pending"}
+            events.append(id, TaskEventType.CLAIMED)
+
             current_thread = threading.Thread(
                 target=TaskRunner.instance.execute_task,
                 args=(
@@ -338,8 +432,8 @@ def regsiter_apis(app: App, task_runner: TaskRunner):
 
     @app.post("/agent-scheduler/v1/requeue/{id}", dependencies=deps, deprecated=True)
     @app.post("/agent-scheduler/v1/task/{id}/requeue", dependencies=deps)
-    def requeue_task(id: str):
-        task = task_manager.get_task(id)
+    async def requeue_task(id: str):
+        task = await astore.get_task(id)
         if task is None:
             return {"success": False, "message": "Task not found"}
 
@@ -347,95 +441,109 @@ def regsiter_apis(app: App, task_runner: TaskRunner):
         task.result = None
         task.status = TaskStatus.PENDING
         task.bookmarked = False
+        task.archived = False
         task.name = f"Copy of {task.name}" if task.name else None
-        task_manager.add_task(task)
-        task_runner.execute_pending_tasks_threading()
+        await astore.add_task(task)
+        # the copy remembers where it came from
+        events.append(task.id, TaskEventType.QUEUED, id)
+        # claims the next task with the sync store
+        await run_blocking(task_runner.execute_pending_tasks_threading)
 
         return {"success": True, "message": "Task requeued"}
 
     @app.post("/agent-scheduler/v1/task/requeue-failed", dependencies=deps)
-    def requeue_failed_tasks():
-        failed_tasks = task_manager.get_tasks(status=TaskStatus.FAILED)
+    async def requeue_failed_tasks():
+        failed_tasks = await astore.get_tasks(status=TaskStatus.FAILED, load_payload=False)
         if (len(failed_tasks)) == 0:
             return {"success": False, "message": "No failed tasks"}
 
-        for task in failed_tasks:
+        priority = int(datetime.now(timezone.utc).timestamp() * 1000)
+        for i, task in enumerate(failed_tasks):
             task.status = TaskStatus.PENDING
             task.result = None
-            task.priority = int(datetime.now(timezone.utc).timestamp() * 1000)
-            task_manager.update_task(task)
+            # keep the failed tasks in their original order
+            task.priority = priority + i
+
+        await astore.update_status_bulk(failed_tasks)
+        for task in failed_tasks:
+            events.append(task.id, TaskEventType.REQUEUED)
 
         return {"success": True, "message": f"Requeued {len(failed_tasks)} failed tasks"}
 
     @app.post("/agent-scheduler/v1/delete/{id}", dependencies=deps, deprecated=True)
     @app.delete("/agent-scheduler/v1/task/{id}", dependencies=deps)
-    def delete_task(id: str):
+    async def delete_task(id: str):
         if progress.current_task == id:
             shared.state.interrupt()
             task_runner.interrupted = id
             return {"success": True, "message": "Task interrupted"}
 
-        task_manager.delete_task(id)
+        task = await astore.get_task(id)
+        if task is None:
+            return {"success": False, "message": "Task not found"}
+
+        if task.archived:
+            await run_blocking(archive.delete_task, id)
+        else:
+            await astore.delete_task(id)
+        events.append(id, TaskEventType.DELETED)
         return {"success": True, "message": "Task deleted"}
 
     @app.post("/agent-scheduler/v1/move/{id}/{over_id}", dependencies=deps, deprecated=True)
     @app.post("/agent-scheduler/v1/task/{id}/move/{over_id}", dependencies=deps)
-    def move_task(id: str, over_id: str):
-        task = task_manager.get_task(id)
-        if task is None:
-            return {"success": False, "message": "Task not found"}
+    async def move_task(id: str, over_id: str):
+        task = await astore.get_task(id)
+        if task is None or task.archived:
+            return await task_not_changed(id)
 
         if over_id == "top":
-            task_manager.prioritize_task(id, 0)
+            await astore.prioritize_task(id, 0)
+            events.append(id, TaskEventType.MOVED, "top")
             return {"success": True, "message": "Task moved to top"}
         elif over_id == "bottom":
-            task_manager.prioritize_task(id, -1)
+            await astore.prioritize_task(id, -1)
+            events.append(id, TaskEventType.MOVED, "bottom")
             return {"success": True, "message": "Task moved to bottom"}
         else:
-            over_task = task_manager.get_task(over_id)
-            if over_task is None:
+            over_task = await astore.get_task(over_id)
+            if over_task is None or over_task.archived:
                 return {"success": False, "message": "Task not found"}
 
-            task_manager.prioritize_task(id, over_task.priority)
+            await astore.prioritize_task(id, over_task.priority)
+            events.append(id, TaskEventType.MOVED, over_id)
             return {"success": True, "message": "Task moved"}
 
     @app.post("/agent-scheduler/v1/bookmark/{id}", dependencies=deps, deprecated=True)
     @app.post("/agent-scheduler/v1/task/{id}/bookmark", dependencies=deps)
-    def pin_task(id: str):
-        task = task_manager.get_task(id)
-        if task is None:
-            return {"success": False, "message": "Task not found"}
+    async def pin_task(id: str):
+        if not await astore.set_bookmark(id, True):
+            return await task_not_changed(id)
 
-        task.bookmarked = True
-        task_manager.update_task(task)
+        events.append(id, TaskEventType.BOOKMARKED)
         return {"success": True, "message": "Task bookmarked"}
 
     @app.post("/agent-scheduler/v1/unbookmark/{id}", dependencies=deps, deprecated=True)
     @app.post("/agent-scheduler/v1/task/{id}/unbookmark")
-    def unpin_task(id: str):
-        task = task_manager.get_task(id)
-        if task is None:
-            return {"success": False, "message": "Task not found"}
+    async def unpin_task(id: str):
+        if not await astore.set_bookmark(id, False):
+            return await task_not_changed(id)
 
-        task.bookmarked = False
-        task_manager.update_task(task)
+        events.append(id, TaskEventType.UNBOOKMARKED)
         return {"success": True, "message": "Task unbookmarked"}
 
     @app.post("/agent-scheduler/v1/rename/{id}", dependencies=deps, deprecated=True)
     @app.post("/agent-scheduler/v1/task/{id}/rename", dependencies=deps)
-    def rename_task(id: str, name: str):
-        task = task_manager.get_task(id)
-        if task is None:
-            return {"success": False, "message": "Task not found"}
+    async def rename_task(id: str, name: str):
+        if not await astore.rename(id, name):
+            return await task_not_changed(id)
 
-        task.name = name
-        task_manager.update_task(task)
+        events.append(id, TaskEventType.RENAMED, name)
         return {"success": True, "message": "Task renamed."}
 
     @app.get("/agent-scheduler/v1/results/{id}", dependencies=deps, deprecated=True)
     @app.get("/agent-scheduler/v1/task/{id}/results", dependencies=deps)
     def get_task_results(id: str, zip: Optional[bool] = False):
-        task = task_manager.get_task(id)
+        task = store.get_task(id)
         if task is None:
             return {"success": False, "message": "Task not found"}
 
@@ -473,7 +581,7 @@ def regsiter_apis(app: App, task_runner: TaskRunner):
         else:
             data = [
                 {
-                    "image": encode_image_to_base64(Image.open(image)),
+                    "image": encode_image_file_to_base64(image),
                     "infotext": infotexts[i],
                 }
                 for i, image in enumerate(result["images"])
@@ -496,19 +604,22 @@ def regsiter_apis(app: App, task_runner: TaskRunner):
         return {"success": True, "message": "Queue resumed."}
 
     @app.post("/agent-scheduler/v1/queue/clear", dependencies=deps)
-    def clear_queue():
-        task_manager.delete_tasks(status=TaskStatus.PENDING)
+    async def clear_queue():
+        await astore.delete_tasks(status=TaskStatus.PENDING)
         return {"success": True, "message": "Queue cleared."}
 
     @app.post("/agent-scheduler/v1/history/clear", dependencies=deps)
-    def clear_history():
-        task_manager.delete_tasks(
+    async def clear_history():
+        await astore.delete_tasks(
             status=[
                 TaskStatus.DONE,
                 TaskStatus.FAILED,
                 TaskStatus.INTERRUPTED,
             ]
         )
+        # bookmarked tasks are never archived, nothing in the archive is kept
+        if archive is not None:
+            await run_blocking(archive.clear)
         return {"success": True, "message": "History cleared."}
 
     task_runner.on_task_finished(on_task_finished)
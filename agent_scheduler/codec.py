@@ -0,0 +1,374 @@
+"""
+Binary format of the task script args (Task.script_params)
+
+    magic | u8 version | u32 buffer count | buffer table | u32 body length | body | padding | buffers
+
+The body is the args tree in a msgpack-like tagged encoding. The data of arrays, tensors and images is not
+inlined in the body but stored out-of-band after it, every buffer 64-byte aligned, so decoding maps numpy and
+torch arrays onto the payload instead of copying them. A buffer table entry is
+(u8 codec, u64 offset from the first buffer, u64 stored length, u64 raw length).
+
+Rows written before this format are zlib compressed pickles, decode_script_args still reads them.
+"""
+
+import io
+import zlib
+import importlib
+import pickle
+import struct
+from enum import Enum
+from typing import Any, Union, List, Tuple
+
+import numpy as np
+import torch
+from PIL import Image
+
+MAGIC = b"ASSA"
+VERSION = 1
+ALIGNMENT = 64
+
+# buffer codecs
+CODEC_RAW = 0
+CODEC_ZLIB = 1
+
+# buffers smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+
+# value tags
+TAG_NONE = 0x00
+TAG_FALSE = 0x01
+TAG_TRUE = 0x02
+TAG_INT = 0x03
+TAG_BIGINT = 0x04
+TAG_FLOAT = 0x05
+TAG_STR = 0x06
+TAG_BYTES = 0x07
+TAG_LIST = 0x08
+TAG_TUPLE = 0x09
+TAG_DICT = 0x0A
+TAG_NDARRAY = 0x0B
+TAG_TENSOR = 0x0C
+TAG_IMAGE = 0x0D
+TAG_CNET = 0x0E
+TAG_PICKLE = 0x0F
+TAG_ENUM = 0x10
+
+_u8 = struct.Struct("<B")
+_u32 = struct.Struct("<I")
+_i64 = struct.Struct("<q")
+_u64 = struct.Struct("<Q")
+_f64 = struct.Struct("<d")
+_buffer_entry = struct.Struct("<BQQQ")
+_header = struct.Struct("<4sBI")
+
+
+class ScriptArgsDecodeError(Exception):
+    pass
+
+
+def is_legacy_script_args(data: bytes) -> bool:
+    return bytes(data[: len(MAGIC)]) != MAGIC
+
+
+def encode_script_args(script_args: List, compress_level: int = 1) -> bytes:
+    """Encode script args, compress_level 0 stores the buffers uncompressed"""
+
+    encoder = _Encoder()
+    encoder.write(script_args)
+
+    table = bytearray()
+    buffers: List[bytes] = []
+    offset = 0
+    for buffer in encoder.buffers:
+        raw_length = len(buffer)
+        codec = CODEC_RAW
+        if compress_level > 0 and raw_length >= MIN_COMPRESS_SIZE:
+            compressed = zlib.compress(buffer, compress_level)
+            # pixels that don't compress are kept raw, they decode without a copy
+            if len(compressed) < raw_length * 0.9:
+                codec, buffer = CODEC_ZLIB, compressed
+
+        table += _buffer_entry.pack(codec, offset, len(buffer), raw_length)
+        padding = -len(buffer) % ALIGNMENT
+        buffers.append(buffer)
+        buffers.append(b"\0" * padding)
+        offset += len(buffer) + padding
+
+    head = _header.pack(MAGIC, VERSION, len(encoder.buffers)) + table + _u32.pack(len(encoder.body)) + encoder.body
+    return b"".join([head, b"\0" * (-len(head) % ALIGNMENT)] + buffers)
+
+
+def decode_script_args(data: Union[bytes, bytearray, memoryview], trusted: bool = True) -> List:
+    """
+    Decode script args in the current or the legacy format
+    `trusted=False` is for payloads from elsewhere (imported queues), their pickled values may only hold plain
+    containers, numbers, strings and arrays
+    """
+
+    if is_legacy_script_args(data):
+        raw = zlib.decompress(data)
+        return pickle.loads(raw) if trusted else restricted_loads(raw)
+
+    # arrays are views into this copy, writable like the unpickled ones used to be
+    payload = memoryview(bytearray(data))
+    magic, version, buffer_count = _header.unpack_from(payload, 0)
+    if version > VERSION:
+        raise ScriptArgsDecodeError(f"Script args format version {version} is newer than supported {VERSION}")
+
+    position = _header.size
+    entries = []
+    for _ in range(buffer_count):
+        entries.append(_buffer_entry.unpack_from(payload, position))
+        position += _buffer_entry.size
+
+    (body_length,) = _u32.unpack_from(payload, position)
+    position += _u32.size
+    body = payload[position : position + body_length]
+    position += body_length
+    buffers_start = position + (-position % ALIGNMENT)
+
+    buffers = []
+    for codec, offset, stored_length, raw_length in entries:
+        start = buffers_start + offset
+        buffer = payload[start : start + stored_length]
+        if codec == CODEC_ZLIB:
+            buffer = memoryview(bytearray(zlib.decompress(buffer)))
+        elif codec != CODEC_RAW:
+            raise ScriptArgsDecodeError(f"Unknown script args buffer codec {codec}")
+        if len(buffer) != raw_length:
+            raise ScriptArgsDecodeError("Script args buffer has the wrong length")
+        buffers.append(buffer)
+
+    return _Decoder(body, buffers, trusted).read()
+
+
+# globals the restricted unpickler may load, enough for the script args the legacy format stored
+_safe_globals = {
+    ("builtins", "dict"),
+    ("builtins", "list"),
+    ("builtins", "tuple"),
+    ("builtins", "set"),
+    ("builtins", "frozenset"),
+    ("builtins", "bytearray"),
+    ("builtins", "bytes"),
+    ("builtins", "str"),
+    ("builtins", "int"),
+    ("builtins", "float"),
+    ("builtins", "bool"),
+    ("builtins", "complex"),
+    ("builtins", "slice"),
+    ("builtins", "object"),
+    ("collections", "OrderedDict"),
+    ("copyreg", "_reconstructor"),
+    ("numpy", "ndarray"),
+    ("numpy", "dtype"),
+    ("numpy.core.multiarray", "_reconstruct"),
+    ("numpy.core.multiarray", "scalar"),
+    ("numpy._core.multiarray", "_reconstruct"),
+    ("numpy._core.multiarray", "scalar"),
+    ("PIL.Image", "Image"),
+}
+
+
+class _RestrictedUnpickler(pickle.Unpickler):
+    def find_class(self, module: str, name: str):
+        if (module, name) in _safe_globals or (module == "numpy" and name.endswith("DType")):
+            return super().find_class(module, name)
+
+        raise pickle.UnpicklingError(f"Refusing to load {module}.{name} from untrusted script args")
+
+
+def restricted_loads(data: bytes) -> Any:
+    return _RestrictedUnpickler(io.BytesIO(data)).load()
+
+
+def _load_enum(module: str, qualname: str, value: Any) -> Any:
+    # members of enums the running webui no longer has decode to their value
+    try:
+        cls = importlib.import_module(module)
+        for name in qualname.split("."):
+            cls = getattr(cls, name)
+        if isinstance(cls, type) and issubclass(cls, Enum):
+            return cls(value)
+    except Exception:
+        pass
+
+    return value
+
+
+class _Encoder:
+    def __init__(self):
+        self.body = bytearray()
+        self.buffers: List[Union[bytes, memoryview]] = []
+
+    def write(self, value: Any):
+        body = self.body
+        if value is None:
+            body += _u8.pack(TAG_NONE)
+        elif value is True:
+            body += _u8.pack(TAG_TRUE)
+        elif value is False:
+            body += _u8.pack(TAG_FALSE)
+        elif isinstance(value, Enum):
+            # by class and value, the member comes back instead of its bare value
+            body += _u8.pack(TAG_ENUM)
+            self.__write_str(type(value).__module__)
+            self.__write_str(type(value).__qualname__)
+            self.write(value.value)
+        elif isinstance(value, int):
+            if -(2**63) <= value < 2**63:
+                body += _u8.pack(TAG_INT) + _i64.pack(value)
+            else:
+                self.__write_sized(TAG_BIGINT, str(value).encode("ascii"))
+        elif isinstance(value, float):
+            body += _u8.pack(TAG_FLOAT) + _f64.pack(value)
+        elif isinstance(value, str):
+            self.__write_sized(TAG_STR, value.encode("utf-8", "surrogatepass"))
+        elif isinstance(value, (bytes, bytearray)):
+            self.__write_sized(TAG_BYTES, bytes(value))
+        elif isinstance(value, (list, tuple)) and type(value) in (list, tuple):
+            body += _u8.pack(TAG_LIST if type(value) is list else TAG_TUPLE) + _u32.pack(len(value))
+            for item in value:
+                self.write(item)
+        elif type(value) is dict:
+            self.__write_dict(TAG_DICT, value)
+        elif isinstance(value, np.ndarray) and not value.dtype.hasobject:
+            array = value if value.flags.c_contiguous else np.ascontiguousarray(value)
+            body += _u8.pack(TAG_NDARRAY)
+            self.__write_str(array.dtype.str)
+            self.__write_shape(value.shape)
+            self.__write_buffer(array.reshape(-1).view(np.uint8).data if array.size else b"")
+        elif isinstance(value, np.generic) and not isinstance(value, np.object_):
+            self.write(value.item())
+        elif isinstance(value, torch.Tensor):
+            tensor = value.detach().cpu().contiguous()
+            body += _u8.pack(TAG_TENSOR)
+            self.__write_str(str(tensor.dtype).replace("torch.", ""))
+            self.__write_str(value.device.type)
+            self.__write_shape(tuple(tensor.shape))
+            self.__write_buffer(tensor.reshape(-1).view(torch.uint8).numpy().data if tensor.numel() else b"")
+        elif isinstance(value, Image.Image):
+            body += _u8.pack(TAG_IMAGE)
+            self.__write_str(value.mode)
+            self.__write_shape(value.size)
+            self.write(value.getpalette() if value.mode == "P" else None)
+            self.__write_buffer(value.tobytes())
+        elif type(value).__name__ == "UiControlNetUnit":
+            self.__write_dict(TAG_CNET, value.__dict__)
+        else:
+            # anything else extensions put in their args, only trusted payloads load it back
+            self.__write_sized(TAG_PICKLE, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def __write_sized(self, tag: int, data: bytes):
+        self.body += _u8.pack(tag) + _u32.pack(len(data)) + data
+
+    def __write_str(self, value: str):
+        data = value.encode("utf-8")
+        self.body += _u32.pack(len(data)) + data
+
+    def __write_shape(self, shape: Tuple[int, ...]):
+        self.body += _u8.pack(len(shape)) + b"".join(_u64.pack(dim) for dim in shape)
+
+    def __write_buffer(self, buffer: Union[bytes, memoryview]):
+        self.body += _u32.pack(len(self.buffers))
+        self.buffers.append(buffer)
+
+    def __write_dict(self, tag: int, value: dict):
+        self.body += _u8.pack(tag) + _u32.pack(len(value))
+        for key, item in value.items():
+            self.write(key)
+            self.write(item)
+
+
+class _Decoder:
+    def __init__(self, body: memoryview, buffers: List[memoryview], trusted: bool):
+        self.body = body
+        self.buffers = buffers
+        self.trusted = trusted
+        self.position = 0
+
+    def read(self) -> Any:
+        tag = self.__unpack(_u8)
+        if tag == TAG_NONE:
+            return None
+        if tag == TAG_FALSE:
+            return False
+        if tag == TAG_TRUE:
+            return True
+        if tag == TAG_INT:
+            return self.__unpack(_i64)
+        if tag == TAG_BIGINT:
+            return int(self.__read_sized().decode("ascii"))
+        if tag == TAG_FLOAT:
+            return self.__unpack(_f64)
+        if tag == TAG_STR:
+            return self.__read_sized().decode("utf-8", "surrogatepass")
+        if tag == TAG_BYTES:
+            return self.__read_sized()
+        if tag == TAG_LIST:
+            return [self.read() for _ in range(self.__unpack(_u32))]
+        if tag == TAG_TUPLE:
+            return tuple(self.read() for _ in range(self.__unpack(_u32)))
+        if tag == TAG_DICT:
+            return self.__read_dict()
+        if tag == TAG_NDARRAY:
+            dtype = np.dtype(self.__read_str())
+            shape = self.__read_shape()
+            return np.frombuffer(self.__read_buffer(), dtype=dtype).reshape(shape)
+        if tag == TAG_TENSOR:
+            dtype = getattr(torch, self.__read_str())
+            device = self.__read_str()
+            shape = self.__read_shape()
+            buffer = self.__read_buffer()
+            tensor = torch.frombuffer(buffer, dtype=dtype) if len(buffer) else torch.empty(0, dtype=dtype)
+            return tensor.reshape(shape).to(device=device)
+        if tag == TAG_IMAGE:
+            mode = self.__read_str()
+            size = self.__read_shape()
+            palette = self.read()
+            image = Image.frombytes(mode, size, self.__read_buffer())
+            if palette is not None:
+                image.putpalette(palette)
+            return image
+        if tag == TAG_CNET:
+            # same dict serialize_controlnet_args used to produce, deserialize_script_args builds the unit
+            unit = self.__read_dict()
+            unit["is_cnet"] = True
+            return unit
+        if tag == TAG_PICKLE:
+            data = self.__read_sized()
+            return pickle.loads(data) if self.trusted else restricted_loads(data)
+        if tag == TAG_ENUM:
+            module = self.__read_str()
+            qualname = self.__read_str()
+            value = self.read()
+            # untrusted payloads don't get to import modules, they keep the value
+            return _load_enum(module, qualname, value) if self.trusted else value
+
+        raise ScriptArgsDecodeError(f"Unknown script args value tag {tag}")
+
+    def __unpack(self, fmt: struct.Struct):
+        (value,) = fmt.unpack_from(self.body, self.position)
+        self.position += fmt.size
+        return value
+
+    def __read_sized(self) -> bytes:
+        length = self.__unpack(_u32)
+        data = bytes(self.body[self.position : self.position + length])
+        self.position += length
+        return data
+
+    def __read_str(self) -> str:
+        length = self.__unpack(_u32)
+        data = bytes(self.body[self.position : self.position + length])
+        self.position += length
+        return data.decode("utf-8")
+
+    def __read_shape(self) -> Tuple[int, ...]:
+        return tuple(self.__unpack(_u64) for _ in range(self.__unpack(_u8)))
+
+    def __read_buffer(self) -> memoryview:
+        return self.buffers[self.__unpack(_u32)]
+
+    def __read_dict(self) -> dict:
+        return {self.read(): self.read() for _ in range(self.__unpack(_u32))}
@@ -1,76 +1,58 @@
-from pathlib import Path
-from sqlalchemy import create_engine, inspect, text, String, Text
-
-from .base import Base, metadata, db_file
+from .base import (
+    Base,
+    metadata,
+    db_file,
+    memory_store,
+    create_sqlite_engine,
+    create_memory_engine,
+    get_engine,
+    get_async_engine,
+    incremental_vacuum,
+)
 from .app_state import AppStateKey, AppState, AppStateManager
-from .task import TaskStatus, Task, TaskManager
-
-version = "2"
+from .blob import BlobTable, BlobManager, get_blob_refs, get_sidecar_path
+from .task import (
+    TaskStatus,
+    Task,
+    TaskTable,
+    TaskManager,
+    encode_task_cursor,
+    decode_task_cursor,
+)
+from .store import TaskStore
+from .memory import MemoryTaskManager
+from .aio import AsyncTaskStore, run_blocking
+from .archive import TaskArchive, archive_dir
+from .event import TaskEventType, TaskEvent, TaskEventTable, TaskEventLog
+from .migrations import version, migrate
 
 state_manager = AppStateManager()
-task_manager = TaskManager()
-
-
-def init():
-    engine = create_engine(f"sqlite:///{db_file}")
-
-    metadata.create_all(engine)
+task_archive = TaskArchive(archive_dir)
+task_manager = TaskManager(archive=task_archive)
+blob_manager = BlobManager()
+task_event_log = TaskEventLog()
 
-    state_manager.set_value(AppStateKey.Version, version)
-    # check if app state exists
-    if state_manager.get_value(AppStateKey.QueueState) is None:
-        # create app state
-        state_manager.set_value(AppStateKey.QueueState, "running")
+# the store used by the runner and the api, see --agent-scheduler-task-store
+task_store: TaskStore = MemoryTaskManager(blobs=blob_manager) if memory_store else task_manager
 
-    inspector = inspect(engine)
-    with engine.connect() as conn:
-        task_columns = inspector.get_columns("task")
-        # add result column
-        if not any(col["name"] == "result" for col in task_columns):
-            conn.execute(text("ALTER TABLE task ADD COLUMN result TEXT"))
 
-        # add api_task_id column
-        if not any(col["name"] == "api_task_id" for col in task_columns):
-            conn.execute(text("ALTER TABLE task ADD COLUMN api_task_id VARCHAR(64)"))
-
-        # add api_task_callback column
-        if not any(col["name"] == "api_task_callback" for col in task_columns):
-            conn.execute(text("ALTER TABLE task ADD COLUMN api_task_callback VARCHAR(255)"))
+def init():
+    engine = get_engine()
 
-        # add name column
-        if not any(col["name"] == "name" for col in task_columns):
-            conn.execute(text("ALTER TABLE task ADD COLUMN name VARCHAR(255)"))
+    if memory_store:
+        # a fresh in-memory database for the blobs and events, nothing to migrate, release or collect
+        metadata.create_all(engine)
+        return
 
-        # add bookmarked column
-        if not any(col["name"] == "bookmarked" for col in task_columns):
-            conn.execute(text("ALTER TABLE task ADD COLUMN bookmarked BOOLEAN DEFAULT FALSE"))
+    # schema changes live in migrations.py, nothing is reflected once the stored schema version is current
+    migrate(engine)
 
-        params_column = next(col for col in task_columns if col["name"] == "params")
-        if version > "1" and not isinstance(params_column["type"], Text):
-            transaction = conn.begin()
-            conn.execute(
-                text(
-                    """
-                    CREATE TABLE task_temp (
-                        id VARCHAR(64) NOT NULL,
-                        type VARCHAR(20) NOT NULL,
-                        params TEXT NOT NULL,
-                        script_params BLOB NOT NULL,
-                        priority INTEGER NOT NULL,
-                        status VARCHAR(20) NOT NULL,
-                        created_at DATETIME DEFAULT (datetime('now')) NOT NULL,
-                        updated_at DATETIME DEFAULT (datetime('now')) NOT NULL,
-                        result TEXT,
-                        PRIMARY KEY (id)
-                    )"""
-                )
-            )
-            conn.execute(text("INSERT INTO task_temp SELECT * FROM task"))
-            conn.execute(text("DROP TABLE task"))
-            conn.execute(text("ALTER TABLE task_temp RENAME TO task"))
-            transaction.commit()
+    # tasks left running by a runner that is gone (e.g. before a restart) go back to the queue,
+    # the ones another live runner is executing stay claimed
+    task_store.release_running_tasks()
 
-        conn.close()
+    # blobs released by deleted tasks, or stored for tasks that never got saved
+    blob_manager.delete_unreferenced()
 
 
 __all__ = [
@@ -78,10 +60,31 @@ __all__ = [
     "Base",
     "metadata",
     "db_file",
+    "memory_store",
+    "create_sqlite_engine",
+    "create_memory_engine",
+    "get_engine",
+    "get_async_engine",
+    "incremental_vacuum",
     "AppStateKey",
     "AppState",
     "TaskStatus",
     "Task",
+    "TaskStore",
+    "MemoryTaskManager",
+    "AsyncTaskStore",
+    "run_blocking",
+    "TaskArchive",
+    "TaskEventType",
+    "TaskEvent",
+    "encode_task_cursor",
+    "decode_task_cursor",
     "task_manager",
+    "task_store",
+    "task_archive",
+    "blob_manager",
+    "task_event_log",
+    "get_blob_refs",
+    "get_sidecar_path",
     "state_manager",
 ]
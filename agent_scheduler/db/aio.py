@@ -0,0 +1,93 @@
+import asyncio
+import functools
+from datetime import datetime
+from typing import Optional, Union, List
+
+from .base import get_async_engine
+from .task import Task, TaskManager
+from .store import TaskStore
+from .memory import MemoryTaskManager
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run blocking work on the default executor, outside the threadpool serving the sync routes"""
+
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(fn, *args, **kwargs))
+
+
+# TaskManager methods that only run queries, run_sync executes everything else they do on the event loop thread.
+# The others update the pending index, whose lock is held while it reloads from the database, or start threads,
+# so they always go to the executor
+sql_only_methods = {"get_task", "get_tasks", "count_tasks"}
+
+
+class AsyncTaskStore:
+    """
+    Awaitable TaskStore methods for the api routes
+    A TaskManager runs the queries of sql_only_methods on a connection of the aiosqlite engine, so waiting on the
+    database takes no worker thread; other methods, or all without aiosqlite, run on the default executor.
+    The memory store is called directly.
+    """
+
+    def __init__(self, store: TaskStore, engine=None):
+        self.store = store
+        self.engine = engine if engine is not None else get_async_engine()
+
+    async def get_task(self, id: str) -> Union[Task, None]:
+        task = await self.__call("get_task", id)
+        archive = getattr(self.store, "archive", None)
+        if task is None and archive is not None:
+            # gzip segments, never read on the event loop
+            task = await run_blocking(archive.get_task, id)
+
+        return task
+
+    async def get_task_position(self, id: str) -> int:
+        return await self.__call("get_task_position", id)
+
+    async def get_tasks(self, **kwargs) -> List[Task]:
+        return await self.__call("get_tasks", **kwargs)
+
+    async def count_tasks(self, **kwargs) -> int:
+        return await self.__call("count_tasks", **kwargs)
+
+    async def claim_task(self, id: str) -> Union[Task, None]:
+        return await self.__call("claim_task", id)
+
+    async def add_task(self, task: Task) -> Task:
+        return await self.__call("add_task", task)
+
+    async def upsert_tasks(self, tasks: List[Task]) -> List[Task]:
+        return await self.__call("upsert_tasks", tasks)
+
+    async def update_status_bulk(self, tasks: List[Task]) -> int:
+        return await self.__call("update_status_bulk", tasks)
+
+    async def update_task(self, task: Task) -> Task:
+        return await self.__call("update_task", task)
+
+    async def set_bookmark(self, id: str, bookmarked: bool) -> bool:
+        return await self.__call("set_bookmark", id, bookmarked)
+
+    async def rename(self, id: str, name: Optional[str]) -> bool:
+        return await self.__call("rename", id, name)
+
+    async def prioritize_task(self, id: str, priority: int) -> Task:
+        return await self.__call("prioritize_task", id, priority)
+
+    async def delete_task(self, id: str):
+        return await self.__call("delete_task", id)
+
+    async def delete_tasks(self, before: datetime = None, **kwargs) -> int:
+        return await self.__call("delete_tasks", before=before, **kwargs)
+
+    async def __call(self, name: str, *args, **kwargs):
+        if isinstance(self.store, MemoryTaskManager):
+            return getattr(self.store, name)(*args, **kwargs)
+
+        if self.engine is not None and isinstance(self.store, TaskManager) and name in sql_only_methods:
+            # run_sync executes the sync method in a greenlet, its queries are awaited on the aiosqlite connection
+            async with self.engine.connect() as conn:
+                return await conn.run_sync(lambda sync_conn: getattr(self.store.bind(sync_conn), name)(*args, **kwargs))
+
+        return await run_blocking(getattr(self.store, name), *args, **kwargs)
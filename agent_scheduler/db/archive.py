@@ -0,0 +1,218 @@
+import os
+import json
+import gzip
+import threading
+from datetime import datetime, timezone
+from typing import Union, List, Dict
+
+from modules import scripts
+from modules import shared
+
+from .task import Task, decode_task_cursor, get_task_summary
+
+archive_dir = getattr(shared.cmd_opts, "agent_scheduler_archive_dir", None) or "task_archive"
+if not os.path.isabs(archive_dir):
+    archive_dir = os.path.join(scripts.basedir(), archive_dir)
+
+
+class TaskArchive:
+    """
+    Append-only monthly segments of archived tasks
+    `<month>.jsonl.gz` holds one gzip member per task (Task.to_json), `<month>.idx.jsonl` is its sidecar index
+    with the member offset and the fields needed to filter and sort without opening the segment
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.__lock = threading.Lock()
+        self.__entries: Dict[str, Dict] = None
+        self.__sorted_entries: List[Dict] = None
+
+    def append(self, tasks: List[Dict]):
+        """Write Task.to_json() dicts, synced to disk before returning so the caller can delete the rows"""
+
+        if len(tasks) == 0:
+            return
+
+        by_segment: Dict[str, List[Dict]] = {}
+        for task in tasks:
+            created_at = datetime.fromtimestamp(task["created_at"], timezone.utc)
+            by_segment.setdefault(created_at.strftime("%Y-%m"), []).append(task)
+
+        with self.__lock:
+            os.makedirs(self.directory, exist_ok=True)
+            for segment, segment_tasks in by_segment.items():
+                entries = []
+                with open(self.__segment_path(segment), "ab") as f:
+                    for task in segment_tasks:
+                        offset = f.tell()
+                        f.write(gzip.compress(json.dumps(task).encode("utf-8")))
+                        entries.append(
+                            {
+                                "id": task["id"],
+                                "segment": segment,
+                                "offset": offset,
+                                "length": f.tell() - offset,
+                                "type": task["type"],
+                                "status": task["status"],
+                                "priority": task["priority"],
+                            }
+                        )
+                    f.flush()
+                    os.fsync(f.fileno())
+
+                # the index is written last, a crash in between only leaves unreachable bytes in the segment
+                with open(self.__index_path(segment), "a", encoding="utf-8") as f:
+                    f.writelines(json.dumps(entry) + "\n" for entry in entries)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+                if self.__entries is not None:
+                    for entry in entries:
+                        self.__entries[entry["id"]] = entry
+                    self.__sorted_entries = None
+
+    def has_task(self, id: str) -> bool:
+        return id in self.__get_entries()
+
+    def get_task(self, id: str) -> Union[Task, None]:
+        entry = self.__get_entries().get(id, None)
+        return self.__read_task(entry) if entry else None
+
+    def delete_task(self, id: str) -> bool:
+        """Hide an archived task behind a tombstone in its index, False if it is not archived"""
+
+        entries = self.__get_entries()
+        with self.__lock:
+            entry = entries.pop(id, None)
+            if entry is None:
+                return False
+
+            self.__sorted_entries = None
+            # the segment is append-only, its bytes stay until clear
+            with open(self.__index_path(entry["segment"]), "a", encoding="utf-8") as f:
+                f.write(json.dumps({"id": id, "segment": entry["segment"], "deleted": True}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+            return True
+
+    def clear(self) -> int:
+        """Delete all segments, return the number of archived tasks they held"""
+
+        entries = self.__get_entries()
+        with self.__lock:
+            count = len(entries)
+            if os.path.isdir(self.directory):
+                for file in os.listdir(self.directory):
+                    if file.endswith(".jsonl.gz") or file.endswith(".idx.jsonl"):
+                        os.remove(os.path.join(self.directory, file))
+
+            self.__entries = {}
+            self.__sorted_entries = None
+            return count
+
+    def get_tasks(
+        self,
+        type: str = None,
+        status: Union[str, List[str]] = None,
+        limit: int = None,
+        offset: int = None,
+        order: str = "asc",
+        cursor: str = None,
+        load_payload: bool = True,
+    ) -> List[Task]:
+        """List archived tasks ordered by priority and id, paged like TaskManager.get_tasks"""
+
+        entries = self.__get_sorted_entries()
+        if order != "asc":
+            entries = entries[::-1]
+
+        entries = [entry for entry in entries if self.__matches(entry, type, status)]
+
+        if cursor:
+            _, priority, id = decode_task_cursor(cursor)
+            if order == "asc":
+                entries = [entry for entry in entries if (entry["priority"], entry["id"]) > (priority, id)]
+            else:
+                entries = [entry for entry in entries if (entry["priority"], entry["id"]) < (priority, id)]
+        elif offset:
+            entries = entries[offset:]
+
+        if limit:
+            entries = entries[:limit]
+
+        tasks = [self.__read_task(entry) for entry in entries]
+        if load_payload:
+            return tasks
+
+        return [
+            task.copy(update={"params": "{}", "script_params": None, "summary": get_task_summary(task.params)})
+            for task in tasks
+        ]
+
+    def count_tasks(self, type: str = None, status: Union[str, List[str]] = None) -> int:
+        return len([entry for entry in self.__get_sorted_entries() if self.__matches(entry, type, status)])
+
+    def __get_entries(self) -> Dict[str, Dict]:
+        # loaded once, append keeps it up to date
+        with self.__lock:
+            if self.__entries is None:
+                self.__entries = self.__load_entries()
+
+            return self.__entries
+
+    def __get_sorted_entries(self) -> List[Dict]:
+        entries = self.__get_entries()
+        with self.__lock:
+            if self.__sorted_entries is None:
+                self.__sorted_entries = sorted(entries.values(), key=lambda e: (e["priority"], e["id"]))
+
+            return self.__sorted_entries
+
+    def __load_entries(self) -> Dict[str, Dict]:
+        entries = {}
+        if not os.path.isdir(self.directory):
+            return entries
+
+        for file in sorted(os.listdir(self.directory)):
+            if not file.endswith(".idx.jsonl"):
+                continue
+
+            with open(os.path.join(self.directory, file), "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except Exception:
+                        # torn write at the end of the index
+                        continue
+                    if entry.get("deleted", False):
+                        entries.pop(entry["id"], None)
+                        continue
+                    # a task archived twice (e.g. crash before its row was deleted) keeps the latest copy
+                    entries[entry["id"]] = entry
+
+        return entries
+
+    def __read_task(self, entry: Dict) -> Task:
+        with open(self.__segment_path(entry["segment"]), "rb") as f:
+            f.seek(entry["offset"])
+            data = gzip.decompress(f.read(entry["length"]))
+
+        return Task.from_json(json.loads(data)).copy(update={"archived": True})
+
+    def __matches(self, entry: Dict, type: str, status: Union[str, List[str]]) -> bool:
+        if type and entry["type"] != type:
+            return False
+        if status is not None:
+            if isinstance(status, list):
+                return entry["status"] in status
+            return entry["status"] == status
+
+        return True
+
+    def __segment_path(self, segment: str) -> str:
+        return os.path.join(self.directory, f"{segment}.jsonl.gz")
+
+    def __index_path(self, segment: str) -> str:
+        return os.path.join(self.directory, f"{segment}.idx.jsonl")
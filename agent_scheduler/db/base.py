@@ -1,8 +1,12 @@
 import os
+import time
+import threading
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.schema import MetaData
 from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import StaticPool
 
 from modules import scripts
 from modules import shared
@@ -16,17 +20,168 @@ if hasattr(shared.cmd_opts, "agent_scheduler_sqlite_file"):
 else:
     db_file = os.path.join(scripts.basedir(), "task_scheduler.sqlite3")
 
-print(f"Using sqlite file: {db_file}")
+# see --agent-scheduler-task-store, with the memory store nothing is written to disk
+memory_store: bool = getattr(shared.cmd_opts, "agent_scheduler_task_store", "sqlite") == "memory"
+
+if not memory_store:
+    print(f"Using sqlite file: {db_file}")
+
+# sqlite connection tuning, see preload.py for the matching command line options
+sqlite_journal_mode: str = getattr(shared.cmd_opts, "agent_scheduler_sqlite_journal_mode", "WAL")
+sqlite_synchronous: str = getattr(shared.cmd_opts, "agent_scheduler_sqlite_synchronous", "NORMAL")
+sqlite_busy_timeout: int = getattr(shared.cmd_opts, "agent_scheduler_sqlite_busy_timeout", 5000)
+sqlite_cache_size: int = getattr(shared.cmd_opts, "agent_scheduler_sqlite_cache_size", -16000)
+sqlite_mmap_size: int = getattr(shared.cmd_opts, "agent_scheduler_sqlite_mmap_size", 268435456)
 
 
 Base = declarative_base()
 metadata: MetaData = Base.metadata
 
+_engine: Engine = None
+_engine_lock = threading.Lock()
+# False once aiosqlite turned out to be missing
+_async_engine = None
+
+
+def _set_sqlite_pragmas(dbapi_connection, _connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        # only takes effect on new databases, and has to come before journal_mode=WAL
+        cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        cursor.execute(f"PRAGMA journal_mode={sqlite_journal_mode}")
+        cursor.execute(f"PRAGMA synchronous={sqlite_synchronous}")
+        cursor.execute(f"PRAGMA busy_timeout={int(sqlite_busy_timeout)}")
+        cursor.execute(f"PRAGMA cache_size={int(sqlite_cache_size)}")
+        cursor.execute(f"PRAGMA mmap_size={int(sqlite_mmap_size)}")
+    finally:
+        cursor.close()
+
+
+def create_sqlite_engine(file: str) -> Engine:
+    """New engine on `file` with the connection tuning applied, get_engine shares one on the configured file"""
+
+    engine = create_engine(
+        f"sqlite:///{file}",
+        connect_args={"timeout": sqlite_busy_timeout / 1000},
+    )
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+    return engine
+
+
+class SerializedStaticPool(StaticPool):
+    """
+    StaticPool that lends its one connection to one thread at a time
+    The runner, the api and the event log flusher all use the in-memory database, their transactions must not
+    interleave on the connection and commit or roll back each other's work
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # reentrant, a thread may check the connection out again while holding it
+        self.__lock = threading.RLock()
+
+    def _do_get(self):
+        self.__lock.acquire()
+        try:
+            return super()._do_get()
+        except BaseException:
+            self.__lock.release()
+            raise
+
+    def _do_return_conn(self, record):
+        try:
+            super()._do_return_conn(record)
+        finally:
+            self.__lock.release()
+
+
+def create_memory_engine() -> Engine:
+    """New engine on a private in-memory database, shared by all threads and gone when the process exits"""
+
+    return create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=SerializedStaticPool,
+    )
+
+
+def get_engine() -> Engine:
+    """Return the process-wide engine, creating it on first use."""
+
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_memory_engine() if memory_store else create_sqlite_engine(db_file)
+
+    return _engine
+
+
+def get_async_engine():
+    """Return the process-wide aiosqlite engine on the same file, or None if aiosqlite is not installed"""
+
+    global _async_engine
+    if memory_store:
+        # the in-memory database only exists on the sync engine's connection
+        return None
+
+    if _async_engine is None:
+        with _engine_lock:
+            if _async_engine is None:
+                try:
+                    from sqlalchemy.ext.asyncio import create_async_engine
+
+                    engine = create_async_engine(
+                        f"sqlite+aiosqlite:///{db_file}",
+                        connect_args={"timeout": sqlite_busy_timeout / 1000},
+                    )
+                except (ImportError, ValueError) as e:
+                    # aiosqlite or greenlet missing
+                    print(f"Async database access is not available: {e}")
+                    _async_engine = False
+                    return None
+
+                event.listen(engine.sync_engine, "connect", _set_sqlite_pragmas)
+                _async_engine = engine
+
+    return _async_engine or None
+
+
+def incremental_vacuum(engine: Engine = None, step_pages: int = 1000, pause: float = 0.05) -> int:
+    """Give free pages back to the filesystem in small steps, return the number of bytes reclaimed"""
+
+    engine = engine if engine else get_engine()
+    conn = engine.raw_connection()
+    try:
+        # without auto_vacuum=INCREMENTAL the pragma is a no-op and the free list never shrinks
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return 0
+
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        freelist_count = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        while freelist_count > 0:
+            # executescript steps the pragma to completion, execute would only free a single page
+            conn.executescript(f"PRAGMA incremental_vacuum({int(step_pages)})")
+            remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if remaining >= freelist_count:
+                # e.g. another connection holds a read transaction, try again on the next purge
+                break
+
+            freelist_count = remaining
+            # let other connections take the write lock between steps
+            time.sleep(pause)
+
+        return (page_count - conn.execute("PRAGMA page_count").fetchone()[0]) * page_size
+    finally:
+        conn.close()
+
+
 class BaseTableManager:
     def __init__(self, engine = None):
         # Get the db connection object, making the file and tables if needed.
         try:
-            self.engine = engine if engine else create_engine(f"sqlite:///{db_file}")
+            self.engine = engine if engine else get_engine()
         except Exception as e:
             print(f"Exception connecting to database: {e}")
             raise e
@@ -0,0 +1,214 @@
+import os
+import re
+import base64
+import hashlib
+from collections import Counter
+from typing import Any, Callable, Union, List, IO
+
+from sqlalchemy import Column, String, Integer, LargeBinary, update, delete, bindparam, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from modules import scripts
+from modules import shared
+
+from .base import BaseTableManager, Base
+
+# serialized images reference their blob as {"blob": "<sha256>"} inside task params
+blob_ref_pattern = re.compile(r'"blob": "([0-9a-f]{64})"')
+
+
+# large arrays are stored as .npy files named after their hash, see BlobManager.put_sidecar
+array_dir = getattr(shared.cmd_opts, "agent_scheduler_array_dir", None) or "task_arrays"
+if not os.path.isabs(array_dir):
+    array_dir = os.path.join(scripts.basedir(), array_dir)
+
+
+def get_sidecar_path(hash: str) -> str:
+    return os.path.join(array_dir, f"{hash}.npy")
+
+
+def get_blob_refs(params: Union[str, None]) -> List[str]:
+    """List the blob hashes referenced by serialized task params, once per reference"""
+
+    if not params:
+        return []
+
+    return blob_ref_pattern.findall(params)
+
+
+class BlobTable(Base):
+    __tablename__ = "task_blob"
+
+    hash = Column(String(64), primary_key=True)  # sha256 of data
+    data = Column(LargeBinary, nullable=False)  # empty for sidecar files, the row only counts their references
+    ref_count = Column(Integer, nullable=False, default=0)  # number of task rows referencing this blob
+
+    def __repr__(self):
+        return f"Blob(hash={self.hash!r}, ref_count={self.ref_count!r})"
+
+
+class BlobManager(BaseTableManager):
+    def put(self, data: bytes) -> str:
+        """Store data if not stored yet and return its hash, the blob is kept once a task references it"""
+
+        hash = hashlib.sha256(data).hexdigest()
+        session = Session(self.engine)
+        try:
+            stmt = sqlite_insert(BlobTable).values(hash=hash, data=data, ref_count=0)
+            session.execute(stmt.on_conflict_do_nothing(index_elements=[BlobTable.hash]))
+            session.commit()
+            return hash
+        except Exception as e:
+            print(f"Exception adding blob to database: {e}")
+            raise e
+        finally:
+            session.close()
+
+    def put_sidecar(self, hash: str, write: Callable[[IO[bytes]], None]) -> str:
+        """Like put, for data written by `write` to the sidecar file of `hash` instead of the table"""
+
+        path = get_sidecar_path(hash)
+        if not os.path.exists(path):
+            os.makedirs(array_dir, exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, "wb") as f:
+                write(f)
+            os.replace(temp_path, path)
+
+        return self.put_ref(hash)
+
+    def put_ref(self, hash: str) -> str:
+        session = Session(self.engine)
+        try:
+            stmt = sqlite_insert(BlobTable).values(hash=hash, data=b"", ref_count=0)
+            session.execute(stmt.on_conflict_do_nothing(index_elements=[BlobTable.hash]))
+            session.commit()
+            return hash
+        except Exception as e:
+            print(f"Exception adding blob to database: {e}")
+            raise e
+        finally:
+            session.close()
+
+    def get(self, hash: str) -> Union[bytes, None]:
+        session = Session(self.engine)
+        try:
+            blob = session.get(BlobTable, hash)
+            return blob.data if blob else None
+        except Exception as e:
+            print(f"Exception getting blob from database: {e}")
+            raise e
+        finally:
+            session.close()
+
+    def inline(self, value: Any) -> Any:
+        """Replace blob references in deserialized params with inline data, so the params no longer need this table"""
+
+        session = Session(self.engine)
+        try:
+            return BlobManager.inline_refs(session, value)
+        except Exception as e:
+            print(f"Exception getting blob from database: {e}")
+            raise e
+        finally:
+            session.close()
+
+    def update_refs(self, retain: List[str] = [], release: List[str] = []):
+        """retain and release in a transaction of their own, for task stores that don't share this database"""
+
+        if len(retain) == 0 and len(release) == 0:
+            return
+
+        session = Session(self.engine)
+        try:
+            BlobManager.retain(session, retain)
+            BlobManager.release(session, release)
+            session.commit()
+        except Exception as e:
+            print(f"Exception updating blob references in database: {e}")
+            raise e
+        finally:
+            session.close()
+
+    def delete_unreferenced(self) -> int:
+        session = Session(self.engine)
+        try:
+            deleted_rows = session.execute(delete(BlobTable).where(BlobTable.ref_count <= 0)).rowcount
+            session.commit()
+            self.__delete_orphan_sidecars(session)
+            return deleted_rows
+        except Exception as e:
+            print(f"Exception deleting blobs from database: {e}")
+            raise e
+        finally:
+            session.close()
+
+    def __delete_orphan_sidecars(self, session: Session):
+        # files of sidecar rows deleted above, or left by a put that never got its row
+        if not os.path.isdir(array_dir):
+            return
+
+        hashes = set(
+            hash for (hash,) in session.query(BlobTable.hash).filter(func.length(BlobTable.data) == 0).all()
+        )
+        for file in os.listdir(array_dir):
+            if file.endswith(".npy") and file[: -len(".npy")] in hashes:
+                continue
+            try:
+                os.remove(os.path.join(array_dir, file))
+            except OSError as e:
+                print(f"Exception deleting array file {file}: {e}")
+
+    @staticmethod
+    def retain(session: Session, hashes: List[str]):
+        """Add references to the given blobs within the caller's transaction"""
+
+        BlobManager.__add_refs(session, Counter(hashes))
+
+    @staticmethod
+    def release(session: Session, hashes: List[str]):
+        """Drop references to the given blobs within the caller's transaction"""
+
+        # unreferenced rows stay until delete_unreferenced on the next start: put commits a blob before the task
+        # referencing it is added, deleting it here would lose it if another task released the same hash meanwhile
+        BlobManager.__add_refs(session, {hash: -count for hash, count in Counter(hashes).items()})
+
+    @staticmethod
+    def inline_refs(session: Session, value: Any) -> Any:
+        """Same as inline, within the caller's session"""
+
+        if isinstance(value, dict):
+            if value.get("cls", None) and value.get("blob", None):
+                value = value.copy()
+                hash = value.pop("blob")
+                if value.get("codec", None) == "npy":
+                    path = get_sidecar_path(hash)
+                    if os.path.exists(path):
+                        with open(path, "rb") as f:
+                            value["data"] = base64.b64encode(f.read()).decode()
+                    else:
+                        value["data"] = None
+                    return value
+
+                blob = session.get(BlobTable, hash)
+                value["data"] = base64.b64encode(blob.data).decode() if blob else None
+                return value
+
+            return {k: BlobManager.inline_refs(session, v) for k, v in value.items()}
+        elif isinstance(value, list):
+            return [BlobManager.inline_refs(session, v) for v in value]
+        else:
+            return value
+
+    @staticmethod
+    def __add_refs(session: Session, counts: dict):
+        if len(counts) == 0:
+            return
+
+        stmt = (
+            update(BlobTable.__table__)
+            .where(BlobTable.__table__.c.hash == bindparam("_hash"))
+            .values(ref_count=BlobTable.__table__.c.ref_count + bindparam("_count"))
+        )
+        session.execute(stmt, [{"_hash": hash, "_count": count} for hash, count in counts.items()])
@@ -0,0 +1,181 @@
+import time
+import atexit
+import threading
+from enum import Enum
+from datetime import datetime, timezone
+from typing import Optional, List, Dict
+
+from sqlalchemy import Column, String, Integer, Text, Index, insert, delete
+from sqlalchemy.orm import Session
+
+from .base import BaseTableManager, Base
+
+
+class TaskEventType(str, Enum):
+    QUEUED = "queued"
+    CLAIMED = "claimed"
+    STARTED = "started"
+    DONE = "done"
+    FAILED = "failed"
+    INTERRUPTED = "interrupted"
+    REQUEUED = "requeued"
+    RELEASED = "released"  # handed back to the queue without running, e.g. on reload
+    UPDATED = "updated"
+    MOVED = "moved"
+    BOOKMARKED = "bookmarked"
+    UNBOOKMARKED = "unbookmarked"
+    RENAMED = "renamed"
+    DELETED = "deleted"
+
+
+class TaskEvent:
+    def __init__(self, task_id: str, event: str, ts: int, data: Optional[str] = None):
+        self.task_id: str = task_id
+        self.event: str = event
+        self.ts: int = ts  # milliseconds since epoch, taken when the event happened
+        self.data: Optional[str] = data
+
+    @staticmethod
+    def from_table(table: "TaskEventTable"):
+        return TaskEvent(table.task_id, table.event, table.ts, table.data)
+
+    def to_json(self):
+        return {"task_id": self.task_id, "event": self.event, "ts": self.ts, "data": self.data}
+
+
+class TaskEventTable(Base):
+    __tablename__ = "task_event"
+    __table_args__ = (
+        Index("ix_task_event_task_id_ts", "task_id", "ts"),
+        Index("ix_task_event_ts", "ts"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    task_id = Column(String(64), nullable=False)
+    event = Column(String(20), nullable=False)
+    ts = Column(Integer, nullable=False)
+    data = Column(Text, nullable=True)
+
+    def __repr__(self):
+        return f"TaskEvent(task_id={self.task_id!r}, event={self.event!r}, ts={self.ts!r})"
+
+
+class TaskEventLog(BaseTableManager):
+    """
+    Append-only log of task state transitions
+    append() only buffers the event, a background thread writes the buffer in one transaction every
+    `flush_interval` seconds or as soon as `batch_size` events are waiting
+    """
+
+    def __init__(self, engine=None, flush_interval: float = 1.0, batch_size: int = 200):
+        super().__init__(engine)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.__lock = threading.Lock()
+        self.__flush_lock = threading.Lock()
+        self.__buffer: List[Dict] = []
+        self.__wakeup = threading.Event()
+        self.__thread: threading.Thread = None
+        atexit.register(self.flush)
+
+    def append(self, task_id: str, event: str, data: Optional[str] = None):
+        with self.__lock:
+            self.__buffer.append(
+                {
+                    "task_id": task_id,
+                    "event": event,
+                    "ts": int(datetime.now(timezone.utc).timestamp() * 1000),
+                    "data": data,
+                }
+            )
+            if self.__thread is None or not self.__thread.is_alive():
+                self.__thread = threading.Thread(target=self.__run, daemon=True)
+                self.__thread.start()
+            if len(self.__buffer) >= self.batch_size:
+                self.__wakeup.set()
+
+    def flush(self) -> int:
+        """Write the buffered events now, return how many were written"""
+
+        with self.__flush_lock:
+            with self.__lock:
+                events, self.__buffer = self.__buffer, []
+
+            if len(events) == 0:
+                return 0
+
+            session = Session(self.engine)
+            try:
+                session.execute(insert(TaskEventTable.__table__), events)
+                session.commit()
+                return len(events)
+            except Exception as e:
+                # the log must never break the runner, drop the batch
+                print(f"Exception adding task events to database: {e}")
+                return 0
+            finally:
+                session.close()
+
+    def get_events(self, task_id: str = None, since: int = None, limit: int = None) -> List[TaskEvent]:
+        """Events in the order they happened, optionally of one task and/or from `since` (ms) on"""
+
+        self.flush()
+        session = Session(self.engine)
+        try:
+            query = session.query(TaskEventTable)
+            if task_id:
+                query = query.filter(TaskEventTable.task_id == task_id)
+            if since is not None:
+                query = query.filter(TaskEventTable.ts >= since)
+
+            query = query.order_by(TaskEventTable.ts.asc(), TaskEventTable.id.asc())
+            if limit:
+                query = query.limit(limit)
+
+            return [TaskEvent.from_table(row) for row in query.all()]
+        except Exception as e:
+            print(f"Exception getting task events from database: {e}")
+            raise e
+        finally:
+            session.close()
+
+    def delete_events(self, before: datetime, batch_size: int = 500, pause: float = 0.05) -> int:
+        """Delete the events older than `before`, committing every `batch_size` rows so other writers are not blocked for long"""
+
+        ts = int(before.timestamp() * 1000)
+        deleted_rows = 0
+        while True:
+            session = Session(self.engine)
+            try:
+                ids = [
+                    row.id
+                    for row in session.query(TaskEventTable.id)
+                    .filter(TaskEventTable.ts < ts)
+                    .order_by(TaskEventTable.ts.asc())
+                    .limit(batch_size)
+                ]
+                if len(ids) == 0:
+                    return deleted_rows
+
+                session.execute(delete(TaskEventTable).where(TaskEventTable.id.in_(ids)))
+                session.commit()
+                deleted_rows += len(ids)
+            except Exception as e:
+                print(f"Exception deleting task events from database: {e}")
+                raise e
+            finally:
+                session.close()
+
+            # yield the write lock between batches
+            time.sleep(pause)
+
+    def __run(self):
+        while True:
+            self.__wakeup.wait(self.flush_interval)
+            self.__wakeup.clear()
+            self.flush()
+            # don't keep an idle thread around, append starts a new one
+            with self.__lock:
+                if len(self.__buffer) == 0:
+                    self.__thread = None
+                    return
@@ -0,0 +1,366 @@
+import json
+import threading
+from datetime import datetime, timezone
+from typing import Optional, Union, List, Dict, Tuple
+
+from .blob import BlobManager, get_blob_refs
+from .pending_index import PendingTaskIndex, get_pending_key
+from .task import (
+    PRIORITY_GAP,
+    TaskStatus,
+    Task,
+    decode_task_cursor,
+    get_task_summary,
+)
+
+
+class MemoryTaskManager:
+    """
+    TaskStore keeping the tasks in process memory, they are gone when the process exits
+    Serialized images go to the blob table of `blobs`, which references them while their task is kept
+    """
+
+    def __init__(self, tasks: List[Task] = None, blobs: BlobManager = None):
+        self.__lock = threading.RLock()
+        self.__tasks: Dict[str, Task] = {}
+        self.__blobs = blobs
+        self.pending_index = PendingTaskIndex()
+        self.pending_index.ensure_loaded(lambda: [])
+
+        for task in tasks or []:
+            self.__put(task.copy())
+
+    def snapshot(self) -> List[Task]:
+        """Copy of all tasks, they can be given back to the constructor later"""
+
+        with self.__lock:
+            return [task.copy() for task in self.__tasks.values()]
+
+    def invalidate_cache(self):
+        # the memory is the source of truth, nothing to reload
+        pass
+
+    def get_task(self, id: str) -> Union[Task, None]:
+        with self.__lock:
+            task = self.__tasks.get(id, None)
+            return task.copy(update={"summary": None}) if task else None
+
+    def get_task_position(self, id: str) -> int:
+        with self.__lock:
+            position = self.pending_index.position(id)
+            if position is not None:
+                return position
+
+            task = self.__tasks.get(id, None)
+            if task is None:
+                raise Exception(f"Task with id {id} not found")
+
+            key = get_pending_key(task.id, task.bookmarked, task.priority)
+            return len(
+                [
+                    t
+                    for t in self.__tasks.values()
+                    if t.status == TaskStatus.PENDING and get_pending_key(t.id, t.bookmarked, t.priority) < key
+                ]
+            )
+
+    def get_tasks(
+        self,
+        type: str = None,
+        status: Union[str, List[str]] = None,
+        bookmarked: bool = None,
+        api_task_id: str = None,
+        limit: int = None,
+        offset: int = None,
+        order: str = "asc",
+        cursor: str = None,
+        load_payload: bool = True,
+        q: str = None,
+    ) -> List[Task]:
+        """Same ordering, filtering and paging as TaskManager.get_tasks"""
+
+        with self.__lock:
+            tasks = [task for task in self.__tasks.values() if self.__matches(task, type, status, api_task_id, q)]
+
+        if bookmarked == True:
+            tasks = [task for task in tasks if task.bookmarked == True]
+
+        # priority and id in the requested order, bookmarked always ascending
+        tasks.sort(key=lambda t: (t.priority, t.id), reverse=order != "asc")
+        tasks.sort(key=lambda t: get_pending_key(t.id, t.bookmarked, t.priority)[0])
+
+        if cursor:
+            after = decode_task_cursor(cursor)
+            tasks = [task for task in tasks if self.__is_after(task, after, order)]
+        elif offset:
+            tasks = tasks[offset:]
+
+        if limit:
+            tasks = tasks[:limit]
+
+        if load_payload:
+            return [task.copy(update={"summary": None}) for task in tasks]
+
+        return [task.copy(update={"params": "{}", "script_params": None}) for task in tasks]
+
+    def count_tasks(
+        self,
+        type: str = None,
+        status: Union[str, List[str]] = None,
+        api_task_id: str = None,
+        q: str = None,
+    ) -> int:
+        with self.__lock:
+            return len([task for task in self.__tasks.values() if self.__matches(task, type, status, api_task_id, q)])
+
+    def claim_next_task(self) -> Union[Task, None]:
+        with self.__lock:
+            id = self.pending_index.first()
+            return self.claim_task(id) if id is not None else None
+
+    def claim_task(self, id: str) -> Union[Task, None]:
+        with self.__lock:
+            task = self.__tasks.get(id, None)
+            if task is None or task.status != TaskStatus.PENDING:
+                return None
+
+            task.status = TaskStatus.RUNNING
+            self.__touch(task)
+            return task.copy()
+
+    def release_running_tasks(self) -> int:
+        # the tasks only live as long as this process, whatever is running was claimed by a live runner
+        return 0
+
+    def add_task(self, task: Task) -> Task:
+        return self.add_tasks([task])[0]
+
+    def add_tasks(self, tasks: List[Task]) -> List[Task]:
+        with self.__lock:
+            for task in tasks:
+                if task.id in self.__tasks:
+                    raise Exception(f"Task with id {task.id} already exists")
+
+            for task in tasks:
+                self.__put(task.copy())
+
+            return tasks
+
+    def upsert_tasks(self, tasks: List[Task]) -> List[Task]:
+        with self.__lock:
+            for task in tasks:
+                current = self.__tasks.get(task.id, None)
+                created_at = current.created_at if current else None
+                self.__put(task.copy(update={"created_at": created_at}))
+
+            return tasks
+
+    def update_status_bulk(self, tasks: List[Task]) -> int:
+        with self.__lock:
+            for task in tasks:
+                current = self.__tasks.get(task.id, None)
+                if current is None:
+                    continue
+
+                current.status = task.status
+                current.result = task.result
+                current.priority = task.priority
+                self.__touch(current)
+
+            return len(tasks)
+
+    def update_task(self, task: Task) -> Task:
+        with self.__lock:
+            current = self.__tasks.get(task.id, None)
+            if current is None:
+                raise Exception(f"Task with id {task.id} not found")
+
+            self.__put(task.copy(update={"created_at": current.created_at}))
+            return task
+
+    def set_status(self, id: str, status: str, priority: int = None) -> bool:
+        values = {"status": status}
+        if priority is not None:
+            values["priority"] = priority
+
+        return self.__update_fields(id, values)
+
+    def set_result(self, id: str, result: Optional[str], status: str = None) -> bool:
+        values = {"result": result}
+        if status is not None:
+            values["status"] = status
+
+        return self.__update_fields(id, values)
+
+    def set_bookmark(self, id: str, bookmarked: bool) -> bool:
+        return self.__update_fields(id, {"bookmarked": bookmarked})
+
+    def rename(self, id: str, name: Optional[str]) -> bool:
+        return self.__update_fields(id, {"name": name})
+
+    def prioritize_task(self, id: str, priority: int) -> Task:
+        """0 means move to top, -1 means move to bottom, otherwise move right before the pending task with that priority"""
+
+        with self.__lock:
+            task = self.__tasks.get(id, None)
+            if task is None:
+                raise Exception(f"Task with id {id} not found")
+
+            if priority == 0:
+                pending = [t.priority for t in self.__tasks.values() if t.status == TaskStatus.PENDING]
+                task.priority = (min(pending) if pending else 0) - 1
+            elif priority == -1:
+                task.priority = int(datetime.now(timezone.utc).timestamp() * 1000)
+            else:
+                task.priority = self.__get_priority_before(id, priority)
+
+            self.__touch(task)
+            return task.copy()
+
+    def delete_task(self, id: str):
+        with self.__lock:
+            task = self.__tasks.pop(id, None)
+            if task is None:
+                raise Exception(f"Task with id {id} not found")
+
+            self.pending_index.remove(id)
+            self.__update_blob_refs(release=[task])
+
+    def delete_tasks(
+        self,
+        before: datetime = None,
+        status: Union[str, List[str]] = [
+            TaskStatus.DONE,
+            TaskStatus.FAILED,
+            TaskStatus.INTERRUPTED,
+        ],
+    ) -> int:
+        with self.__lock:
+            ids = [
+                task.id
+                for task in self.__tasks.values()
+                if task.bookmarked == False
+                and self.__matches(task, None, status, None)
+                and (before is None or (task.created_at is not None and task.created_at < before))
+            ]
+            deleted = [self.__tasks.pop(id) for id in ids]
+            for id in ids:
+                self.pending_index.remove(id)
+            self.__update_blob_refs(release=deleted)
+
+            return len(ids)
+
+    def delete_tasks_in_batches(
+        self,
+        before: datetime = None,
+        status: Union[str, List[str]] = [
+            TaskStatus.DONE,
+            TaskStatus.FAILED,
+            TaskStatus.INTERRUPTED,
+        ],
+        batch_size: int = 500,
+        pause: float = 0.05,
+    ) -> int:
+        # nothing else waits on a lock long enough to be worth batching
+        return self.delete_tasks(before=before, status=status)
+
+    def __update_fields(self, id: str, values: Dict) -> bool:
+        with self.__lock:
+            task = self.__tasks.get(id, None)
+            if task is None:
+                return False
+
+            for key, value in values.items():
+                setattr(task, key, value)
+            self.__touch(task)
+            return True
+
+    def __put(self, task: Task):
+        # inserts store a missing bookmarked as false, like the task table default
+        if task.bookmarked is None:
+            task.bookmarked = False
+        if task.created_at is None:
+            task.created_at = datetime.now(timezone.utc)
+        task.summary = get_task_summary(task.params)
+        self.__touch(task)
+        replaced = self.__tasks.get(task.id, None)
+        self.__tasks[task.id] = task
+        self.__update_blob_refs(retain=[task], release=[replaced] if replaced else [])
+
+    def __update_blob_refs(self, retain: List[Task] = [], release: List[Task] = []):
+        # same accounting the task table does in its transactions, so images of removed tasks are freed
+        if self.__blobs is None:
+            return
+
+        self.__blobs.update_refs(
+            retain=[ref for task in retain for ref in get_blob_refs(task.params)],
+            release=[ref for task in release for ref in get_blob_refs(task.params)],
+        )
+
+    def __touch(self, task: Task):
+        task.updated_at = datetime.now(timezone.utc)
+        if task.status == TaskStatus.PENDING:
+            self.pending_index.put(task.id, task.bookmarked, task.priority)
+        else:
+            self.pending_index.remove(task.id)
+
+    def __matches(self, task: Task, type: str, status: Union[str, List[str]], api_task_id: str, q: str = None) -> bool:
+        if type and task.type != type:
+            return False
+        if status is not None:
+            if isinstance(status, list):
+                if task.status not in status:
+                    return False
+            elif task.status != status:
+                return False
+        if api_task_id and task.api_task_id != api_task_id:
+            return False
+        if q and not self.__matches_search(task, q):
+            return False
+
+        return True
+
+    def __matches_search(self, task: Task, q: str) -> bool:
+        # the task table matches word prefixes with fts5, substrings are close enough here
+        try:
+            args = json.loads(task.params).get("args", {})
+        except Exception:
+            args = {}
+
+        text = " ".join(str(value or "") for value in [task.name, args.get("prompt"), args.get("negative_prompt")]).lower()
+        return all(term in text for term in q.lower().split())
+
+    def __is_after(self, task: Task, cursor: Tuple[bool, int, str], order: str) -> bool:
+        bookmarked, priority, id = cursor
+        rank = get_pending_key(task.id, task.bookmarked, task.priority)[0]
+        cursor_rank = get_pending_key(id, bookmarked, priority)[0]
+        if rank != cursor_rank:
+            return rank > cursor_rank
+
+        if order == "asc":
+            return (task.priority, task.id) > (priority, id)
+
+        return (task.priority, task.id) < (priority, id)
+
+    def __get_priority_before(self, id: str, priority: int) -> int:
+        pending = sorted(
+            [t for t in self.__tasks.values() if t.status == TaskStatus.PENDING and t.id != id],
+            key=lambda t: t.priority,
+        )
+        over = next((t for t in pending if t.priority >= priority), None)
+        if over is None:
+            return priority
+
+        prev_priority = max([t.priority for t in pending if t.priority < over.priority], default=None)
+        if prev_priority is None:
+            return over.priority - PRIORITY_GAP
+        if over.priority - prev_priority > 1:
+            return prev_priority + (over.priority - prev_priority) // 2
+
+        # no room left between neighbours, spread out the pending tasks keeping the last one in place
+        last_priority = pending[-1].priority
+        for i, t in enumerate(pending):
+            t.priority = last_priority - (len(pending) - 1 - i) * PRIORITY_GAP
+            self.pending_index.put(t.id, t.bookmarked, t.priority)
+
+        return self.__get_priority_before(id, over.priority)
@@ -0,0 +1,239 @@
+from typing import Callable, List, Tuple
+
+from sqlalchemy import inspect, text, Text
+from sqlalchemy.engine import Connection, Engine
+
+from .base import metadata
+from .app_state import AppStateKey
+from .event import TaskEventTable
+from .task import (
+    TaskTable,
+    task_counter_triggers,
+    task_search_table,
+    task_search_key_table,
+    task_search_triggers,
+    get_task_search_values,
+    get_task_summary_sql,
+)
+
+# format version of the stored params
+version = "2"
+
+# the applied schema version is sqlite's user_version, reading it needs no table and no reflection.
+# append new migrations at the end, never reorder or remove them: version N means the first N have run
+Migration = Callable[[Connection], None]
+migrations: List[Tuple[Migration, bool]] = []
+
+
+def migration(transactional: bool = True):
+    """Register the decorated function as the next migration"""
+
+    def decorator(fn: Migration) -> Migration:
+        migrations.append((fn, transactional))
+        return fn
+
+    return decorator
+
+
+def get_schema_version(conn: Connection) -> int:
+    return conn.execute(text("PRAGMA user_version")).scalar()
+
+
+def migrate(engine: Engine) -> int:
+    """Run the migrations newer than the stored schema version, return how many ran"""
+
+    with engine.connect() as conn:
+        if get_schema_version(conn) >= len(migrations):
+            return 0
+
+    applied = 0
+    for schema_version, (fn, transactional) in enumerate(migrations, start=1):
+        # the sqlite driver does not open transactions for DDL itself, so manage them by hand
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            if transactional:
+                # IMMEDIATE takes the write lock now, so concurrent starts migrate one after another
+                conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+            try:
+                # another process may have migrated in the meantime
+                if get_schema_version(conn) >= schema_version:
+                    if transactional:
+                        conn.exec_driver_sql("ROLLBACK")
+                    continue
+
+                fn(conn)
+                conn.exec_driver_sql(f"PRAGMA user_version = {schema_version}")
+                if transactional:
+                    conn.exec_driver_sql("COMMIT")
+            except Exception as e:
+                print(f"Exception applying database migration {schema_version}: {e}")
+                if transactional:
+                    conn.exec_driver_sql("ROLLBACK")
+                raise e
+
+        print(f"Applied database migration {schema_version}: {fn.__doc__}")
+        applied += 1
+
+    return applied
+
+
+@migration()
+def create_schema(conn: Connection):
+    """create tables and bring databases from before the migrations up to date"""
+
+    metadata.create_all(conn)
+
+    task_columns = inspect(conn).get_columns("task")
+    column_names = [col["name"] for col in task_columns]
+
+    # add result column
+    if "result" not in column_names:
+        conn.execute(text("ALTER TABLE task ADD COLUMN result TEXT"))
+
+    # params used to be VARCHAR, rebuild the table with the original columns before adding the newer ones
+    params_column = next(col for col in task_columns if col["name"] == "params")
+    if not isinstance(params_column["type"], Text):
+        columns = "id, type, params, script_params, priority, status, created_at, updated_at, result"
+        conn.execute(
+            text(
+                """
+                CREATE TABLE task_temp (
+                    id VARCHAR(64) NOT NULL,
+                    type VARCHAR(20) NOT NULL,
+                    params TEXT NOT NULL,
+                    script_params BLOB NOT NULL,
+                    priority INTEGER NOT NULL,
+                    status VARCHAR(20) NOT NULL,
+                    created_at DATETIME DEFAULT (datetime('now')) NOT NULL,
+                    updated_at DATETIME DEFAULT (datetime('now')) NOT NULL,
+                    result TEXT,
+                    PRIMARY KEY (id)
+                )"""
+            )
+        )
+        conn.execute(text(f"INSERT INTO task_temp ({columns}) SELECT {columns} FROM task"))
+        conn.execute(text("DROP TABLE task"))
+        conn.execute(text("ALTER TABLE task_temp RENAME TO task"))
+        column_names = columns.split(", ")
+
+    # add api_task_id column
+    if "api_task_id" not in column_names:
+        conn.execute(text("ALTER TABLE task ADD COLUMN api_task_id VARCHAR(64)"))
+
+    # add api_task_callback column
+    if "api_task_callback" not in column_names:
+        conn.execute(text("ALTER TABLE task ADD COLUMN api_task_callback VARCHAR(255)"))
+
+    # add name column
+    if "name" not in column_names:
+        conn.execute(text("ALTER TABLE task ADD COLUMN name VARCHAR(255)"))
+
+    # add bookmarked column
+    if "bookmarked" not in column_names:
+        conn.execute(text("ALTER TABLE task ADD COLUMN bookmarked BOOLEAN DEFAULT FALSE"))
+
+    conn.execute(
+        text("INSERT OR REPLACE INTO app_state (key, value) VALUES (:key, :value)"),
+        {"key": AppStateKey.Version.value, "value": version},
+    )
+    conn.execute(
+        text("INSERT OR IGNORE INTO app_state (key, value) VALUES (:key, 'running')"),
+        {"key": AppStateKey.QueueState.value},
+    )
+
+
+@migration()
+def create_task_indexes(conn: Connection):
+    """create the task listing indexes"""
+
+    for index in TaskTable.__table__.indexes:
+        index.create(bind=conn, checkfirst=True)
+
+
+@migration()
+def create_task_counters(conn: Connection):
+    """maintain per status task counters with triggers"""
+
+    for sql in task_counter_triggers.values():
+        conn.execute(text(sql))
+
+    conn.execute(text("DELETE FROM task_counter"))
+    conn.execute(
+        text(
+            "INSERT INTO task_counter (status, type, count) "
+            + "SELECT status, type, COUNT(*) FROM task GROUP BY status, type"
+        )
+    )
+
+
+@migration(transactional=False)
+def enable_incremental_vacuum(conn: Connection):
+    """enable incremental auto vacuum"""
+
+    # new databases get it from the connect pragmas, existing ones only switch after a full vacuum,
+    # which cannot run inside a transaction
+    if conn.execute(text("PRAGMA auto_vacuum")).scalar() != 2:
+        print("Enabling incremental auto vacuum, this may take a while for large databases")
+        conn.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+        conn.execute(text("VACUUM"))
+
+
+@migration()
+def create_task_search(conn: Connection):
+    """index task names and prompts for full-text search"""
+
+    try:
+        conn.execute(text(task_search_table))
+    except Exception as e:
+        # sqlite built without fts5, searching falls back to scanning the task table
+        print(f"Could not create the task search index: {e}")
+        return
+
+    conn.execute(text(task_search_key_table))
+    for sql in task_search_triggers.values():
+        conn.execute(text(sql))
+
+    conn.execute(text("INSERT INTO task_fts_key (task_id) SELECT id FROM task"))
+    conn.execute(
+        text(
+            f"""
+            INSERT INTO task_fts (rowid, name, prompt, negative_prompt)
+            SELECT task_fts_key.fts_rowid, {get_task_search_values("task")}
+            FROM task JOIN task_fts_key ON task_fts_key.task_id = task.id"""
+        )
+    )
+
+
+@migration()
+def add_task_summary(conn: Connection):
+    """extract the listed task args into the summary column"""
+
+    if not any(col["name"] == "summary" for col in inspect(conn).get_columns("task")):
+        conn.execute(text("ALTER TABLE task ADD COLUMN summary TEXT"))
+
+    # same shape as get_task_summary, rows left NULL (no JSON1) are listed from their params
+    try:
+        summary = get_task_summary_sql("params")
+        conn.execute(text(f"UPDATE task SET summary = {summary} WHERE summary IS NULL AND json_valid(params)"))
+    except Exception as e:
+        print(f"Could not fill the task summaries: {e}")
+
+
+@migration()
+def create_task_events(conn: Connection):
+    """create the task event log"""
+
+    TaskEventTable.__table__.create(bind=conn, checkfirst=True)
+    for index in TaskEventTable.__table__.indexes:
+        index.create(bind=conn, checkfirst=True)
+
+
+@migration()
+def add_task_claims(conn: Connection):
+    """record which runner claimed a running task and when it was last seen alive"""
+
+    column_names = [col["name"] for col in inspect(conn).get_columns("task")]
+    if "claimed_by" not in column_names:
+        conn.execute(text("ALTER TABLE task ADD COLUMN claimed_by VARCHAR(255)"))
+    if "heartbeat_at" not in column_names:
+        conn.execute(text("ALTER TABLE task ADD COLUMN heartbeat_at INTEGER"))
@@ -0,0 +1,91 @@
+import bisect
+import threading
+from typing import Callable, Iterable, Optional, Union, List, Dict, Tuple
+
+# (bookmarked, priority, id), same order as the pending task listing
+PendingKey = Tuple[int, int, str]
+
+
+def get_pending_key(id: str, bookmarked: Optional[bool], priority: int) -> PendingKey:
+    # sqlite sorts NULL before FALSE before TRUE
+    bookmarked_rank = -1 if bookmarked is None else int(bookmarked)
+    return (bookmarked_rank, priority, id)
+
+
+class PendingTaskIndex:
+    """
+    In-process ordered index of the pending tasks
+    Loaded lazily from the database and kept up to date by TaskManager after each write
+    """
+
+    def __init__(self):
+        self.__lock = threading.RLock()
+        self.__keys: List[PendingKey] = []
+        self.__key_by_id: Dict[str, PendingKey] = {}
+        self.__loaded = False
+
+    @property
+    def loaded(self) -> bool:
+        return self.__loaded
+
+    def ensure_loaded(self, load: Callable[[], Iterable[Tuple[str, Optional[bool], int]]]):
+        """Fill the index with `load()` rows of (id, bookmarked, priority) unless already loaded"""
+
+        with self.__lock:
+            if self.__loaded:
+                return
+
+            keys = [get_pending_key(*row) for row in load()]
+            keys.sort()
+            self.__keys = keys
+            self.__key_by_id = {key[2]: key for key in keys}
+            self.__loaded = True
+
+    def invalidate(self):
+        with self.__lock:
+            self.__keys = []
+            self.__key_by_id = {}
+            self.__loaded = False
+
+    def put(self, id: str, bookmarked: Optional[bool], priority: int):
+        with self.__lock:
+            if not self.__loaded:
+                return
+
+            self.__remove(id)
+            key = get_pending_key(id, bookmarked, priority)
+            bisect.insort(self.__keys, key)
+            self.__key_by_id[id] = key
+
+    def remove(self, id: str):
+        with self.__lock:
+            if self.__loaded:
+                self.__remove(id)
+
+    def first(self) -> Union[str, None]:
+        with self.__lock:
+            return self.__keys[0][2] if len(self.__keys) > 0 else None
+
+    def position(self, id: str) -> Union[int, None]:
+        with self.__lock:
+            key = self.__key_by_id.get(id, None)
+            if key is None:
+                return None
+
+            return bisect.bisect_left(self.__keys, key)
+
+    def __contains__(self, id: str) -> bool:
+        with self.__lock:
+            return id in self.__key_by_id
+
+    def __len__(self) -> int:
+        with self.__lock:
+            return len(self.__keys)
+
+    def __remove(self, id: str):
+        key = self.__key_by_id.pop(id, None)
+        if key is None:
+            return
+
+        index = bisect.bisect_left(self.__keys, key)
+        del self.__keys[index]
@@ -0,0 +1,87 @@
+from datetime import datetime
+from typing import Protocol, Optional, Union, List
+
+from .task import Task
+
+
+class TaskStore(Protocol):
+    """What the runner and the api need from a task storage backend, see TaskManager and MemoryTaskManager"""
+
+    def get_task(self, id: str) -> Union[Task, None]:
+        ...
+
+    def get_task_position(self, id: str) -> int:
+        ...
+
+    def get_tasks(
+        self,
+        type: str = None,
+        status: Union[str, List[str]] = None,
+        bookmarked: bool = None,
+        api_task_id: str = None,
+        limit: int = None,
+        offset: int = None,
+        order: str = "asc",
+        cursor: str = None,
+        load_payload: bool = True,
+        q: str = None,
+    ) -> List[Task]:
+        ...
+
+    def count_tasks(
+        self, type: str = None, status: Union[str, List[str]] = None, api_task_id: str = None, q: str = None
+    ) -> int:
+        ...
+
+    def claim_next_task(self) -> Union[Task, None]:
+        ...
+
+    def claim_task(self, id: str) -> Union[Task, None]:
+        ...
+
+    def release_running_tasks(self) -> int:
+        """Move tasks claimed by a runner that is gone back to pending, never the ones a live runner is running"""
+        ...
+
+    def add_task(self, task: Task) -> Task:
+        ...
+
+    def add_tasks(self, tasks: List[Task]) -> List[Task]:
+        ...
+
+    def upsert_tasks(self, tasks: List[Task]) -> List[Task]:
+        ...
+
+    def update_status_bulk(self, tasks: List[Task]) -> int:
+        ...
+
+    def update_task(self, task: Task) -> Task:
+        ...
+
+    def set_status(self, id: str, status: str, priority: int = None) -> bool:
+        ...
+
+    def set_result(self, id: str, result: Optional[str], status: str = None) -> bool:
+        ...
+
+    def set_bookmark(self, id: str, bookmarked: bool) -> bool:
+        ...
+
+    def rename(self, id: str, name: Optional[str]) -> bool:
+        ...
+
+    def prioritize_task(self, id: str, priority: int) -> Task:
+        ...
+
+    def delete_task(self, id: str):
+        ...
+
+    def delete_tasks(self, before: datetime = None, status: Union[str, List[str]] = ...) -> int:
+        ...
+
+    def delete_tasks_in_batches(self, before: datetime = None, status: Union[str, List[str]] = ...) -> int:
+        ...
+
+    def invalidate_cache(self):
+        """Drop anything cached in process, called before the UI reloads"""
+        ...
@@ -1,11 +1,19 @@
+import os
+import copy
 import json
+import time
 import base64
+import socket
+import threading
+from uuid import uuid4
 from enum import Enum
 from datetime import datetime, timezone
-from typing import Optional, Union, List, Dict
+from typing import Optional, Union, List, Dict, Tuple
 
 from sqlalchemy import (
     TypeDecorator,
+    or_,
+    tuple_,
     Column,
     String,
     Text,
@@ -13,12 +21,20 @@ from sqlalchemy import (
     DateTime as DateTimeImpl,
     LargeBinary,
     Boolean,
+    Index,
     text,
     func,
+    case,
+    insert,
+    update,
+    bindparam,
 )
-from sqlalchemy.orm import Session
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session, defer
 
 from .base import BaseTableManager, Base
+from .blob import BlobManager, get_blob_refs
+from .pending_index import PendingTaskIndex, get_pending_key
 from ..models import TaskModel
 
 
@@ -39,6 +55,124 @@ class DateTime(TypeDecorator):
         return value.astimezone(timezone.utc)
 
 
+# distance between pending task priorities after a rebalance, leaving room for moves in between
+PRIORITY_GAP = 1000
+
+# a running task's claim is refreshed every CLAIM_HEARTBEAT_INTERVAL seconds while this process is alive,
+# other runners release it once the heartbeat is CLAIM_STALE_AFTER seconds old
+CLAIM_HEARTBEAT_INTERVAL = 15
+CLAIM_STALE_AFTER = 120
+
+# owner of the claims made by this process, host and pid tell whether it is still alive
+runner_id = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def is_process_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    if psutil is not None:
+        return psutil.pid_exists(pid)
+    if os.name == "nt":
+        # signal 0 is CTRL_C_EVENT on windows, leave it to the heartbeat
+        return True
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # exists, owned by someone else
+        return True
+
+    return True
+
+
+def is_claim_stale(claimed_by: Optional[str], heartbeat_at: Optional[int], now: int) -> bool:
+    """Whether the runner that claimed a task is gone: no heartbeat for a while, or a dead process on this host"""
+
+    # claimed before claims had an owner
+    if not claimed_by or heartbeat_at is None:
+        return True
+    if now - heartbeat_at > CLAIM_STALE_AFTER * 1000:
+        return True
+
+    try:
+        host, pid, _ = claimed_by.rsplit(":", 2)
+        return host == socket.gethostname() and not is_process_alive(int(pid))
+    except ValueError:
+        return False
+
+
+def get_timestamp_ms() -> int:
+    return int(datetime.now(timezone.utc).timestamp() * 1000)
+
+
+# heavy params entries (inline images and script args) left out of task listings
+listing_excluded_params = [
+    "$.args.init_img",
+    "$.args.sketch",
+    "$.args.init_img_with_mask",
+    "$.args.inpaint_color_sketch",
+    "$.args.inpaint_color_sketch_orig",
+    "$.args.init_img_inpaint",
+    "$.args.init_mask_inpaint",
+    "$.args.init_images",
+    "$.args.mask",
+    "$.args.alwayson_scripts",
+    "$.args.script_args",
+    "$.script_args",
+]
+
+
+# columns written by bulk inserts, created_at and updated_at come from the server defaults
+task_mapping_keys = [
+    "id",
+    "api_task_id",
+    "api_task_callback",
+    "name",
+    "type",
+    "params",
+    "script_params",
+    "priority",
+    "status",
+    "result",
+    "bookmarked",
+    "summary",
+]
+
+# args of listing_excluded_params, the listed params are the args without them
+listing_excluded_args = [path[len("$.args.") :] for path in listing_excluded_params if path.startswith("$.args.")]
+
+
+def get_task_summary(params: str) -> Union[str, None]:
+    """Json of the params as listed: the args without listing_excluded_args, plus the checkpoint"""
+
+    try:
+        parsed = json.loads(params)
+    except Exception:
+        return None
+
+    args = parsed.get("args", None) or {}
+    summary = {key: value for key, value in args.items() if key not in listing_excluded_args}
+    summary["checkpoint"] = parsed.get("checkpoint", None)
+    return json.dumps(summary)
+
+
+def get_task_summary_sql(params: str) -> str:
+    """Same as get_task_summary, as an sql expression over the `params` column"""
+
+    excluded_args = ", ".join(f"'$.{key}'" for key in listing_excluded_args)
+    return (
+        f"json_set(json_remove(json_extract({params}, '$.args'), {excluded_args}), "
+        + f"'$.checkpoint', json_extract({params}, '$.checkpoint'))"
+    )
+
+
 class TaskStatus(str, Enum):
     PENDING = "pending"
     RUNNING = "running"
@@ -47,9 +181,17 @@ class TaskStatus(str, Enum):
     INTERRUPTED = "interrupted"
 
 
+# statuses of the history listing, ix_task_history_bookmarked_priority only holds these rows
+history_statuses = [TaskStatus.DONE, TaskStatus.FAILED, TaskStatus.INTERRUPTED]
+
+# bookmarked segments of the listings in sort order, sqlite sorts NULL before FALSE before TRUE
+bookmarked_segments = [None, False, True]
+
+
 class Task(TaskModel):
     script_params: bytes = None
     params: str
+    summary: Optional[str] = None  # only set on listed tasks
 
     def __init__(self, **kwargs):
         priority = kwargs.pop("priority", int(datetime.now(timezone.utc).timestamp() * 1000))
@@ -59,19 +201,22 @@ class Task(TaskModel):
         exclude = ["script_params"]
 
     @staticmethod
-    def from_table(table: "TaskTable"):
+    def from_table(table: "TaskTable", params: str = None):
+        """`params` replaces the stored params, listings use it to skip loading the payload columns and get the summary"""
+
         return Task(
             id=table.id,
             api_task_id=table.api_task_id,
             api_task_callback=table.api_task_callback,
             name=table.name,
             type=table.type,
-            params=table.params,
-            script_params=table.script_params,
+            params=table.params if params is None else params,
+            script_params=table.script_params if params is None else None,
             priority=table.priority,
             status=table.status,
             result=table.result,
             bookmarked=table.bookmarked,
+            summary=table.summary if params is not None else None,
             created_at=table.created_at,
             updated_at=table.updated_at,
         )
@@ -89,6 +234,7 @@ class Task(TaskModel):
             status=self.status,
             result=self.result,
             bookmarked=self.bookmarked,
+            summary=get_task_summary(self.params),
         )
 
     def from_json(json_obj: Dict):
@@ -126,6 +272,21 @@ class Task(TaskModel):
         }
 
 
+def encode_task_cursor(task: Task) -> str:
+    """Opaque pagination cursor pointing right after the given task"""
+
+    key = json.dumps([task.bookmarked, task.priority, task.id])
+    return base64.urlsafe_b64encode(key.encode("utf-8")).decode("utf-8")
+
+
+def decode_task_cursor(cursor: str) -> Tuple[Optional[bool], int, str]:
+    try:
+        bookmarked, priority, id = json.loads(base64.urlsafe_b64decode(cursor.encode("utf-8")))
+        return (None if bookmarked is None else bool(bookmarked), int(priority), str(id))
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
 class TaskTable(Base):
     __tablename__ = "task"
 
@@ -140,6 +301,9 @@ class TaskTable(Base):
     status = Column(String(20), nullable=False, default="pending")  # pending, running, done, failed
     result = Column(Text)  # task result
     bookmarked = Column(Boolean, nullable=True, default=False)
+    summary = Column(Text, nullable=True)  # see get_task_summary
+    claimed_by = Column(String(255), nullable=True)  # runner_id of the process running the task
+    heartbeat_at = Column(Integer, nullable=True)  # ms since epoch, refreshed while the task is running
     created_at = Column(
         DateTime,
         nullable=False,
@@ -152,17 +316,187 @@ class TaskTable(Base):
         onupdate=text("(datetime('now'))"),
     )
 
+    __table_args__ = (
+        # pending queue: filter by status, order by priority
+        Index("ix_task_status_priority", "status", "priority", "id"),
+        # listing of one status: filter by status, order by bookmarked then priority, id breaks ties for cursors
+        Index("ix_task_status_bookmarked_priority", "status", "bookmarked", "priority", "id"),
+        # history listing: an IN list on the leading status column can't return rows in order, this partial
+        # index can, for queries with the same literal IN list (see TaskManager.__status_in)
+        Index(
+            "ix_task_history_bookmarked_priority",
+            "bookmarked",
+            "priority",
+            "id",
+            sqlite_where=text("status IN (" + ", ".join(f"'{status.value}'" for status in history_statuses) + ")"),
+        ),
+    )
+
     def __repr__(self):
         return f"Task(id={self.id!r}, type={self.type!r}, params={self.params!r}, status={self.status!r}, created_at={self.created_at!r})"
 
 
+class TaskCounterTable(Base):
+    __tablename__ = "task_counter"
+
+    status = Column(String(20), primary_key=True)
+    type = Column(String(20), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"TaskCounter(status={self.status!r}, type={self.type!r}, count={self.count!r})"
+
+
+# keep task_counter in sync with the task table within the writing transaction, whatever the write path is
+task_counter_triggers = {
+    "task_counter_insert": """
+        CREATE TRIGGER IF NOT EXISTS task_counter_insert AFTER INSERT ON task
+        BEGIN
+            INSERT OR IGNORE INTO task_counter (status, type, count) VALUES (NEW.status, NEW.type, 0);
+            UPDATE task_counter SET count = count + 1 WHERE status = NEW.status AND type = NEW.type;
+        END""",
+    "task_counter_update": """
+        CREATE TRIGGER IF NOT EXISTS task_counter_update AFTER UPDATE OF status, type ON task
+        WHEN OLD.status IS NOT NEW.status OR OLD.type IS NOT NEW.type
+        BEGIN
+            UPDATE task_counter SET count = count - 1 WHERE status = OLD.status AND type = OLD.type;
+            INSERT OR IGNORE INTO task_counter (status, type, count) VALUES (NEW.status, NEW.type, 0);
+            UPDATE task_counter SET count = count + 1 WHERE status = NEW.status AND type = NEW.type;
+        END""",
+    "task_counter_delete": """
+        CREATE TRIGGER IF NOT EXISTS task_counter_delete AFTER DELETE ON task
+        BEGIN
+            UPDATE task_counter SET count = count - 1 WHERE status = OLD.status AND type = OLD.type;
+        END""",
+}
+
+
+# full-text index over task names and prompts. The fts rowid comes from task_fts_key, whose INTEGER PRIMARY KEY
+# is stable across VACUUM unlike the implicit task rowid. The index is contentless, deletes pass the indexed values
+task_search_table = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS task_fts USING fts5(name, prompt, negative_prompt, content='')"
+)
+
+task_search_key_table = (
+    "CREATE TABLE IF NOT EXISTS task_fts_key (fts_rowid INTEGER PRIMARY KEY, task_id VARCHAR(64) NOT NULL UNIQUE)"
+)
+
+
+def get_task_search_values(row: str) -> str:
+    return f"""
+        {row}.name,
+        CASE WHEN json_valid({row}.params) THEN json_extract({row}.params, '$.args.prompt') END,
+        CASE WHEN json_valid({row}.params) THEN json_extract({row}.params, '$.args.negative_prompt') END"""
+
+
+task_search_triggers = {
+    "task_fts_insert": f"""
+        CREATE TRIGGER IF NOT EXISTS task_fts_insert AFTER INSERT ON task
+        BEGIN
+            INSERT INTO task_fts_key (task_id) VALUES (NEW.id);
+            INSERT INTO task_fts (rowid, name, prompt, negative_prompt)
+            SELECT fts_rowid, {get_task_search_values("NEW")} FROM task_fts_key WHERE task_id = NEW.id;
+        END""",
+    "task_fts_update": f"""
+        CREATE TRIGGER IF NOT EXISTS task_fts_update AFTER UPDATE OF name, params ON task
+        BEGIN
+            INSERT INTO task_fts (task_fts, rowid, name, prompt, negative_prompt)
+            SELECT 'delete', fts_rowid, {get_task_search_values("OLD")} FROM task_fts_key WHERE task_id = OLD.id;
+            INSERT INTO task_fts (rowid, name, prompt, negative_prompt)
+            SELECT fts_rowid, {get_task_search_values("NEW")} FROM task_fts_key WHERE task_id = NEW.id;
+        END""",
+    "task_fts_delete": f"""
+        CREATE TRIGGER IF NOT EXISTS task_fts_delete AFTER DELETE ON task
+        BEGIN
+            INSERT INTO task_fts (task_fts, rowid, name, prompt, negative_prompt)
+            SELECT 'delete', fts_rowid, {get_task_search_values("OLD")} FROM task_fts_key WHERE task_id = OLD.id;
+            DELETE FROM task_fts_key WHERE task_id = OLD.id;
+        END""",
+}
+
+
+def to_search_query(q: str) -> str:
+    """Turn free text into an fts5 query matching all words as prefixes, so user input is never parsed as syntax"""
+
+    return " ".join('"' + term.replace('"', '""') + '"*' for term in q.split())
+
+
+class ClaimHeartbeat:
+    """Refreshes the heartbeat of the tasks this process claimed, from the first claim on"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.__lock = threading.Lock()
+        self.__thread: threading.Thread = None
+
+    def start(self):
+        with self.__lock:
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run, daemon=True)
+                self.__thread.start()
+
+    def beat(self) -> int:
+        """Refresh the claims of this process now, return how many tasks it is running"""
+
+        session = Session(self.engine)
+        try:
+            updated_rows = (
+                session.query(TaskTable)
+                .filter(TaskTable.status == TaskStatus.RUNNING)
+                .filter(TaskTable.claimed_by == runner_id)
+                .update(
+                    # updated_at is left alone, a heartbeat is not a change of the task
+                    {TaskTable.heartbeat_at: get_timestamp_ms(), TaskTable.updated_at: TaskTable.updated_at},
+                    synchronize_session=False,
+                )
+            )
+            session.commit()
+            return updated_rows
+        finally:
+            session.close()
+
+    def __run(self):
+        while True:
+            time.sleep(CLAIM_HEARTBEAT_INTERVAL)
+            try:
+                self.beat()
+            except Exception as e:
+                # keep beating, the claims only go stale after several missed heartbeats
+                print(f"Exception refreshing task claims in database: {e}")
+
+
 class TaskManager(BaseTableManager):
+    def __init__(self, engine=None, archive=None):
+        super().__init__(engine)
+        # whether the database has JSON1 and the FTS5 index, probed once and shared with the bound copies
+        self.__sqlite_features: Dict[str, bool] = {}
+        # ordered pending tasks, written through after every commit that touches them
+        self.pending_index = PendingTaskIndex()
+        # TaskArchive that archive_tasks moves old history to, get_task falls back to it
+        self.archive = archive
+        # shared with the bound copies, the heartbeat always runs on the engine
+        self.claim_heartbeat = ClaimHeartbeat(self.engine)
+
+    def invalidate_cache(self):
+        self.pending_index.invalidate()
+
+    def bind(self, connection) -> "TaskManager":
+        """Same manager, sharing the pending index, running its queries on `connection`"""
+
+        manager = copy.copy(self)
+        manager.engine = connection
+        # the archive is read with blocking file I/O, AsyncTaskStore reads it off the event loop instead
+        manager.archive = None
+        return manager
+
     def get_task(self, id: str) -> Union[TaskTable, None]:
         session = Session(self.engine)
         try:
             task = session.get(TaskTable, id)
+            if task:
+                return Task.from_table(task)
 
-            return Task.from_table(task) if task else None
+            return self.archive.get_task(id) if self.archive else None
         except Exception as e:
             print(f"Exception getting task from database: {e}")
             raise e
@@ -170,14 +504,24 @@ class TaskManager(BaseTableManager):
             session.close()
 
     def get_task_position(self, id: str) -> int:
+        self.__load_pending_index()
+        position = self.pending_index.position(id)
+        if position is not None:
+            return position
+
         session = Session(self.engine)
         try:
             task = session.get(TaskTable, id)
             if task:
+                # ranked like the pending index and the claim query, NULL bookmarks first
+                bookmarked = func.coalesce(TaskTable.bookmarked, -1, type_=Integer)
                 return (
                     session.query(func.count(TaskTable.id))
                     .filter(TaskTable.status == TaskStatus.PENDING)
-                    .filter(TaskTable.priority < task.priority)
+                    .filter(
+                        tuple_(bookmarked, TaskTable.priority, TaskTable.id)
+                        < tuple_(*get_pending_key(task.id, task.bookmarked, task.priority))
+                    )
                     .scalar()
                 )
             else:
@@ -197,37 +541,87 @@ class TaskManager(BaseTableManager):
         limit: int = None,
         offset: int = None,
         order: str = "asc",
+        cursor: str = None,
+        load_payload: bool = True,
+        q: str = None,
     ) -> List[TaskTable]:
+        """List tasks ordered by bookmarked, priority and id.
+
+        Pass the `cursor` of the last task of a page (see `encode_task_cursor`) to get the next page
+        without scanning the previous ones; `offset` is only applied when no cursor is given.
+        With `load_payload=False` the tasks come without script_params and with the inline images and
+        script args stripped from params, which is all a listing needs.
+        `q` keeps the tasks whose name, prompt or negative prompt contain all its words.
+        """
+
         session = Session(self.engine)
         try:
-            query = session.query(TaskTable)
+            listing_params = None if load_payload else self.__get_listing_params_column(session)
+            if listing_params is None:
+                query = session.query(TaskTable)
+            else:
+                query = session.query(TaskTable, listing_params).options(
+                    defer(TaskTable.params), defer(TaskTable.script_params)
+                )
             if type:
                 query = query.filter(TaskTable.type == type)
 
             if status is not None:
                 if isinstance(status, list):
-                    query = query.filter(TaskTable.status.in_(status))
+                    query = query.filter(self.__status_in(status))
                 else:
                     query = query.filter(TaskTable.status == status)
 
             if api_task_id:
                 query = query.filter(TaskTable.api_task_id == api_task_id)
 
-            if bookmarked == True:
-                query = query.filter(TaskTable.bookmarked == bookmarked)
+            if q and q.strip():
+                query = query.filter(self.__search_filter(session, q))
+
+            if order == "asc":
+                query = query.order_by(TaskTable.priority.asc(), TaskTable.id.asc())
             else:
-                query = query.order_by(TaskTable.bookmarked.asc())
+                query = query.order_by(TaskTable.priority.desc(), TaskTable.id.desc())
 
-            query = query.order_by(TaskTable.priority.asc() if order == "asc" else TaskTable.priority.desc())
+            # every bookmarked segment is read on its own: within one, the rows come in index order in a single
+            # direction, while ordering by bookmarked ascending then priority descending needs a temporary b-tree
+            segments = [True] if bookmarked == True else bookmarked_segments
+            after = decode_task_cursor(cursor) if cursor else None
+            if after is not None:
+                # continue from the segment of the cursor
+                start = bookmarked_segments.index(after[0])
+                segments = [segment for segment in segments if bookmarked_segments.index(segment) >= start]
 
-            if limit:
-                query = query.limit(limit)
+            skip = offset if offset and not cursor else 0
+            all = []
+            for segment in segments:
+                if segment is None:
+                    segment_query = query.filter(TaskTable.bookmarked.is_(None))
+                else:
+                    segment_query = query.filter(TaskTable.bookmarked == segment)
 
-            if offset:
-                query = query.offset(offset)
+                if after is not None and segment is after[0]:
+                    segment_query = segment_query.filter(self.__after_cursor(after, order))
 
-            all = query.all()
-            return [Task.from_table(t) for t in all]
+                rows = segment_query
+                if limit:
+                    rows = rows.limit(limit - len(all))
+                if skip:
+                    rows = rows.offset(skip)
+
+                rows = rows.all()
+                if skip:
+                    # the offset is used up by this segment unless it had no row past it
+                    skip = 0 if len(rows) > 0 else skip - segment_query.order_by(None).count()
+
+                all.extend(rows)
+                if limit and len(all) >= limit:
+                    break
+
+            if listing_params is None:
+                return [Task.from_table(t, params=None if load_payload else t.params) for t in all]
+
+            return [Task.from_table(t, params=params) for t, params in all]
         except Exception as e:
             print(f"Exception getting tasks from database: {e}")
             raise e
@@ -239,35 +633,179 @@ class TaskManager(BaseTableManager):
         type: str = None,
         status: Union[str, List[str]] = None,
         api_task_id: str = None,
+        q: str = None,
     ) -> int:
         session = Session(self.engine)
         try:
-            query = session.query(TaskTable)
+            # the counter table answers everything but api_task_id lookups and searches without scanning tasks
+            if api_task_id or (q and q.strip()):
+                query = session.query(TaskTable)
+                if api_task_id:
+                    query = query.filter(TaskTable.api_task_id == api_task_id)
+                if q and q.strip():
+                    query = query.filter(self.__search_filter(session, q))
+                table = TaskTable
+            else:
+                query = session.query(func.coalesce(func.sum(TaskCounterTable.count), 0))
+                table = TaskCounterTable
+
             if type:
-                query = query.filter(TaskTable.type == type)
+                query = query.filter(table.type == type)
 
             if status is not None:
                 if isinstance(status, list):
-                    query = query.filter(TaskTable.status.in_(status))
+                    query = query.filter(table.status.in_(status))
                 else:
-                    query = query.filter(TaskTable.status == status)
+                    query = query.filter(table.status == status)
 
-            if api_task_id:
-                query = query.filter(TaskTable.api_task_id == api_task_id)
-
-            return query.count()
+            return query.count() if table is TaskTable else query.scalar()
         except Exception as e:
             print(f"Exception counting tasks from database: {e}")
             raise e
         finally:
             session.close()
 
+    def check_counters(self) -> bool:
+        """Compare the maintained counters with the task table, return True if they match"""
+
+        session = Session(self.engine)
+        try:
+            actual = {
+                (row.status, row.type): row.count
+                for row in session.query(TaskTable.status, TaskTable.type, func.count(TaskTable.id).label("count"))
+                .group_by(TaskTable.status, TaskTable.type)
+                .all()
+            }
+            counters = {
+                (row.status, row.type): row.count
+                for row in session.query(TaskCounterTable).filter(TaskCounterTable.count != 0).all()
+            }
+            return actual == counters
+        except Exception as e:
+            print(f"Exception checking task counters in database: {e}")
+            raise e
+        finally:
+            session.close()
+
+    def rebuild_counters(self):
+        """Recount tasks per status and type, e.g. after the counter triggers were (re)created"""
+
+        session = Session(self.engine)
+        try:
+            session.query(TaskCounterTable).delete()
+            session.execute(
+                text(
+                    "INSERT INTO task_counter (status, type, count) "
+                    + "SELECT status, type, COUNT(*) FROM task GROUP BY status, type"
+                )
+            )
+            session.commit()
+        except Exception as e:
+            print(f"Exception rebuilding task counters in database: {e}")
+            raise e
+        finally:
+            session.close()
+
+    def claim_next_task(self) -> Union[Task, None]:
+        """Mark the next pending task as running and return it, None if there is no pending task"""
+
+        # tasks of runners that are gone go back to the queue first
+        self.release_running_tasks()
+        self.__load_pending_index()
+        session = Session(self.engine)
+        try:
+            # the index is only a hint, other processes sharing the database don't update it
+            task_id = self.pending_index.first()
+            if task_id is not None:
+                task = self.__claim_task(session, task_id)
+                if task is not None:
+                    return task
+
+            while True:
+                task_id = (
+                    session.query(TaskTable.id)
+                    .filter(TaskTable.status == TaskStatus.PENDING)
+                    .order_by(TaskTable.bookmarked.asc(), TaskTable.priority.asc(), TaskTable.id.asc())
+                    .limit(1)
+                    .scalar()
+                )
+                if task_id is None:
+                    if self.pending_index.first() is not None:
+                        self.pending_index.invalidate()
+                    return None
+
+                task = self.__claim_task(session, task_id)
+                if task is not None:
+                    # the index missed a change made elsewhere, reload it on next use
+                    self.pending_index.invalidate()
+                    return task
+                # claimed by someone else in the meantime, try the next one
+        except Exception as e:
+            print(f"Exception claiming task from database: {e}")
+            raise e
+        finally:
+            session.close()
+
+    def claim_task(self, id: str) -> Union[Task, None]:
+        """Mark the given pending task as running and return it, None if the task is not pending"""
+
+        session = Session(self.engine)
+        try:
+            return self.__claim_task(session, id)
+        except Exception as e:
+            print(f"Exception claiming task from database: {e}")
+            raise e
+        finally:
+            session.close()
+
+    def release_running_tasks(self) -> int:
+        """Move tasks left running by a runner that is gone (e.g. crashed) back to pending, see is_claim_stale"""
+
+        session = Session(self.engine)
+        try:
+            now = get_timestamp_ms()
+            running = (
+                session.query(TaskTable.id, TaskTable.claimed_by, TaskTable.heartbeat_at)
+                .filter(TaskTable.status == TaskStatus.RUNNING)
+                .all()
+            )
+            stale = [row for row in running if is_claim_stale(row.claimed_by, row.heartbeat_at, now)]
+            if len(stale) == 0:
+                return 0
+
+            # compare-and-set, the claim must not have been refreshed or taken over in the meantime
+            table = TaskTable.__table__
+            stmt = (
+                update(table)
+                .where(table.c.id == bindparam("_id"))
+                .where(table.c.status == TaskStatus.RUNNING)
+                .where(table.c.claimed_by.is_not_distinct_from(bindparam("_claimed_by")))
+                .where(table.c.heartbeat_at.is_not_distinct_from(bindparam("_heartbeat_at")))
+                .values(status=TaskStatus.PENDING, claimed_by=None, heartbeat_at=None)
+            )
+            result = session.execute(
+                stmt,
+                [{"_id": row.id, "_claimed_by": row.claimed_by, "_heartbeat_at": row.heartbeat_at} for row in stale],
+            )
+            session.commit()
+            updated_rows = result.rowcount
+            if updated_rows > 0:
+                self.pending_index.invalidate()
+            return updated_rows
+        except Exception as e:
+            print(f"Exception releasing running tasks in database: {e}")
+            raise e
+        finally:
+            session.close()
+
     def add_task(self, task: Task) -> TaskTable:
         session = Session(self.engine)
         try:
             item = task.to_table()
             session.add(item)
+            BlobManager.retain(session, get_blob_refs(task.params))
             session.commit()
+            self.__index_inserted_tasks([task])
             return task
         except Exception as e:
             print(f"Exception adding task to database: {e}")
@@ -275,6 +813,85 @@ class TaskManager(BaseTableManager):
         finally:
             session.close()
 
+    def add_tasks(self, tasks: List[Task]) -> List[Task]:
+        """Insert many tasks in one transaction"""
+
+        if len(tasks) == 0:
+            return tasks
+
+        session = Session(self.engine)
+        try:
+            session.execute(insert(TaskTable.__table__), [self.__to_mapping(task) for task in tasks])
+            BlobManager.retain(session, [ref for task in tasks for ref in get_blob_refs(task.params)])
+            session.commit()
+            self.__index_inserted_tasks(tasks)
+            return tasks
+        except Exception as e:
+            print(f"Exception adding tasks to database: {e}")
+            raise e
+        finally:
+            session.close()
+
+    def upsert_tasks(self, tasks: List[Task]) -> List[Task]:
+        """Insert many tasks in one transaction, replacing the ones that already exist"""
+
+        if len(tasks) == 0:
+            return tasks
+
+        session = Session(self.engine)
+        try:
+            stmt = sqlite_insert(TaskTable.__table__)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[TaskTable.id],
+                set_={key: getattr(stmt.excluded, key) for key in task_mapping_keys if key != "id"},
+            )
+            replaced_params = self.__get_blob_params(session, [task.id for task in tasks])
+            session.execute(stmt, [self.__to_mapping(task) for task in tasks])
+            BlobManager.retain(session, [ref for task in tasks for ref in get_blob_refs(task.params)])
+            BlobManager.release(session, [ref for params in replaced_params for ref in get_blob_refs(params)])
+            session.commit()
+            self.__index_inserted_tasks(tasks)
+            return tasks
+        except Exception as e:
+            print(f"Exception upserting tasks to database: {e}")
+            raise e
+        finally:
+            session.close()
+
+    def update_status_bulk(self, tasks: List[Task]) -> int:
+        """Write status, result and priority of many tasks in one transaction, leaving the payload untouched"""
+
+        if len(tasks) == 0:
+            return 0
+
+        session = Session(self.engine)
+        try:
+            stmt = (
+                update(TaskTable.__table__)
+                .where(TaskTable.__table__.c.id == bindparam("_id"))
+                .values(status=bindparam("status"), result=bindparam("result"), priority=bindparam("priority"))
+            )
+            session.execute(
+                stmt,
+                [
+                    {"_id": task.id, "status": task.status, "result": task.result, "priority": task.priority}
+                    for task in tasks
+                ],
+            )
+            session.commit()
+            # bookmarked is not written here, invalidate if a task becomes pending
+            if any(task.status == TaskStatus.PENDING for task in tasks):
+                self.pending_index.invalidate()
+            else:
+                for task in tasks:
+                    self.pending_index.remove(task.id)
+            return len(tasks)
+        except Exception as e:
+            print(f"Exception updating tasks in database: {e}")
+            raise e
+        finally:
+            session.close()
+
     def update_task(self, task: Task) -> TaskTable:
         session = Session(self.engine)
         try:
@@ -282,8 +899,17 @@ class TaskManager(BaseTableManager):
             if current is None:
                 raise Exception(f"Task with id {id} not found")
 
-            session.merge(task.to_table())
+            if current.params != task.params:
+                BlobManager.retain(session, get_blob_refs(task.params))
+                BlobManager.release(session, get_blob_refs(current.params))
+
+            merged = session.merge(task.to_table())
+            pending_key = (merged.bookmarked, merged.priority) if merged.status == TaskStatus.PENDING else None
             session.commit()
+            if pending_key is not None:
+                self.pending_index.put(task.id, *pending_key)
+            else:
+                self.pending_index.remove(task.id)
             return task
 
         except Exception as e:
@@ -292,23 +918,50 @@ class TaskManager(BaseTableManager):
         finally:
             session.close()
 
+    def set_status(self, id: str, status: str, priority: int = None) -> bool:
+        """Write only the status (and priority) of a task, return False if the task does not exist"""
+
+        values = {"status": status}
+        if priority is not None:
+            values["priority"] = priority
+
+        return self.__update_columns(id, values)
+
+    def set_result(self, id: str, result: Optional[str], status: str = None) -> bool:
+        """Write only the result (and status) of a task, return False if the task does not exist"""
+
+        values = {"result": result}
+        if status is not None:
+            values["status"] = status
+
+        return self.__update_columns(id, values)
+
+    def set_bookmark(self, id: str, bookmarked: bool) -> bool:
+        return self.__update_columns(id, {"bookmarked": bookmarked})
+
+    def rename(self, id: str, name: Optional[str]) -> bool:
+        return self.__update_columns(id, {"name": name})
+
     def prioritize_task(self, id: str, priority: int) -> TaskTable:
-        """0 means move to top, -1 means move to bottom, otherwise set the exact priority"""
+        """0 means move to top, -1 means move to bottom, otherwise move right before the pending task with that priority"""
 
         session = Session(self.engine)
         try:
             result = session.get(TaskTable, id)
             if result:
+                rebalanced = False
                 if priority == 0:
                     result.priority = self.__get_min_priority(status=TaskStatus.PENDING) - 1
                 elif priority == -1:
                     result.priority = int(datetime.now(timezone.utc).timestamp() * 1000)
                 else:
-                    self.__move_tasks_down(priority)
-                    session.execute(text("SELECT 1"))
-                    result.priority = priority
+                    result.priority, rebalanced = self.__get_priority_before(session, id, priority)
 
                 session.commit()
+                if rebalanced:
+                    self.pending_index.invalidate()
+                elif result.status == TaskStatus.PENDING:
+                    self.pending_index.put(result.id, result.bookmarked, result.priority)
                 return result
             else:
                 raise Exception(f"Task with id {id} not found")
@@ -323,8 +976,10 @@ class TaskManager(BaseTableManager):
         try:
             result = session.get(TaskTable, id)
             if result:
+                BlobManager.release(session, get_blob_refs(result.params))
                 session.delete(result)
                 session.commit()
+                self.pending_index.remove(id)
             else:
                 raise Exception(f"Task with id {id} not found")
         except Exception as e:
@@ -355,8 +1010,13 @@ class TaskManager(BaseTableManager):
                 else:
                     query = query.filter(TaskTable.status == status)
 
-            deleted_rows = query.delete()
+            blob_params = query.filter(TaskTable.params.like('%"blob": "%')).with_entities(TaskTable.params)
+            BlobManager.release(session, [ref for (params,) in blob_params for ref in get_blob_refs(params)])
+
+            deleted_rows = query.delete(synchronize_session=False)
             session.commit()
+            if deleted_rows > 0 and self.__may_include_pending(status):
+                self.pending_index.invalidate()
 
             return deleted_rows
         except Exception as e:
@@ -365,6 +1025,277 @@ class TaskManager(BaseTableManager):
         finally:
             session.close()
 
+    def delete_tasks_in_batches(
+        self,
+        before: datetime = None,
+        status: Union[str, List[str]] = [
+            TaskStatus.DONE,
+            TaskStatus.FAILED,
+            TaskStatus.INTERRUPTED,
+        ],
+        batch_size: int = 500,
+        pause: float = 0.05,
+    ) -> int:
+        """Same as delete_tasks, but commit every `batch_size` rows so other writers are not blocked for long"""
+
+        deleted_rows = 0
+        while True:
+            session = Session(self.engine)
+            try:
+                query = session.query(TaskTable.id, TaskTable.params).filter(TaskTable.bookmarked == False)
+
+                if before:
+                    query = query.filter(TaskTable.created_at < before)
+
+                if status is not None:
+                    if isinstance(status, list):
+                        query = query.filter(TaskTable.status.in_(status))
+                    else:
+                        query = query.filter(TaskTable.status == status)
+
+                rows = query.limit(batch_size).all()
+                if len(rows) == 0:
+                    return deleted_rows
+
+                BlobManager.release(session, [ref for row in rows for ref in get_blob_refs(row.params)])
+                session.query(TaskTable).filter(TaskTable.id.in_([row.id for row in rows])).delete(
+                    synchronize_session=False
+                )
+                session.commit()
+                deleted_rows += len(rows)
+                if self.__may_include_pending(status):
+                    for row in rows:
+                        self.pending_index.remove(row.id)
+            except Exception as e:
+                print(f"Exception deleting tasks from database: {e}")
+                raise e
+            finally:
+                session.close()
+
+            # yield the write lock between batches
+            time.sleep(pause)
+
+    def archive_tasks(
+        self,
+        before: datetime,
+        status: Union[str, List[str]] = [
+            TaskStatus.DONE,
+            TaskStatus.FAILED,
+            TaskStatus.INTERRUPTED,
+        ],
+        batch_size: int = 100,
+        pause: float = 0.05,
+    ) -> int:
+        """Move unbookmarked tasks created before `before` to the archive, in batches like delete_tasks_in_batches"""
+
+        if self.archive is None:
+            raise Exception("No task archive configured")
+
+        archived_rows = 0
+        while True:
+            session = Session(self.engine)
+            try:
+                query = (
+                    session.query(TaskTable)
+                    .filter(TaskTable.bookmarked == False)
+                    .filter(TaskTable.created_at < before)
+                )
+                if isinstance(status, list):
+                    query = query.filter(TaskTable.status.in_(status))
+                else:
+                    query = query.filter(TaskTable.status == status)
+
+                rows = query.limit(batch_size).all()
+                if len(rows) == 0:
+                    return archived_rows
+
+                # images go inline, the blobs are released with the rows
+                tasks = []
+                for row in rows:
+                    task = Task.from_table(row).to_json()
+                    task["params"] = BlobManager.inline_refs(session, task["params"])
+                    tasks.append(task)
+                self.archive.append(tasks)
+
+                BlobManager.release(session, [ref for row in rows for ref in get_blob_refs(row.params)])
+                session.query(TaskTable).filter(TaskTable.id.in_([row.id for row in rows])).delete(
+                    synchronize_session=False
+                )
+                session.commit()
+                archived_rows += len(rows)
+            except Exception as e:
+                print(f"Exception archiving tasks from database: {e}")
+                raise e
+            finally:
+                session.close()
+
+            # yield the write lock between batches
+            time.sleep(pause)
+
+    def __update_columns(self, id: str, values: Dict) -> bool:
+        # a single UPDATE of the given columns, the payload columns are neither read nor rewritten
+        session = Session(self.engine)
+        try:
+            updated_rows = (
+                session.query(TaskTable).filter(TaskTable.id == id).update(values, synchronize_session=False)
+            )
+
+            pending_key = None
+            reindex = updated_rows > 0 and any(key in values for key in ["status", "bookmarked", "priority"])
+            if reindex:
+                row = (
+                    session.query(TaskTable.status, TaskTable.bookmarked, TaskTable.priority)
+                    .filter(TaskTable.id == id)
+                    .first()
+                )
+                pending_key = (row.bookmarked, row.priority) if row.status == TaskStatus.PENDING else None
+
+            session.commit()
+            if reindex:
+                if pending_key is not None:
+                    self.pending_index.put(id, *pending_key)
+                else:
+                    self.pending_index.remove(id)
+
+            return updated_rows > 0
+        except Exception as e:
+            print(f"Exception updating task in database: {e}")
+            raise e
+        finally:
+            session.close()
+
+    def __load_pending_index(self):
+        def load():
+            session = Session(self.engine)
+            try:
+                return (
+                    session.query(TaskTable.id, TaskTable.bookmarked, TaskTable.priority)
+                    .filter(TaskTable.status == TaskStatus.PENDING)
+                    .all()
+                )
+            except Exception as e:
+                print(f"Exception loading pending tasks from database: {e}")
+                raise e
+            finally:
+                session.close()
+
+        self.pending_index.ensure_loaded(load)
+
+    def __index_inserted_tasks(self, tasks: List[Task]):
+        for task in tasks:
+            if task.status == TaskStatus.PENDING:
+                # inserts store a missing bookmarked as false
+                self.pending_index.put(task.id, bool(task.bookmarked), task.priority)
+            else:
+                self.pending_index.remove(task.id)
+
+    def __may_include_pending(self, status: Union[str, List[str], None]) -> bool:
+        if status is None:
+            return True
+        if isinstance(status, list):
+            return TaskStatus.PENDING in status
+        return status == TaskStatus.PENDING
+
+    def __get_blob_params(self, session: Session, ids: List[str]) -> List[str]:
+        """Params of the given tasks that reference blobs"""
+
+        params = []
+        for i in range(0, len(ids), 500):
+            rows = (
+                session.query(TaskTable.params)
+                .filter(TaskTable.id.in_(ids[i : i + 500]))
+                .filter(TaskTable.params.like('%"blob": "%'))
+                .all()
+            )
+            params.extend(row.params for row in rows)
+
+        return params
+
+    def __to_mapping(self, task: Task) -> Dict:
+        # every row needs the same keys for executemany
+        mapping = {key: getattr(task, key) for key in task_mapping_keys}
+        mapping["bookmarked"] = bool(task.bookmarked)
+        mapping["summary"] = get_task_summary(task.params)
+        return mapping
+
+    def __get_listing_params_column(self, session: Session):
+        # json_remove needs the sqlite JSON1 extension, fall back to loading full rows without it
+        features = self.__sqlite_features
+        if "json" not in features:
+            try:
+                session.execute(text("SELECT json_remove('{}', '$.a')"))
+                features["json"] = True
+            except Exception:
+                print("SQLite JSON1 extension is not available, task listings will load full rows")
+                features["json"] = False
+
+        if not features["json"]:
+            return None
+
+        # tasks with a summary don't need their params at all
+        return case(
+            (TaskTable.summary.is_(None), func.json_remove(TaskTable.params, *listing_excluded_params)),
+            else_="{}",
+        ).label("listing_params")
+
+    def __search_filter(self, session: Session, q: str):
+        features = self.__sqlite_features
+        if "search" not in features:
+            features["search"] = (
+                session.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'task_fts'")).first()
+                is not None
+            )
+            if not features["search"]:
+                print("SQLite FTS5 index is not available, task search will scan the task table")
+
+        if not features["search"]:
+            pattern = f"%{q.strip()}%"
+            return or_(TaskTable.name.like(pattern), TaskTable.params.like(pattern))
+
+        return text(
+            "task.id IN (SELECT task_fts_key.task_id FROM task_fts "
+            + "JOIN task_fts_key ON task_fts_key.fts_rowid = task_fts.rowid WHERE task_fts MATCH :search_query)"
+        ).bindparams(search_query=to_search_query(q))
+
+    def __status_in(self, status: List[str]):
+        # inlined instead of bound, sqlite only uses a partial index when the query has its literal where clause
+        if set(status) == set(history_statuses):
+            status = history_statuses
+
+        values = [getattr(value, "value", value) for value in status]
+        return TaskTable.status.in_(bindparam("status_in", values, expanding=True, literal_execute=True))
+
+    def __after_cursor(self, cursor: Tuple[Optional[bool], int, str], order: str):
+        # rows of the cursor's bookmarked segment that come after it, as a row value so sqlite can seek the index to it
+        _, priority, id = cursor
+        key = tuple_(TaskTable.priority, TaskTable.id)
+        return key > tuple_(priority, id) if order == "asc" else key < tuple_(priority, id)
+
+    def __claim_task(self, session: Session, id: str) -> Union[Task, None]:
+        # compare-and-set so that only one caller can move the task out of pending
+        claimed = (
+            session.query(TaskTable)
+            .filter(TaskTable.id == id)
+            .filter(TaskTable.status == TaskStatus.PENDING)
+            .update(
+                {
+                    TaskTable.status: TaskStatus.RUNNING,
+                    TaskTable.claimed_by: runner_id,
+                    TaskTable.heartbeat_at: get_timestamp_ms(),
+                },
+                synchronize_session=False,
+            )
+        )
+        if claimed != 1:
+            session.rollback()
+            return None
+
+        task = Task.from_table(session.get(TaskTable, id))
+        session.commit()
+        self.pending_index.remove(id)
+        self.claim_heartbeat.start()
+        return task
+
     def __get_min_priority(self, status: str = None) -> int:
         session = Session(self.engine)
         try:
@@ -380,15 +1311,68 @@ class TaskManager(BaseTableManager):
         finally:
             session.close()
 
-    def __move_tasks_down(self, priority: int):
-        session = Session(self.engine)
-        try:
-            session.query(TaskTable).filter(TaskTable.priority >= priority).update(
-                {TaskTable.priority: TaskTable.priority + 1}
-            )
-            session.commit()
-        except Exception as e:
-            print(f"Exception moving tasks down in database: {e}")
-            raise e
-        finally:
-            session.close()
+    def __get_priority_before(self, session: Session, id: str, priority: int) -> Tuple[int, bool]:
+        """
+        Pick a priority between the pending task at `priority` and its predecessor, so only the moved row changes
+        Also tell whether the other pending tasks had to be renumbered
+        """
+
+        over = self.__get_pending_at_or_after(session, id, priority)
+        if over is None:
+            return priority, False
+
+        new_priority = self.__get_gap_priority(session, id, over.priority)
+        if new_priority is not None:
+            return new_priority, False
+
+        # no room left between neighbours, spread out the pending tasks and try again
+        self.__rebalance_pending_tasks(session, exclude_id=id)
+        session.refresh(over)
+        return self.__get_gap_priority(session, id, over.priority), True
+
+    def __get_pending_at_or_after(self, session: Session, id: str, priority: int) -> Union[TaskTable, None]:
+        return (
+            session.query(TaskTable)
+            .filter(TaskTable.status == TaskStatus.PENDING)
+            .filter(TaskTable.priority >= priority)
+            .filter(TaskTable.id != id)
+            .order_by(TaskTable.priority.asc())
+            .first()
+        )
+
+    def __get_gap_priority(self, session: Session, id: str, priority: int) -> Union[int, None]:
+        prev_priority = (
+            session.query(func.max(TaskTable.priority))
+            .filter(TaskTable.status == TaskStatus.PENDING)
+            .filter(TaskTable.priority < priority)
+            .filter(TaskTable.id != id)
+            .scalar()
+        )
+        if prev_priority is None:
+            return priority - PRIORITY_GAP
+        if priority - prev_priority > 1:
+            return prev_priority + (priority - prev_priority) // 2
+
+        return None
+
+    def __rebalance_pending_tasks(self, session: Session, exclude_id: str = None):
+        """Renumber pending tasks PRIORITY_GAP apart, keeping their order and the last task's priority"""
+
+        rows = (
+            session.query(TaskTable.id, TaskTable.priority)
+            .filter(TaskTable.status == TaskStatus.PENDING)
+            .filter(TaskTable.id != exclude_id)
+            .order_by(TaskTable.priority.asc(), TaskTable.created_at.asc())
+            .all()
+        )
+        if len(rows) == 0:
+            return
+
+        # only spread downwards so rebalanced tasks stay ahead of newly queued ones
+        last_priority = rows[-1].priority
+        mappings = [
+            {"id": row.id, "priority": last_priority - (len(rows) - 1 - i) * PRIORITY_GAP}
+            for i, row in enumerate(rows)
+        ]
+        session.bulk_update_mappings(TaskTable, mappings)
+        session.flush()
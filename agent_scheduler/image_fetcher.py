@@ -0,0 +1,162 @@
+import os
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from modules import scripts
+from modules import shared
+
+from .helpers import log
+
+image_cache_dir = getattr(shared.cmd_opts, "agent_scheduler_image_cache_dir", None) or "image_cache"
+if not os.path.isabs(image_cache_dir):
+    image_cache_dir = os.path.join(scripts.basedir(), image_cache_dir)
+image_cache_size_mb: int = getattr(shared.cmd_opts, "agent_scheduler_image_cache_size", 512)
+
+
+def is_image_url(value) -> bool:
+    return isinstance(value, str) and (value.startswith("http://") or value.startswith("https://"))
+
+
+class ImageFetcher:
+    """
+    Downloads the remote images of enqueued tasks
+    One connection-pooled session with timeouts, at most `max_workers` downloads at a time, and an on-disk LRU
+    cache keyed by URL that is revalidated with ETag/Last-Modified before use
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        cache_size: int,
+        max_workers: int = 8,
+        timeout: Tuple[float, float] = (5, 30),
+    ):
+        self.cache_dir = cache_dir
+        self.cache_size = cache_size
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agent_scheduler_fetch")
+        self.__evict_lock = threading.Lock()
+
+    def fetch(self, url: str) -> Optional[bytes]:
+        """
+        Image data at url, raises requests.HTTPError if the server answers with an error status
+        When the server can't be reached the cached copy is used, None if there is none
+        """
+
+        cached = self.__read_cache(url)
+        headers = {}
+        if cached is not None:
+            meta, _ = cached
+            if meta.get("etag", None):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified", None):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        try:
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            if cached is not None:
+                log.warning(f"[AgentScheduler] Error downloading image from url, using the cached copy: {e}")
+                return cached[1]
+
+            log.error(f"[AgentScheduler] Error downloading image from url: {e}")
+            return None
+
+        if response.status_code == 304 and cached is not None:
+            self.__touch(url)
+            return cached[1]
+
+        # the server is up, a removed or broken url must not keep serving the cached image
+        response.raise_for_status()
+        self.__write_cache(url, response)
+        return response.content
+
+    def fetch_all(self, urls: List[str]) -> Dict[str, Optional[bytes]]:
+        """Download the urls concurrently, the call takes about as long as the slowest one"""
+
+        urls = list(dict.fromkeys(urls))
+        if len(urls) <= 1:
+            return {url: self.fetch(url) for url in urls}
+
+        futures = {url: self.executor.submit(self.fetch, url) for url in urls}
+        return {url: future.result() for url, future in futures.items()}
+
+    def __cache_path(self, url: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha256(url.encode("utf-8")).hexdigest())
+
+    def __read_cache(self, url: str) -> Optional[Tuple[Dict, bytes]]:
+        # a cache file is a json header line followed by the image data
+        try:
+            with open(self.__cache_path(url), "rb") as f:
+                meta = json.loads(f.readline())
+                return meta, f.read()
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log.debug(f"[AgentScheduler] Ignoring broken image cache entry: {e}")
+            return None
+
+    def __write_cache(self, url: str, response: requests.Response):
+        etag = response.headers.get("ETag", None)
+        last_modified = response.headers.get("Last-Modified", None)
+        # without a validator the copy could never be revalidated
+        if (etag is None and last_modified is None) or "no-store" in response.headers.get("Cache-Control", ""):
+            return
+
+        path = self.__cache_path(url)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(temp_path, "wb") as f:
+                f.write(json.dumps({"url": url, "etag": etag, "last_modified": last_modified}).encode("utf-8"))
+                f.write(b"\n")
+                f.write(response.content)
+            os.replace(temp_path, path)
+        except Exception as e:
+            log.warning(f"[AgentScheduler] Could not cache image: {e}")
+            return
+
+        self.__evict()
+
+    def __touch(self, url: str):
+        try:
+            os.utime(self.__cache_path(url))
+        except OSError:
+            pass
+
+    def __evict(self):
+        # least recently used first, hits refresh the modification time
+        with self.__evict_lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.cache_dir):
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+
+            if total <= self.cache_size:
+                return
+
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.cache_size:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+
+image_fetcher = ImageFetcher(image_cache_dir, image_cache_size_mb * 1024 * 1024)
@@ -20,6 +20,12 @@ def transform_to_utc_datetime(dt: datetime) -> datetime:
 class QueueStatusAPI(BaseModel):
     limit: Optional[int] = Field(title="Limit", description="The maximum number of tasks to return", default=20)
     offset: Optional[int] = Field(title="Offset", description="The offset of the tasks to return", default=0)
+    cursor: Optional[str] = Field(
+        title="Cursor", description="The next_cursor of the previous page, takes precedence over offset", default=None
+    )
+    q: Optional[str] = Field(
+        title="Search", description="Only tasks whose name, prompt or negative prompt contain these words", default=None
+    )
 
 
 class TaskModel(BaseModel):
@@ -38,6 +44,11 @@ class TaskModel(BaseModel):
     position: Optional[int] = Field(title="Task Position")
     result: Optional[str] = Field(title="Task Result", description="The result of the task in JSON format")
     bookmarked: Optional[bool] = Field(title="Is task bookmarked")
+    archived: Optional[bool] = Field(
+        title="Is task archived",
+        description="Archived tasks are read-only, they can only be deleted",
+        default=False,
+    )
     created_at: Optional[datetime] = Field(
         title="Task Created At",
         description="The time when the task was created",
@@ -111,6 +122,9 @@ class QueueStatusResponse(BaseModel):
     pending_tasks: List[TaskModel] = Field(title="Pending Tasks", description="The pending tasks in the queue")
     total_pending_tasks: int = Field(title="Queue length", description="The total pending tasks in the queue")
     paused: bool = Field(title="Paused", description="Whether the queue is paused")
+    next_cursor: Optional[str] = Field(
+        title="Next Cursor", description="Pass as cursor to get the next page, empty if this is the last page"
+    )
 
     class Config:
         json_encoders = {datetime: lambda dt: int(dt.timestamp() * 1e3)}
@@ -119,6 +133,9 @@ class QueueStatusResponse(BaseModel):
 class HistoryResponse(BaseModel):
     tasks: List[TaskModel] = Field(title="Tasks")
     total: int = Field(title="Task count")
+    next_cursor: Optional[str] = Field(
+        title="Next Cursor", description="Pass as cursor to get the next page, empty if this is the last page"
+    )
 
     class Config:
         json_encoders = {datetime: lambda dt: int(dt.timestamp() * 1e3)}
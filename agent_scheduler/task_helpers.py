@@ -1,14 +1,14 @@
 import io
+import os
 import zlib
 import base64
-import pickle
+import hashlib
 import inspect
-import requests
 import numpy as np
 import torch
-from typing import Union, List, Dict
+from typing import Any, Callable, Optional, Union, List, Dict, Tuple
 from enum import Enum
-from PIL import Image, ImageOps, ImageChops, ImageEnhance, ImageFilter, PngImagePlugin
+from PIL import Image, ImageOps, ImageChops, ImageEnhance, ImageFilter, PngImagePlugin, features
 from numpy import ndarray
 from torch import Tensor
 
@@ -20,7 +20,17 @@ from modules.api.models import (
     StableDiffusionImg2ImgProcessingAPI,
 )
 
+from .db import blob_manager, memory_store, get_sidecar_path
+from .codec import encode_script_args, decode_script_args
 from .helpers import log, get_dict_attribute
+from .image_fetcher import image_fetcher, is_image_url
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+webp_supported = features.check("webp")
 
 img2img_image_args_by_mode: Dict[int, List[List[str]]] = {
     0: [["init_img"]],
@@ -31,32 +41,57 @@ img2img_image_args_by_mode: Dict[int, List[List[str]]] = {
 }
 
 
-def get_script_by_name(script_name: str, is_img2img: bool = False, is_always_on: bool = False) -> scripts.Script:
+# every enqueue and execution maps args by the same few signatures and script titles, they only change on ui reload
+arg_spec_cache: Dict[Callable, inspect.FullArgSpec] = {}
+scripts_by_name_cache: Dict[Tuple[bool, bool], Tuple[Any, Dict[str, scripts.Script]]] = {}
+
+
+def clear_task_args_caches():
+    arg_spec_cache.clear()
+    scripts_by_name_cache.clear()
+
+
+def get_arg_spec(fn: Callable) -> inspect.FullArgSpec:
+    # bound methods are new objects on every access, key them by their function (the spec keeps self either way)
+    key = getattr(fn, "__func__", fn)
+    spec = arg_spec_cache.get(key, None)
+    if spec is None:
+        spec = inspect.getfullargspec(fn)
+        arg_spec_cache[key] = spec
+
+    return spec
+
+
+def get_scripts_by_name(is_img2img: bool = False, is_always_on: bool = False) -> Dict[str, scripts.Script]:
+    """Scripts of the txt2img or img2img runner by lowercase title"""
+
     script_runner = scripts.scripts_img2img if is_img2img else scripts.scripts_txt2img
+    cached = scripts_by_name_cache.get((is_img2img, is_always_on), None)
+    if cached is not None and cached[0] is script_runner:
+        return cached[1]
+
     available_scripts = script_runner.alwayson_scripts if is_always_on else script_runner.selectable_scripts
+    by_name: Dict[str, scripts.Script] = {}
+    for s in available_scripts:
+        # the first script with a title wins, like the linear scan did
+        by_name.setdefault(s.title().lower(), s)
 
-    return next(
-        (s for s in available_scripts if s.title().lower() == script_name.lower()),
-        None,
-    )
+    scripts_by_name_cache[(is_img2img, is_always_on)] = (script_runner, by_name)
+    return by_name
 
 
-def load_image_from_url(url: str):
-    try:
-        response = requests.get(url)
-        buffer = io.BytesIO(response.content)
-        return Image.open(buffer)
-    except Exception as e:
-        log.error(f"[AgentScheduler] Error downloading image from url: {e}")
-        return None
+def get_script_by_name(script_name: str, is_img2img: bool = False, is_always_on: bool = False) -> scripts.Script:
+    return get_scripts_by_name(is_img2img, is_always_on).get(script_name.lower(), None)
+
 
+def encode_image_to_base64(image, fetched: Dict[str, Optional[bytes]] = None):
+    """`fetched` holds url images already downloaded with image_fetcher.fetch_all"""
 
-def encode_image_to_base64(image):
     if isinstance(image, np.ndarray):
         image = Image.fromarray(image.astype("uint8"))
-    elif isinstance(image, str):
-        if image.startswith("http://") or image.startswith("https://"):
-            image = load_image_from_url(image)
+    elif is_image_url(image):
+        data = fetched[image] if fetched is not None and image in fetched else image_fetcher.fetch(image)
+        return encode_image_bytes_to_base64(data) if data is not None else None
 
     if not isinstance(image, Image.Image):
         return image
@@ -66,74 +101,256 @@ def encode_image_to_base64(image):
     if geninfo:
         pnginfo.add_text("parameters", geninfo)
 
+    compress_level = int(getattr(shared.opts, "queue_png_compress_level", 6))
     with io.BytesIO() as output_bytes:
         if geninfo:
-            image.save(output_bytes, format="PNG", pnginfo=pnginfo)
+            image.save(output_bytes, format="PNG", pnginfo=pnginfo, compress_level=compress_level)
         else:
-            image.save(output_bytes, format="PNG") # remove pnginfo to save space
+            image.save(output_bytes, format="PNG", compress_level=compress_level) # remove pnginfo to save space
         bytes_data = output_bytes.getvalue()
         return "data:image/png;base64," + base64.b64encode(bytes_data).decode("utf-8")
 
 
+png_signature = b"\x89PNG\r\n\x1a\n"
+
+
+def encode_image_bytes_to_base64(data: bytes):
+    """Like encode_image_to_base64 for encoded image data, PNG data is sent as it is, with its own infotext"""
+
+    if data.startswith(png_signature):
+        return "data:image/png;base64," + base64.b64encode(data).decode("utf-8")
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            return encode_image_to_base64(image)
+    except Exception as e:
+        log.error(f"[AgentScheduler] Error reading image: {e}")
+        return None
+
+
+def encode_image_file_to_base64(path: str):
+    """Same as encode_image_bytes_to_base64 for an image file"""
+
+    with open(path, "rb") as f:
+        return encode_image_bytes_to_base64(f.read())
+
+
+# lossless codecs for the pixels of serialized images, the payload records the one used in "codec"
+# png and webp only take 8-bit images, anything else falls back to compressing the raw pixels
+image_codecs = ["webp", "png", "zstd", "zlib"]
+png_modes = ["1", "L", "LA", "P", "RGB", "RGBA"]
+webp_modes = ["RGB", "RGBA"]
+webp_max_size = 16383
+
+
+def get_image_codec() -> str:
+    codec = getattr(shared.opts, "queue_image_codec", "webp")
+    if codec not in image_codecs:
+        return "webp"
+    if codec == "webp" and not webp_supported:
+        return "png"
+    if codec == "zstd" and zstandard is None:
+        return "zlib"
+
+    return codec
+
+
+def compress_raw_image_data(data: bytes, codec: str):
+    if codec == "zstd" and zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=3).compress(data)
+
+    return "zlib", zlib.compress(data)
+
+
+def compress_image(image: Image.Image, codec: str):
+    """Losslessly encode a PIL image, return the codec actually used and the data"""
+
+    # the raw pixels of a palette image mean nothing without its palette
+    if codec in ["webp", "png"] or image.mode == "P":
+        with io.BytesIO() as output:
+            if codec == "webp" and image.mode in webp_modes and max(image.size) <= webp_max_size:
+                # exact keeps the color of transparent pixels, method 0 is by far the fastest lossless effort
+                image.save(output, format="WEBP", lossless=True, quality=0, method=0, exact=True)
+                return "webp", output.getvalue()
+            if image.mode in png_modes:
+                image.save(output, format="PNG", compress_level=1)
+                return "png", output.getvalue()
+
+    return compress_raw_image_data(image.tobytes(), codec)
+
+
+def decompress_image(data: bytes, mode: str) -> Image.Image:
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    # webp has no grayscale and drops an opaque alpha channel
+    return image if image.mode == mode else image.convert(mode)
+
+
+def decompress_raw_image_data(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise Exception("Image was serialized with zstd, install the zstandard package to load it")
+        return zstandard.ZstdDecompressor().decompress(data)
+
+    return zlib.decompress(data)
+
+
+def get_array_sidecar_threshold() -> Union[int, None]:
+    """Arrays of at least this many bytes are stored as .npy sidecar files, None if disabled"""
+
+    if memory_store:
+        # the files would outlive the tasks, keep the arrays in the in-memory blob table
+        return None
+
+    threshold_mb = getattr(shared.opts, "queue_array_sidecar_threshold", 1)
+    return int(threshold_mb * 1024 * 1024) if threshold_mb > 0 else None
+
+
+def put_array_sidecar(array: np.ndarray) -> str:
+    array = array if array.flags.c_contiguous else np.ascontiguousarray(array)
+    hasher = hashlib.sha256(f"{array.dtype.str}{array.shape}".encode("utf-8"))
+    hasher.update(array.reshape(-1).view(np.uint8))
+    return blob_manager.put_sidecar(hasher.hexdigest(), lambda f: np.save(f, array, allow_pickle=False))
+
+
+def load_array_sidecar(image_str: Dict, mmap_mode: str) -> np.ndarray:
+    # exported tasks carry the .npy file inline
+    if image_str.get("blob", None) is None:
+        return np.load(io.BytesIO(base64.b64decode(image_str["data"])), allow_pickle=False)
+
+    path = get_sidecar_path(image_str["blob"])
+    if not os.path.exists(path):
+        raise Exception(f"Array file {path} not found")
+
+    return np.load(path, mmap_mode=mmap_mode, allow_pickle=False)
+
+
 def serialize_image(image):
+    """
+    Serialize an image, the compressed pixels are stored once in the blob store and referenced by hash
+    Large arrays and tensors go uncompressed to a .npy file instead, so they load back memory-mapped
+    """
+
+    codec = get_image_codec()
+    threshold = get_array_sidecar_threshold()
+    if isinstance(image, (np.ndarray, torch.Tensor)) and threshold is not None:
+        image_np = image if isinstance(image, np.ndarray) else image.detach().cpu().numpy()
+        if image_np.nbytes >= threshold and not image_np.dtype.hasobject:
+            serialized = {
+                "shape": image_np.shape,
+                "blob": put_array_sidecar(image_np),
+                "cls": "ndarray" if isinstance(image, np.ndarray) else "Tensor",
+                "dtype": str(image_np.dtype),
+                "codec": "npy",
+            }
+            if isinstance(image, torch.Tensor):
+                serialized["device"] = image.device.type
+            return serialized
+
     if isinstance(image, np.ndarray):
         shape = image.shape
         dtype = image.dtype
-        data = base64.b64encode(zlib.compress(image.tobytes())).decode()
-        return {"shape": shape, "data": data, "cls": "ndarray", "dtype": str(dtype)}
+        if dtype == np.uint8 and (image.ndim == 2 or (image.ndim == 3 and shape[2] in [3, 4])):
+            codec, data = compress_image(Image.fromarray(image), codec)
+        else:
+            codec, data = compress_raw_image_data(image.tobytes(), codec)
+        blob = blob_manager.put(data)
+        return {"shape": shape, "blob": blob, "cls": "ndarray", "dtype": str(dtype), "codec": codec}
     elif isinstance(image, torch.Tensor):
         shape = image.shape
-        dtype = image.dtype
-        data = base64.b64encode(zlib.compress(image.detach().numpy().tobytes())).decode()
+        image_np = image.detach().cpu().numpy()
+        codec, data = compress_raw_image_data(image_np.tobytes(), codec)
+        blob = blob_manager.put(data)
         return {
             "shape": shape,
-            "data": data,
+            "blob": blob,
             "cls": "Tensor",
             "device": image.device.type,
-            "dtype": str(dtype),
+            "dtype": str(image_np.dtype),
+            "codec": codec,
         }
     elif isinstance(image, Image.Image):
         size = image.size
         mode = image.mode
-        data = base64.b64encode(zlib.compress(image.tobytes())).decode()
+        codec, data = compress_image(image, codec)
+        blob = blob_manager.put(data)
         return {
             "size": size,
             "mode": mode,
-            "data": data,
+            "blob": blob,
             "cls": "Image",
+            "codec": codec,
         }
     else:
         return image
 
 
+def load_serialized_image_data(image_str: Dict) -> bytes:
+    """Stored data of a serialized image, still encoded with its codec"""
+
+    # images serialized before the blob store keep their data inline
+    if image_str.get("blob", None) is None:
+        return base64.b64decode(image_str["data"])
+
+    blob = blob_manager.get(image_str["blob"])
+    if blob is None:
+        raise Exception(f"Image blob {image_str['blob']} not found")
+
+    return blob
+
+
 def deserialize_image(image_str):
     if isinstance(image_str, dict) and image_str.get("cls", None):
         cls = image_str["cls"]
-        data = zlib.decompress(base64.b64decode(image_str["data"]))
+        # payloads from before the codecs are zlib
+        codec = image_str.get("codec", "zlib")
+        if codec == "npy":
+            if cls == "Tensor":
+                # copy-on-write, tensors expect writable memory
+                image_np = load_array_sidecar(image_str, mmap_mode="c")
+                return torch.from_numpy(image_np).to(device=image_str.get("device", "cpu"))
+
+            return load_array_sidecar(image_str, mmap_mode="r")
+
+        data = load_serialized_image_data(image_str)
 
         if cls == "ndarray":
             # warn if required fields are missing
             if image_str.get("dtype", None) is None:
                 log.warning(f"Missing dtype for ndarray")
             shape = tuple(image_str["shape"])
+            if codec in ["webp", "png"]:
+                mode = "L" if len(shape) == 2 else ("RGB" if shape[2] == 3 else "RGBA")
+                return np.array(decompress_image(data, mode))
+
             dtype = np.dtype(image_str.get("dtype", "uint8"))
-            image = np.frombuffer(data, dtype=dtype)
+            image = np.frombuffer(decompress_raw_image_data(data, codec), dtype=dtype)
             return image.reshape(shape)
         elif cls == "Tensor":
             if image_str.get("device", None) is None:
                 log.warning(f"Missing device for Tensor")
             shape = tuple(image_str["shape"])
-            dtype = np.dtype(image_str.get("dtype", "uint8"))
-            image_np = np.frombuffer(data, dtype=dtype)
+            # older payloads recorded the torch dtype name
+            dtype = np.dtype(image_str.get("dtype", "uint8").replace("torch.", ""))
+            image_np = np.frombuffer(decompress_raw_image_data(data, codec), dtype=dtype)
             return torch.from_numpy(image_np.reshape(shape)).to(device=image_str.get("device", "cpu"))
         else:
             size = tuple(image_str["size"])
             mode = image_str["mode"]
-            return Image.frombytes(mode, size, data)
+            if codec in ["webp", "png"]:
+                return decompress_image(data, mode)
+
+            return Image.frombytes(mode, size, decompress_raw_image_data(data, codec))
     else:
         return image_str
 
 
+def inline_image_blobs(value):
+    """Replace blob references with inline data, so that exported tasks can be imported elsewhere"""
+
+    return blob_manager.inline(value)
+
+
 def serialize_img2img_image_args(args: Dict):
     for mode, image_args in img2img_image_args_by_mode.items():
         for keys in image_args:
@@ -166,18 +383,6 @@ def deserialize_img2img_image_args(args: Dict):
                 args[keys[0]] = value
 
 
-def serialize_controlnet_args(cnet_unit):
-    args: Dict = cnet_unit.__dict__
-    serialized_args = {"is_cnet": True}
-    for k, v in args.items():
-        if isinstance(v, Enum):
-            serialized_args[k] = v.value
-        else:
-            serialized_args[k] = v
-
-    return serialized_args
-
-
 def deserialize_controlnet_args(args: Dict):
     new_args = args.copy()
     new_args.pop("is_cnet", None)
@@ -187,17 +392,13 @@ def deserialize_controlnet_args(args: Dict):
 
 
 def serialize_script_args(script_args: List):
-    # convert UiControlNetUnit to dict to make it serializable
-    for i, a in enumerate(script_args):
-        if type(a).__name__ == "UiControlNetUnit":
-            script_args[i] = serialize_controlnet_args(a)
-
-    return zlib.compress(pickle.dumps(script_args))
+    # UiControlNetUnit is stored as the dict of its fields, see codec.py
+    return encode_script_args(script_args)
 
 
 def deserialize_script_args(script_args: Union[bytes, List], UiControlNetUnit = None):
     if type(script_args) is bytes:
-        script_args = pickle.loads(zlib.decompress(script_args))
+        script_args = decode_script_args(script_args)
 
     for i, a in enumerate(script_args):
         if isinstance(a, dict) and a.get("is_cnet", False):
@@ -207,6 +408,9 @@ def deserialize_script_args(script_args: Union[bytes, List], UiControlNetUnit =
                 u = UiControlNetUnit()
                 for k, v in unit.items():
                     if isinstance(getattr(u, k, None), Enum):
+                        # members are stored with their enum, older rows only have the value
+                        if isinstance(v, Enum):
+                            v = v.value
                         # check if v is a valid enum value
                         enum_obj: Enum= getattr(u, k)
                         if v not in [e.value for e in enum_obj.__class__]:
@@ -244,7 +448,7 @@ def map_ui_task_args_list_to_named_args(args: List, is_img2img: bool):
         if is_img2img
         else getattr(txt2img, "txt2img_create_processing", txt2img.txt2img)
     )
-    arg_names = inspect.getfullargspec(fn).args
+    arg_names = get_arg_spec(fn).args
 
     # SD WebUI 1.5.0 has new request arg
     if "request" in arg_names:
@@ -281,7 +485,7 @@ def map_named_args_to_ui_task_args_list(named_args: Dict, script_args: List, is_
         if is_img2img
         else getattr(txt2img, "txt2img_create_processing", txt2img.txt2img)
     )
-    arg_names = inspect.getfullargspec(fn).args
+    arg_names = get_arg_spec(fn).args
 
     sampler_name = named_args.get("sampler_name", None)
     if sampler_name is not None:
@@ -305,7 +509,7 @@ def map_script_args_list_to_named(script: scripts.Script, args: List):
         return args
 
     fn = script.process if script.alwayson else script.run
-    inspection = inspect.getfullargspec(fn)
+    inspection = get_arg_spec(fn)
     arg_names = inspection.args[2:]
     named_script_args = dict(zip(arg_names, args[: len(arg_names)]))
     if inspection.varargs is not None:
@@ -319,7 +523,7 @@ def map_named_script_args_to_list(script: scripts.Script, named_args: Union[dict
 
     if isinstance(named_args, dict):
         fn = script.process if script.alwayson else script.run
-        inspection = inspect.getfullargspec(fn)
+        inspection = get_arg_spec(fn)
         arg_names = inspection.args[2:]
         args = [named_args.get(name, None) for name in arg_names]
         if inspection.varargs is not None:
@@ -454,8 +658,7 @@ def serialize_api_task_args(
     alwayson_scripts = get_dict_attribute(params, "alwayson_scripts", {})
     assert type(alwayson_scripts) is dict
 
-    script_runner = scripts.scripts_img2img if is_img2img else scripts.scripts_txt2img
-    allowed_alwayson_scripts = {s.title().lower(): s for s in script_runner.alwayson_scripts}
+    allowed_alwayson_scripts = get_scripts_by_name(is_img2img, is_always_on=True)
 
     valid_alwayson_scripts = {}
     for script_name, script_args in alwayson_scripts.items():
@@ -499,10 +702,12 @@ def serialize_api_task_args(
         if len(init_images) == 0:
             raise Exception("At least one init image is required")
 
+        # download the url images at the same time instead of one after another
+        fetched = image_fetcher.fetch_all([image for image in init_images + [args.mask] if is_image_url(image)])
         for i, image in enumerate(init_images):
-            init_images[i] = encode_image_to_base64(image)
+            init_images[i] = encode_image_to_base64(image, fetched)
 
-        args.mask = encode_image_to_base64(args.mask)
+        args.mask = encode_image_to_base64(args.mask, fetched)
         if len(init_images) > 1:
             args.batch_size = len(init_images)
 
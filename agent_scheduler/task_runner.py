@@ -11,7 +11,6 @@ from datetime import datetime, timezone
 from pydantic import BaseModel
 from typing import Any, Callable, Union, Optional, List, Dict
 from fastapi import FastAPI
-from PIL import Image
 
 from modules import progress, shared, script_callbacks
 from modules.call_queue import queue_lock, wrap_gradio_call
@@ -23,7 +22,7 @@ from modules.api.models import (
     StableDiffusionImg2ImgProcessingAPI,
 )
 
-from .db import TaskStatus, Task, task_manager
+from .db import TaskStatus, Task, TaskStore, TaskEventType, task_store, task_event_log
 from .helpers import (
     log,
     detect_control_net,
@@ -34,7 +33,7 @@ from .helpers import (
     _exit,
 )
 from .task_helpers import (
-    encode_image_to_base64,
+    encode_image_file_to_base64,
     serialize_img2img_image_args,
     deserialize_img2img_image_args,
     serialize_script_args,
@@ -42,6 +41,7 @@ from .task_helpers import (
     serialize_api_task_args,
     map_ui_task_args_list_to_named_args,
     map_named_args_to_ui_task_args_list,
+    clear_task_args_caches,
 )
 
 
@@ -67,8 +67,10 @@ class ParsedTaskArgs(BaseModel):
 class TaskRunner:
     instance = None
 
-    def __init__(self, UiControlNetUnit=None):
+    def __init__(self, UiControlNetUnit=None, store: TaskStore = None):
         self.UiControlNetUnit = UiControlNetUnit
+        self.store = store if store is not None else task_store
+        self.events = task_event_log
 
         self.__total_pending_tasks: int = 0
         self.__current_thread: threading.Thread = None
@@ -108,10 +110,15 @@ class TaskRunner:
         self,
         is_img2img: bool,
         *args,
-        checkpoint: str = None,
+        checkpoints: List[str] = [None],
         vae: str = None,
         request: gr.Request = None,
     ):
+        """
+        Serialize UI task arguments once for all the given checkpoints
+        Return one params per checkpoint and the shared script params
+        """
+
         named_args, script_args = map_ui_task_args_list_to_named_args(list(args), is_img2img)
 
         # loop through named_args and serialize images
@@ -121,15 +128,18 @@ class TaskRunner:
         if "request" in named_args:
             named_args["request"] = {"username": request.username}
 
-        params = json.dumps(
-            {
-                "args": named_args,
-                "checkpoint": checkpoint,
-                "vae": vae,
-                "is_ui": True,
-                "is_img2img": is_img2img,
-            }
-        )
+        params = [
+            json.dumps(
+                {
+                    "args": named_args,
+                    "checkpoint": checkpoint,
+                    "vae": vae,
+                    "is_ui": True,
+                    "is_img2img": is_img2img,
+                }
+            )
+            for checkpoint in checkpoints
+        ]
         script_params = serialize_script_args(script_args)
 
         return (params, script_params)
@@ -225,8 +235,7 @@ class TaskRunner:
             init_images = named_args.get("init_images")
             for i, img in enumerate(init_images):
                 if isinstance(img, str) and os.path.isfile(img):
-                    image = Image.open(img)
-                    init_images[i] = encode_image_to_base64(image)
+                    init_images[i] = encode_image_file_to_base64(img)
 
         # force image saving
         named_args.update({"save_images": True, "send_images": False})
@@ -273,28 +282,54 @@ class TaskRunner:
         task_name: str = None,
         request: gr.Request = None,
     ):
-        progress.add_task_to_queue(task_id)
+        return self.register_ui_tasks(
+            [task_id],
+            is_img2img,
+            *args,
+            checkpoints=[checkpoint],
+            task_name=task_name,
+            request=request,
+        )[0]
+
+    def register_ui_tasks(
+        self,
+        task_ids: List[str],
+        is_img2img: bool,
+        *args,
+        checkpoints: List[str],
+        task_name: str = None,
+        request: gr.Request = None,
+    ):
+        """Register the same UI task once per checkpoint, serializing the args once and saving in one transaction"""
+
+        for task_id in task_ids:
+            progress.add_task_to_queue(task_id)
 
         vae = getattr(shared.opts, "sd_vae", "Automatic")
 
         (params, script_args) = self.__serialize_ui_task_args(
-            is_img2img, *args, checkpoint=checkpoint, vae=vae, request=request
+            is_img2img, *args, checkpoints=checkpoints, vae=vae, request=request
         )
 
         task_type = "img2img" if is_img2img else "txt2img"
-        task = Task(
-            id=task_id,
-            name=task_name,
-            type=task_type,
-            params=params,
-            script_params=script_args,
-        )
-        task_manager.add_task(task)
+        tasks = [
+            Task(
+                id=task_id,
+                name=task_name,
+                type=task_type,
+                params=task_params,
+                script_params=script_args,
+            )
+            for task_id, task_params in zip(task_ids, params)
+        ]
+        self.store.add_tasks(tasks)
 
-        self.__run_callbacks("task_registered", task_id, is_img2img=is_img2img, is_ui=True, args=params)
-        self.__total_pending_tasks += 1
+        for task in tasks:
+            self.events.append(task.id, TaskEventType.QUEUED)
+            self.__run_callbacks("task_registered", task.id, is_img2img=is_img2img, is_ui=True, args=task.params)
+        self.__total_pending_tasks += len(tasks)
 
-        return task
+        return tasks
 
     def register_api_task(
         self,
@@ -317,7 +352,8 @@ class TaskRunner:
             params=params,
             script_params=script_params,
         )
-        task_manager.add_task(task)
+        self.store.add_task(task)
+        self.events.append(task_id, TaskEventType.QUEUED)
 
         self.__run_callbacks("task_registered", task_id, is_img2img=is_img2img, is_ui=False, args=params)
         self.__total_pending_tasks += 1
@@ -327,6 +363,11 @@ class TaskRunner:
     def execute_task(self, task: Task, get_next_task: Callable[[], Task]):
         while True:
             if self.dispose:
+                # hand the claimed task back to the queue for the new instance
+                if task.status == TaskStatus.RUNNING:
+                    task.status = TaskStatus.PENDING
+                    self.store.set_status(task.id, task.status)
+                    self.events.append(task.id, TaskEventType.RELEASED)
                 break
 
             if progress.current_task is None:
@@ -343,6 +384,7 @@ class TaskRunner:
 
                 self.interrupted = None
                 self.__saved_images_path = []
+                self.events.append(task_id, TaskEventType.STARTED)
                 self.__run_callbacks("task_started", task_id, **task_meta)
 
                 # enable image saving
@@ -366,18 +408,21 @@ class TaskRunner:
                         log.info(f"[AgentScheduler] Requeue task {task_id}")
                         task.status = TaskStatus.PENDING
                         task.priority = int(datetime.now(timezone.utc).timestamp() * 1000)
-                        task_manager.update_task(task)
+                        self.store.set_status(task.id, task.status, priority=task.priority)
+                        self.events.append(task_id, TaskEventType.REQUEUED, str(res) if res else None)
                     else:
                         task.status = TaskStatus.FAILED
                         task.result = str(res) if res else None
-                        task_manager.update_task(task)
+                        self.store.set_result(task.id, task.result, status=task.status)
+                        self.events.append(task_id, TaskEventType.FAILED, task.result)
                         self.__run_callbacks("task_finished", task_id, status=TaskStatus.FAILED, **task_meta)
                 else:
                     is_interrupted = self.interrupted == task_id
                     if is_interrupted:
                         log.info(f"\n[AgentScheduler] Task {task.id} interrupted")
                         task.status = TaskStatus.INTERRUPTED
-                        task_manager.update_task(task)
+                        self.store.set_status(task.id, task.status)
+                        self.events.append(task_id, TaskEventType.INTERRUPTED)
                         self.__run_callbacks(
                             "task_finished",
                             task_id,
@@ -393,7 +438,8 @@ class TaskRunner:
 
                         task.status = TaskStatus.DONE
                         task.result = json.dumps(result)
-                        task_manager.update_task(task)
+                        self.store.set_result(task.id, task.result, status=task.status)
+                        self.events.append(task_id, TaskEventType.DONE)
                         self.__run_callbacks(
                             "task_finished",
                             task_id,
@@ -512,21 +558,18 @@ class TaskRunner:
         #     retention_days = task_history_retenion_map[shared.opts.queue_history_retention_days]
 
         # if retention_days > 0:
-        #     deleted_rows = task_manager.delete_tasks(before=datetime.now() - timedelta(days=retention_days))
+        #     deleted_rows = self.store.delete_tasks(before=datetime.now() - timedelta(days=retention_days))
         #     if deleted_rows > 0:
         #         log.debug(f"[AgentScheduler] Deleted {deleted_rows} tasks older than {retention_days} days")
 
-        self.__total_pending_tasks = task_manager.count_tasks(status="pending")
+        task = self.store.claim_next_task()
+        if task is not None:
+            log.info(f"[AgentScheduler] Claimed task {task.id}")
+            self.events.append(task.id, TaskEventType.CLAIMED)
+            return task
 
-        # get more task if needed
-        if self.__total_pending_tasks > 0:
-            log.info(f"[AgentScheduler] Total pending tasks: {self.__total_pending_tasks}")
-            pending_tasks = task_manager.get_tasks(status="pending", limit=1)
-            if len(pending_tasks) > 0:
-                return pending_tasks[0]
-        else:
-            log.info("[AgentScheduler] Task queue is empty")
-            self.__run_callbacks("task_cleared")
+        log.info("[AgentScheduler] Task queue is empty")
+        self.__run_callbacks("task_cleared")
 
     def __on_image_saved(self, data: script_callbacks.ImageSaveParams):
         if self.current_task_id is None:
@@ -620,14 +663,14 @@ class TaskRunner:
             callback(*args, **kwargs)
 
 
-def get_instance(block) -> TaskRunner:
+def get_instance(block, store: TaskStore = None) -> TaskRunner:
     if TaskRunner.instance is None:
         if block is not None:
             txt2img_submit_button = get_component_by_elem_id(block, "txt2img_generate")
             UiControlNetUnit = detect_control_net(block, txt2img_submit_button)
-            TaskRunner(UiControlNetUnit)
+            TaskRunner(UiControlNetUnit, store=store)
         else:
-            TaskRunner()
+            TaskRunner(store=store)
 
         if not hasattr(script_callbacks, "on_before_reload"):
             log.warning(
@@ -640,6 +683,10 @@ def get_instance(block) -> TaskRunner:
             def on_before_reload():
                 # Tell old instance to stop
                 TaskRunner.instance.dispose = True
+                # the database may be changed while reloading, load pending tasks again on next use
+                TaskRunner.instance.store.invalidate_cache()
+                # scripts and their signatures are loaded again
+                clear_task_args_caches()
                 # force recreate the instance
                 TaskRunner.instance = None
 
@@ -2,3 +2,6 @@ import launch
 
 if not launch.is_installed("sqlalchemy"):
     launch.run_pip("install sqlalchemy", "requirement for task-scheduler")
+
+if not launch.is_installed("aiosqlite"):
+    launch.run_pip("install aiosqlite greenlet", "requirement for task-scheduler async api")
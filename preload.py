@@ -4,4 +4,59 @@ def preload(parser):
         "--agent-scheduler-sqlite-file",
         help="sqlite file to use for the database connection. It can be abs or relative path(from base path) default: task_scheduler.sqlite3",
         default="task_scheduler.sqlite3",
-    )
\ No newline at end of file
+    )
+    parser.add_argument(
+        "--agent-scheduler-task-store",
+        help="where to keep the tasks: sqlite, or memory to keep them with their images and events in process memory only (lost on restart). default: sqlite",
+        choices=["sqlite", "memory"],
+        default="sqlite",
+    )
+    parser.add_argument(
+        "--agent-scheduler-archive-dir",
+        help="directory for archived queue history. It can be abs or relative path(from base path) default: task_archive",
+        default="task_archive",
+    )
+    parser.add_argument(
+        "--agent-scheduler-array-dir",
+        help="directory for the memory-mapped .npy files of large array args. It can be abs or relative path(from base path) default: task_arrays",
+        default="task_arrays",
+    )
+    parser.add_argument(
+        "--agent-scheduler-image-cache-dir",
+        help="directory caching the images downloaded for enqueued tasks. It can be abs or relative path(from base path) default: image_cache",
+        default="image_cache",
+    )
+    parser.add_argument(
+        "--agent-scheduler-image-cache-size",
+        help="size limit of the downloaded image cache in MB, least recently used images are removed first. default: 512",
+        type=int,
+        default=512,
+    )
+    parser.add_argument(
+        "--agent-scheduler-sqlite-journal-mode",
+        help="sqlite journal mode. WAL lets the API read while the runner is writing. default: WAL",
+        default="WAL",
+    )
+    parser.add_argument(
+        "--agent-scheduler-sqlite-synchronous",
+        help="sqlite synchronous mode. default: NORMAL",
+        default="NORMAL",
+    )
+    parser.add_argument(
+        "--agent-scheduler-sqlite-busy-timeout",
+        help="how long (in milliseconds) to wait for a locked sqlite database. default: 5000",
+        type=int,
+        default=5000,
+    )
+    parser.add_argument(
+        "--agent-scheduler-sqlite-cache-size",
+        help="sqlite page cache size, negative values are in KiB. default: -16000",
+        type=int,
+        default=-16000,
+    )
+    parser.add_argument(
+        "--agent-scheduler-sqlite-mmap-size",
+        help="sqlite memory-mapped I/O size in bytes, 0 to disable. default: 268435456",
+        type=int,
+        default=268435456,
+    )
@@ -1,5 +1,6 @@
 import os
 import json
+import threading
 import gradio as gr
 from PIL import Image
 from uuid import uuid4
@@ -23,13 +24,15 @@ from modules.generation_parameters_copypaste import (
 
 from agent_scheduler.task_runner import TaskRunner, get_instance
 from agent_scheduler.helpers import log, compare_components_with_ids, get_components_by_ids, is_macos
-from agent_scheduler.db import init as init_db, task_manager, TaskStatus
+from agent_scheduler.db import init as init_db, incremental_vacuum, task_store, task_event_log, TaskStatus
 from agent_scheduler.api import regsiter_apis
+from agent_scheduler.task_helpers import image_codecs
 
 is_sdnext = parser.description == "SD.Next"
 ToolButton = gr.Button if is_sdnext else ui_components.ToolButton
 
 task_runner: TaskRunner = None
+remove_old_tasks_lock = threading.Lock()
 
 checkpoint_current = "Current Checkpoint"
 checkpoint_runtime = "Runtime Checkpoint"
@@ -220,16 +223,15 @@ class Script(scripts.Script):
                 else:
                     checkpoint = [checkpoint]
 
-            for i, c in enumerate(checkpoint):
-                t_id = task_id if i == 0 else f"{task_id}.{i}"
-                task_runner.register_ui_task(
-                    t_id,
-                    self.is_img2img,
-                    *args,
-                    checkpoint=c,
-                    task_name=task_name,
-                    request=request,
-                )
+            task_ids = [task_id if i == 0 else f"{task_id}.{i}" for i in range(len(checkpoint))]
+            task_runner.register_ui_tasks(
+                task_ids,
+                self.is_img2img,
+                *args,
+                checkpoints=checkpoint,
+                task_name=task_name,
+                request=request,
+            )
 
             task_runner.execute_pending_tasks_threading()
 
@@ -313,7 +315,7 @@ def infotexts_to_geninfo(infotexts: List[str]):
 
 
 def get_task_results(task_id: str, image_idx: int = None):
-    task = task_manager.get_task(task_id)
+    task = task_store.get_task(task_id)
 
     galerry = None
     geninfo = None
@@ -372,9 +374,41 @@ def remove_old_tasks():
         retention_days = task_history_retenion_map[shared.opts.queue_history_retention_days]
 
     if retention_days > 0:
-        deleted_rows = task_manager.delete_tasks(before=datetime.now() - timedelta(days=retention_days))
+        before = datetime.now() - timedelta(days=retention_days)
+        # archiving needs the sqlite store, the memory store has no archive
+        if getattr(shared.opts, "queue_history_archive", False) and getattr(task_store, "archive", None):
+            deleted_rows = task_store.archive_tasks(before=before)
+            action = "Archived"
+        else:
+            deleted_rows = task_store.delete_tasks_in_batches(before=before)
+            action = "Deleted"
+
+        # events follow the same retention, whether their tasks were archived or deleted
+        task_event_log.delete_events(before=before)
+
         if deleted_rows > 0:
-            log.debug(f"[AgentScheduler] Deleted {deleted_rows} tasks older than {retention_days} days")
+            reclaimed_bytes = incremental_vacuum()
+            log.info(
+                f"[AgentScheduler] {action} {deleted_rows} tasks older than {retention_days} days, "
+                + f"reclaimed {reclaimed_bytes / 1024 / 1024:.1f} MB"
+            )
+
+
+def remove_old_tasks_in_background():
+    # run the purge off the runner thread, skip if the previous one is still running
+    if not remove_old_tasks_lock.acquire(blocking=False):
+        return
+
+    def run():
+        try:
+            remove_old_tasks()
+        except Exception as e:
+            log.error(f"[AgentScheduler] Failed to remove old tasks: {e}")
+        finally:
+            remove_old_tasks_lock.release()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
 
 
 def on_ui_tab(**_kwargs):
@@ -654,6 +688,16 @@ def on_ui_settings():
             section=section,
         ),
     )
+    shared.opts.add_option(
+        "queue_history_archive",
+        shared.OptionInfo(
+            False,
+            "Archive old queue history to compressed files instead of deleting it",
+            gr.Checkbox,
+            {},
+            section=section,
+        ),
+    )
     shared.opts.add_option(
         "queue_automatic_requeue_failed_task",
         shared.OptionInfo(
@@ -674,6 +718,38 @@ def on_ui_settings():
             section=section,
         ),
     )
+    shared.opts.add_option(
+        "queue_image_codec",
+        shared.OptionInfo(
+            "webp",
+            "Lossless codec for images stored with queued tasks",
+            gr.Radio,
+            lambda: {
+                "choices": image_codecs,
+            },
+            section=section,
+        ),
+    )
+    shared.opts.add_option(
+        "queue_array_sidecar_threshold",
+        shared.OptionInfo(
+            1,
+            "Store array args from this size (MB) as memory-mapped files, 0 to disable",
+            gr.Slider,
+            {"minimum": 0, "maximum": 64, "step": 1},
+            section=section,
+        ),
+    )
+    shared.opts.add_option(
+        "queue_png_compress_level",
+        shared.OptionInfo(
+            6,
+            "PNG compression level of images encoded for the API, lower is faster and larger",
+            gr.Slider,
+            {"minimum": 0, "maximum": 9, "step": 1},
+            section=section,
+        ),
+    )
 
     def enqueue_keyboard_shortcut(disabled: bool, modifiers, key_code: str):
         if disabled:
@@ -766,7 +842,7 @@ def on_app_started(block: gr.Blocks, app):
     task_runner = get_instance(block)
     task_runner.execute_pending_tasks_threading()
     regsiter_apis(app, task_runner)
-    task_runner.on_task_cleared(lambda: remove_old_tasks())
+    task_runner.on_task_cleared(lambda: remove_old_tasks_in_background())
 
     if getattr(shared.opts, "queue_ui_placement", "") == ui_placement_append_to_main and block:
         with block:
@@ -0,0 +1,82 @@
+"""
+Encode and decode time and size of the task script args, legacy zlib pickle against agent_scheduler.codec
+
+    SD_WEBUI_DIR=<webui> python tests/bench_codec.py [--units 3] [--size 1024]
+"""
+
+import argparse
+import pickle
+import time
+import zlib
+
+import numpy as np
+
+from webui_path import setup
+
+
+class UiControlNetUnit:
+    def __init__(self, size: int, seed: int):
+        rng = np.random.default_rng(seed)
+        self.enabled = True
+        self.module = "canny"
+        self.model = "control_v11p_sd15_canny"
+        self.weight = 1.0
+        self.image = {
+            "image": rng.integers(0, 255, (size, size, 3), dtype=np.uint8),
+            "mask": np.zeros((size, size, 3), dtype=np.uint8),
+        }
+
+
+def legacy_encode(args):
+    # what Task.script_params held before the codec, units flattened to dicts by serialize_controlnet_args
+    return zlib.compress(pickle.dumps([dict(vars(unit), is_cnet=True) for unit in args]))
+
+
+def legacy_decode(data):
+    return pickle.loads(zlib.decompress(data))
+
+
+def measure(encode, decode, args, repeat: int):
+    encode_time = decode_time = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        data = encode(args)
+        encode_time = min(encode_time, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        decode(data)
+        decode_time = min(decode_time, time.perf_counter() - start)
+
+    return len(data), encode_time, decode_time
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--units", type=int, default=3)
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if not setup():
+        raise SystemExit("stable-diffusion-webui not found, set SD_WEBUI_DIR")
+
+    from agent_scheduler.codec import decode_script_args, encode_script_args
+
+    script_args = [UiControlNetUnit(args.size, seed) for seed in range(args.units)]
+    cases = [
+        ("legacy pickle", legacy_encode, legacy_decode),
+        ("codec", encode_script_args, decode_script_args),
+        ("codec raw", lambda a: encode_script_args(a, compress_level=0), decode_script_args),
+    ]
+
+    print(f"{args.units} ControlNet units, {args.size}x{args.size} image and mask")
+    for name, encode, decode in cases:
+        size, encode_time, decode_time = measure(encode, decode, script_args, args.repeat)
+        print(
+            f"{name:>14}: {size / 1e6:7.2f} MB"
+            f"  encode {encode_time * 1000:7.1f} ms  decode {decode_time * 1000:7.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
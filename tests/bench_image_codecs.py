@@ -0,0 +1,83 @@
+"""
+Size and encode/decode time of the lossless image codecs of serialized image args, on a mask, a sketch and a canvas
+
+    SD_WEBUI_DIR=<webui> python tests/bench_image_codecs.py [--size 1024]
+"""
+
+import argparse
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+from webui_path import setup
+
+
+def mask(size: int, rng) -> Image.Image:
+    image = Image.new("L", (size, size), 0)
+    draw = ImageDraw.Draw(image)
+    for _ in range(6):
+        x, y = rng.integers(0, size * 7 // 8, 2)
+        draw.ellipse([x, y, x + size // 5, y + size // 7], fill=255)
+    return image.convert("RGBA")
+
+
+def sketch(size: int, rng) -> Image.Image:
+    image = Image.new("RGB", (size, size), "white")
+    draw = ImageDraw.Draw(image)
+    for _ in range(60):
+        points = [tuple(int(p) for p in rng.integers(0, size, 2)) for _ in range(5)]
+        draw.line(points, fill=tuple(int(c) for c in rng.integers(0, 255, 3)), width=12)
+    return image
+
+
+def canvas(size: int, rng) -> Image.Image:
+    noise = rng.integers(0, 255, (size // 4, size // 4, 3), dtype=np.uint8)
+    image = Image.fromarray(noise).resize((size, size), Image.BICUBIC).filter(ImageFilter.GaussianBlur(3))
+    image.putalpha(255)
+    return image
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=1024)
+    args = parser.parse_args()
+
+    if not setup():
+        raise SystemExit("stable-diffusion-webui not found, set SD_WEBUI_DIR")
+
+    from agent_scheduler.task_helpers import (
+        compress_image,
+        decompress_image,
+        decompress_raw_image_data,
+        image_codecs,
+    )
+
+    rng = np.random.default_rng(0)
+    images = [
+        ("mask RGBA", mask(args.size, rng)),
+        ("sketch RGB", sketch(args.size, rng)),
+        ("canvas RGBA", canvas(args.size, rng)),
+    ]
+    for name, image in images:
+        for codec in image_codecs:
+            start = time.perf_counter()
+            used, data = compress_image(image, codec)
+            encode_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            if used in ["webp", "png"]:
+                result = decompress_image(data, image.mode)
+            else:
+                result = Image.frombytes(image.mode, image.size, decompress_raw_image_data(data, used))
+            decode_time = time.perf_counter() - start
+
+            assert result.tobytes() == image.tobytes(), (name, used)
+            print(
+                f"{name:>12} {used:>5}: {len(data) / 1024:8.0f} KB"
+                f"  encode {encode_time * 1000:6.1f} ms  decode {decode_time * 1000:6.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
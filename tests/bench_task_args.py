@@ -0,0 +1,79 @@
+"""
+Per-task overhead of mapping args by signature and looking up scripts by title, uncached against task_helpers
+
+    SD_WEBUI_DIR=<webui> python tests/bench_task_args.py [--selectable 40] [--alwayson 30]
+"""
+
+import argparse
+import inspect
+import time
+import types
+
+from webui_path import setup
+
+
+class Script:
+    def __init__(self, title: str):
+        self.__title = title
+
+    def title(self):
+        return self.__title
+
+    def run(self, p, mode, prompt="", *args):
+        pass
+
+
+# the signature of modules.txt2img.txt2img
+def txt2img(
+    id_task, request, prompt, negative_prompt, prompt_styles, steps, sampler_index, restore_faces, tiling, n_iter,
+    batch_size, cfg_scale, seed, subseed, subseed_strength, seed_resize_from_h, seed_resize_from_w,
+    seed_enable_extras, height, width, enable_hr, denoising_strength, hr_scale, hr_upscaler, hr_second_pass_steps,
+    hr_resize_x, hr_resize_y, override_settings_texts, *args
+):
+    pass
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--selectable", type=int, default=40)
+    parser.add_argument("--alwayson", type=int, default=30)
+    parser.add_argument("--tasks", type=int, default=20000)
+    args = parser.parse_args()
+
+    if not setup():
+        raise SystemExit("stable-diffusion-webui not found, set SD_WEBUI_DIR")
+
+    from modules import scripts
+    from agent_scheduler.task_helpers import get_arg_spec, get_script_by_name, get_scripts_by_name
+
+    runner = types.SimpleNamespace(
+        selectable_scripts=[Script(f"Script {i}") for i in range(args.selectable)],
+        alwayson_scripts=[Script(f"Always on {i}") for i in range(args.alwayson)],
+    )
+    scripts.scripts_txt2img = scripts.scripts_img2img = runner
+    script = runner.selectable_scripts[-1]
+    script_name = script.title()
+
+    def uncached():
+        inspect.getfullargspec(txt2img).args
+        inspect.getfullargspec(script.run)
+        next((s for s in runner.selectable_scripts if s.title().lower() == script_name.lower()), None)
+        {s.title().lower(): s for s in runner.alwayson_scripts}
+
+    def cached():
+        get_arg_spec(txt2img).args
+        get_arg_spec(script.run)
+        get_script_by_name(script_name)
+        get_scripts_by_name(is_always_on=True)
+
+    assert get_script_by_name(script_name) is script
+    print(f"txt2img signature, {args.selectable} selectable and {args.alwayson} alwayson scripts")
+    for name, fn in [("uncached", uncached), ("cached", cached)]:
+        start = time.perf_counter()
+        for _ in range(args.tasks):
+            fn()
+        print(f"{name:>9}: {(time.perf_counter() - start) / args.tasks * 1e6:7.2f} us per task")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+import pytest
+
+from webui_path import setup, webui_dir
+
+webui_found = setup()
+if not webui_found:
+    collect_ignore_glob = ["test_*.py"]
+
+
+def pytest_report_header():
+    return f"stable-diffusion-webui: {webui_dir}" + ("" if webui_found else " (not found, tests skipped)")
+
+
+@pytest.fixture
+def engine(tmp_path):
+    from agent_scheduler.db import create_sqlite_engine, migrate
+
+    engine = create_sqlite_engine(str(tmp_path / "task_scheduler.sqlite3"))
+    migrate(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def task_manager(engine):
+    from agent_scheduler.db import TaskManager
+
+    return TaskManager(engine=engine)
@@ -0,0 +1,71 @@
+import asyncio
+import threading
+
+import pytest
+from sqlalchemy import event
+
+from agent_scheduler.db import AsyncTaskStore, TaskManager, TaskStatus
+from agent_scheduler.db.aio import sql_only_methods
+from test_task_manager import make_task
+
+
+def record_threads(monkeypatch, names):
+    threads = {}
+    for name in names:
+        original = getattr(TaskManager, name)
+
+        def wrapper(self, *args, __name=name, __original=original, **kwargs):
+            threads[__name] = threading.current_thread()
+            return __original(self, *args, **kwargs)
+
+        monkeypatch.setattr(TaskManager, name, wrapper)
+
+    return threads
+
+
+def test_only_queries_run_on_the_event_loop(engine, task_manager: TaskManager, monkeypatch):
+    pytest.importorskip("aiosqlite")
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    threads = record_threads(monkeypatch, ["get_tasks", "add_task", "get_task_position", "prioritize_task"])
+
+    async def run():
+        async_engine = create_async_engine(f"sqlite+aiosqlite:///{engine.url.database}")
+        astore = AsyncTaskStore(task_manager, engine=async_engine)
+        try:
+            await astore.add_task(make_task(0, status=TaskStatus.PENDING))
+            await astore.add_task(make_task(1, status=TaskStatus.PENDING))
+            await astore.prioritize_task("task-00001", 0)
+            assert await astore.get_task_position("task-00001") == 0
+            assert [t.id for t in await astore.get_tasks(status=TaskStatus.PENDING)] == ["task-00001", "task-00000"]
+            return threading.current_thread()
+        finally:
+            await async_engine.dispose()
+
+    loop_thread = asyncio.run(run())
+
+    assert "get_tasks" in sql_only_methods
+    assert threads["get_tasks"] is loop_thread
+    for name in ["add_task", "get_task_position", "prioritize_task"]:
+        assert threads[name] is not loop_thread, name
+
+
+def test_bound_copies_reuse_the_feature_probes(engine, task_manager: TaskManager):
+    probes = []
+
+    def before_cursor_execute(_conn, _cursor, statement, *args):
+        if "sqlite_master" in statement or "json_remove('{}'" in statement:
+            probes.append(statement)
+
+    # AsyncTaskStore lists tasks through bound copies only, the manager itself never probes
+    task_manager.add_task(make_task(0))
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        for _ in range(3):
+            with engine.connect() as conn:
+                assert len(task_manager.bind(conn).get_tasks(q="prompt", load_payload=False)) == 1
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+    # JSON1 and FTS5, once each
+    assert len(probes) == 2
@@ -0,0 +1,63 @@
+import types
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from agent_scheduler.db import TaskArchive, TaskManager, TaskStatus
+from test_task_manager import make_task
+
+
+class EventRecorder:
+    def __init__(self):
+        self.events = []
+
+    def append(self, task_id, type, data=None):
+        self.events.append((task_id, type))
+
+
+@pytest.fixture
+def api(engine, tmp_path, monkeypatch):
+    from agent_scheduler.api import regsiter_apis
+    from agent_scheduler.db import aio
+
+    # the store methods run on the executor, the process-wide async engine is on another database
+    monkeypatch.setattr(aio, "get_async_engine", lambda: None)
+
+    store = TaskManager(engine=engine, archive=TaskArchive(str(tmp_path / "task_archive")))
+    store.add_tasks([make_task(i, status=TaskStatus.DONE) for i in range(2)])
+    assert store.archive_tasks(before=datetime.now() + timedelta(days=1)) == 2
+    store.add_tasks([make_task(i, status=TaskStatus.PENDING) for i in range(2, 4)])
+
+    app = FastAPI()
+    task_runner = types.SimpleNamespace(store=store, events=EventRecorder(), on_task_finished=lambda callback: None)
+    regsiter_apis(app, task_runner)
+    client = TestClient(app)
+    client.store = store
+    client.events = task_runner.events.events
+    return client
+
+
+archived = {"success": False, "message": "Task is archived and can't be changed"}
+
+
+def test_update_archived_task(api: TestClient):
+    response = api.put("/agent-scheduler/v1/task/task-00000", json={"name": "renamed"})
+
+    assert response.status_code == 200 and response.json() == archived
+    assert api.put("/agent-scheduler/v1/task/task-00002", json={"name": "renamed"}).json()["success"]
+    assert api.store.get_task("task-00000").name is None
+    assert [id for id, _ in api.events] == ["task-00002"]
+
+
+def test_move_archived_task(api: TestClient):
+    for over_id in ["top", "bottom", "task-00002"]:
+        response = api.post(f"/agent-scheduler/v1/task/task-00001/move/{over_id}")
+        assert response.status_code == 200 and response.json() == archived
+
+    response = api.post("/agent-scheduler/v1/task/task-00003/move/task-00001")
+    assert response.json() == {"success": False, "message": "Task not found"}
+    assert api.post("/agent-scheduler/v1/task/task-00003/move/top").json()["success"]
+    assert api.store.get_task_position("task-00003") == 0
+    assert [id for id, _ in api.events] == ["task-00003"]
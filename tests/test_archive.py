@@ -0,0 +1,71 @@
+import asyncio
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from agent_scheduler.db import AsyncTaskStore, TaskArchive, TaskManager, TaskStatus
+from test_task_manager import make_task
+
+
+@pytest.fixture
+def archive(tmp_path) -> TaskArchive:
+    return TaskArchive(str(tmp_path / "task_archive"))
+
+
+@pytest.fixture
+def archived_manager(engine, archive: TaskArchive) -> TaskManager:
+    manager = TaskManager(engine=engine, archive=archive)
+    manager.add_tasks([make_task(i, status=TaskStatus.DONE) for i in range(5)])
+    assert manager.archive_tasks(before=datetime.now() + timedelta(days=1)) == 5
+    return manager
+
+
+def test_archived_tasks_are_marked(archived_manager: TaskManager, archive: TaskArchive):
+    assert archived_manager.get_task("task-00000").archived is True
+    assert all(task.archived for task in archive.get_tasks(load_payload=False))
+    # the bound copies used on the event loop never read the archive
+    assert archived_manager.bind(archived_manager.engine).get_task("task-00000") is None
+
+
+def test_async_store_reads_the_archive_off_the_loop(engine, archived_manager: TaskManager, monkeypatch):
+    pytest.importorskip("aiosqlite")
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    archive = archived_manager.archive
+    read_on = []
+
+    def get_task(id: str):
+        read_on.append(threading.current_thread())
+        return TaskArchive.get_task(archive, id)
+
+    monkeypatch.setattr(archive, "get_task", get_task)
+
+    async def run():
+        async_engine = create_async_engine(f"sqlite+aiosqlite:///{engine.url.database}")
+        try:
+            return await AsyncTaskStore(archived_manager, engine=async_engine).get_task("task-00003")
+        finally:
+            await async_engine.dispose()
+
+    task = asyncio.run(run())
+
+    assert task.id == "task-00003" and task.archived
+    assert len(read_on) == 1 and read_on[0] is not threading.main_thread()
+
+
+def test_delete_archived_task_survives_reload(archive: TaskArchive, archived_manager: TaskManager):
+    assert archive.delete_task("task-00001")
+    assert not archive.delete_task("task-00001")
+    assert archive.get_task("task-00001") is None
+
+    reloaded = TaskArchive(archive.directory)
+    assert not reloaded.has_task("task-00001")
+    assert reloaded.count_tasks() == 4
+
+
+def test_clear_removes_the_segments(archive: TaskArchive, archived_manager: TaskManager):
+    assert archive.clear() == 5
+
+    assert archive.count_tasks() == 0
+    assert TaskArchive(archive.directory).count_tasks() == 0
@@ -0,0 +1,29 @@
+from agent_scheduler.db import BlobManager, TaskManager, TaskStatus
+from test_memory_store import blob_ref_counts, with_image
+from test_task_manager import make_task
+
+
+def test_blob_put_before_its_task_survives_release(engine, task_manager: TaskManager):
+    blob_manager = BlobManager(engine)
+    hash = blob_manager.put(b"image")
+    task_manager.add_task(with_image(make_task(0, status=TaskStatus.DONE), hash))
+
+    # serialize_image of the next task stores the same image, then the old task is deleted before it is added
+    assert blob_manager.put(b"image") == hash
+    task_manager.delete_task("task-00000")
+    task_manager.add_task(with_image(make_task(1, status=TaskStatus.PENDING), hash))
+
+    assert blob_manager.get(hash) == b"image"
+    assert blob_ref_counts(blob_manager) == {hash: 1}
+
+
+def test_unreferenced_blobs_are_deleted_on_start(engine, task_manager: TaskManager):
+    blob_manager = BlobManager(engine)
+    kept, released, orphan = [blob_manager.put(data) for data in [b"kept", b"released", b"orphan"]]
+    task_manager.add_task(with_image(make_task(0, status=TaskStatus.DONE), kept))
+    task_manager.add_task(with_image(make_task(1, status=TaskStatus.DONE), released))
+    task_manager.delete_task("task-00001")
+
+    assert blob_ref_counts(blob_manager) == {kept: 1, released: 0, orphan: 0}
+    assert blob_manager.delete_unreferenced() == 2
+    assert blob_ref_counts(blob_manager) == {kept: 1}
@@ -0,0 +1,117 @@
+import enum
+import pickle
+import zlib
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from agent_scheduler.codec import decode_script_args, encode_script_args, is_legacy_script_args
+
+
+class Resize(enum.Enum):
+    CROP = "Crop and Resize"
+    FILL = "Resize and Fill"
+
+
+class Mode(enum.IntEnum):
+    BALANCED = 0
+    PROMPT = 1
+
+
+# detected by its class name, like the ControlNet extension's unit
+class UiControlNetUnit:
+    def __init__(self, image: np.ndarray):
+        self.enabled = True
+        self.module = "canny"
+        self.resize_mode = Resize.FILL
+        self.control_mode = Mode.PROMPT
+        self.image = {"image": image, "mask": None}
+        self.weight = 1.0
+
+
+class Evil:
+    def __reduce__(self):
+        return (print, ("unpickled",))
+
+
+def round_trip(args, trusted=True):
+    data = encode_script_args(args)
+    assert not is_legacy_script_args(data)
+    return decode_script_args(data, trusted=trusted)
+
+
+def test_ndarrays_round_trip():
+    arrays = [
+        np.arange(24, dtype=">i4").reshape(4, 6)[:, ::2],
+        np.array(5.5),
+        np.zeros((0, 3), dtype=np.float16),
+        np.random.default_rng(0).integers(0, 255, (64, 64, 3), dtype=np.uint8),
+    ]
+
+    decoded = round_trip(arrays)
+
+    for array, result in zip(arrays, decoded):
+        assert result.dtype == array.dtype and result.shape == array.shape
+        assert np.array_equal(result, array)
+
+
+def test_tensor_round_trips():
+    torch = pytest.importorskip("torch")
+    tensor = torch.arange(12, dtype=torch.float32).reshape(3, 4).t()
+
+    [result] = round_trip([tensor])
+
+    assert isinstance(result, torch.Tensor)
+    assert torch.equal(result, tensor)
+
+
+def test_palette_image_round_trips():
+    image = Image.new("P", (8, 8))
+    image.putpalette([i % 256 for i in range(768)])
+    image.putpixel((1, 2), 7)
+
+    [result] = round_trip([image])
+
+    assert result.mode == "P" and result.size == image.size
+    assert result.getpalette() == image.getpalette()
+    assert list(result.getdata()) == list(image.getdata())
+
+
+def test_controlnet_unit_round_trips_as_dict():
+    image = np.random.default_rng(1).integers(0, 255, (16, 16, 3), dtype=np.uint8)
+
+    [unit] = round_trip([UiControlNetUnit(image)])
+
+    assert unit["is_cnet"] is True
+    assert unit["module"] == "canny" and unit["weight"] == 1.0
+    assert np.array_equal(unit["image"]["image"], image) and unit["image"]["mask"] is None
+    assert unit["resize_mode"] is Resize.FILL and unit["control_mode"] is Mode.PROMPT
+
+
+def test_enums_keep_their_class():
+    args = [Resize.CROP, Mode.BALANCED, {"mode": Mode.PROMPT}]
+
+    assert round_trip(args) == args
+    assert [type(arg) for arg in round_trip(args)[:2]] == [Resize, Mode]
+    # untrusted payloads don't import the enum's module
+    assert round_trip(args, trusted=False) == ["Crop and Resize", 0, {"mode": 1}]
+
+
+def test_legacy_rows_decode():
+    args = [1, "a", np.ones(3), {"x": (1, 2)}]
+    legacy = zlib.compress(pickle.dumps(args))
+    assert is_legacy_script_args(legacy)
+
+    for trusted in [True, False]:
+        decoded = decode_script_args(legacy, trusted=trusted)
+        assert decoded[:2] == [1, "a"] and decoded[3] == {"x": (1, 2)}
+        assert np.array_equal(decoded[2], args[2])
+
+
+def test_untrusted_decode_refuses_arbitrary_globals(capsys):
+    for data in [zlib.compress(pickle.dumps([Evil()])), encode_script_args([Evil()])]:
+        with pytest.raises(pickle.UnpicklingError):
+            decode_script_args(data, trusted=False)
+
+    assert "unpickled" not in capsys.readouterr().out
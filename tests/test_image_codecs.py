@@ -0,0 +1,91 @@
+import base64
+import types
+import zlib
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+from agent_scheduler import task_helpers
+from agent_scheduler.db import BlobManager
+from agent_scheduler.task_helpers import deserialize_image, serialize_image
+
+
+@pytest.fixture
+def image_codec(engine, monkeypatch):
+    """Serialize into the test database, the returned namespace sets the queue_image_codec option"""
+
+    opts = types.SimpleNamespace(queue_image_codec="webp", queue_array_sidecar_threshold=0)
+    monkeypatch.setattr(task_helpers, "shared", types.SimpleNamespace(opts=opts))
+    monkeypatch.setattr(task_helpers, "blob_manager", BlobManager(engine))
+    return opts
+
+
+def transparent_image() -> Image.Image:
+    # fully transparent pixels with a color, the webp encoder would zero them without exact
+    image = Image.new("RGBA", (64, 48), (200, 100, 50, 0))
+    ImageDraw.Draw(image).ellipse([10, 10, 40, 40], fill=(255, 10, 20, 128))
+    return image
+
+
+def test_webp_keeps_transparent_pixels(image_codec):
+    if not task_helpers.webp_supported:
+        pytest.skip("Pillow built without webp")
+    image = transparent_image()
+
+    serialized = serialize_image(image)
+    result = deserialize_image(serialized)
+
+    assert serialized["codec"] == "webp"
+    assert result.mode == "RGBA" and result.tobytes() == image.tobytes()
+
+
+@pytest.mark.parametrize("codec", ["webp", "png", "zstd", "zlib"])
+def test_palette_images_go_through_png(image_codec, codec):
+    image_codec.queue_image_codec = codec
+    image = transparent_image().convert("RGB").convert("P")
+
+    serialized = serialize_image(image)
+    result = deserialize_image(serialized)
+
+    assert serialized["codec"] == "png"
+    assert result.mode == "P" and result.getpalette() == image.getpalette()
+    assert result.tobytes() == image.tobytes()
+
+
+def test_zstd_falls_back_to_zlib(image_codec, monkeypatch):
+    image_codec.queue_image_codec = "zstd"
+    array = np.random.default_rng(0).random((8, 5)).astype(np.float32)
+    zstd_serialized = serialize_image(array)
+    if task_helpers.zstandard is not None:
+        assert zstd_serialized["codec"] == "zstd"
+
+    monkeypatch.setattr(task_helpers, "zstandard", None)
+    serialized = serialize_image(array)
+
+    assert task_helpers.get_image_codec() == "zlib"
+    assert serialized["codec"] == "zlib"
+    assert np.array_equal(deserialize_image(serialized), array)
+    if zstd_serialized["codec"] == "zstd":
+        with pytest.raises(Exception, match="zstandard"):
+            deserialize_image(zstd_serialized)
+
+
+def test_legacy_payloads_without_codec_are_zlib(image_codec):
+    image = transparent_image()
+    array = np.arange(60, dtype=np.int16).reshape(3, 4, 5)
+    legacy_image = {
+        "size": image.size,
+        "mode": image.mode,
+        "data": base64.b64encode(zlib.compress(image.tobytes())).decode("utf-8"),
+        "cls": "Image",
+    }
+    legacy_array = {
+        "shape": array.shape,
+        "data": base64.b64encode(zlib.compress(array.tobytes())).decode("utf-8"),
+        "cls": "ndarray",
+        "dtype": str(array.dtype),
+    }
+
+    assert deserialize_image(legacy_image).tobytes() == image.tobytes()
+    assert np.array_equal(deserialize_image(legacy_array), array)
@@ -0,0 +1,173 @@
+import hashlib
+import io
+import os
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+from PIL import Image
+
+from agent_scheduler.image_fetcher import ImageFetcher
+
+
+def png(color: str) -> bytes:
+    with io.BytesIO() as output:
+        Image.new("RGB", (8, 8), color).save(output, format="PNG")
+        return output.getvalue()
+
+
+class ImageServer(ThreadingHTTPServer):
+    """Serves /<color>.png with an ETag, counting the full and the not modified responses per path"""
+
+    daemon_threads = True
+
+    def __init__(self, delay: float = 0):
+        super().__init__(("127.0.0.1", 0), ImageHandler)
+        self.delay = delay
+        self.ok = Counter()
+        self.not_modified = Counter()
+        # paths answered with 404
+        self.missing = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self.server_port}{path}"
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    server: ImageServer
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            time.sleep(server.delay)
+            if self.path in server.missing:
+                self.send_error(404)
+                return
+
+            data = png(self.path.strip("/").split(".")[0])
+            etag = f'"{hashlib.sha256(data).hexdigest()[:16]}"'
+            if self.headers.get("If-None-Match", None) == etag:
+                server.not_modified[self.path] += 1
+                self.send_response(304)
+                self.end_headers()
+                return
+
+            server.ok[self.path] += 1
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(data)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+
+@pytest.fixture
+def server():
+    server = ImageServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def fetcher(tmp_path):
+    fetcher = ImageFetcher(str(tmp_path / "image_cache"), 1024 * 1024, max_workers=4, timeout=(1, 5))
+    yield fetcher
+    fetcher.executor.shutdown()
+
+
+def cache_path(fetcher: ImageFetcher, url: str) -> str:
+    return os.path.join(fetcher.cache_dir, hashlib.sha256(url.encode("utf-8")).hexdigest())
+
+
+def test_fetch_all_downloads_concurrently(server: ImageServer, fetcher: ImageFetcher):
+    server.delay = 0.3
+    colors = ["red", "green", "blue", "white"]
+    urls = [server.url(f"/{color}.png") for color in colors]
+
+    start = time.perf_counter()
+    fetched = fetcher.fetch_all(urls)
+
+    assert [fetched[url] for url in urls] == [png(color) for color in colors]
+    assert server.max_in_flight == len(urls)
+    assert time.perf_counter() - start < server.delay * len(urls)
+
+
+def test_fetch_all_downloads_repeated_urls_once(server: ImageServer, fetcher: ImageFetcher):
+    urls = [server.url("/red.png"), server.url("/blue.png")]
+
+    fetched = fetcher.fetch_all(urls + urls[::-1] + urls)
+
+    assert list(fetched) == urls
+    assert server.ok == {"/red.png": 1, "/blue.png": 1}
+
+
+def test_cached_images_are_revalidated(server: ImageServer, fetcher: ImageFetcher):
+    url = server.url("/red.png")
+    assert fetcher.fetch(url) == png("red")
+
+    assert fetcher.fetch(url) == png("red")
+    assert fetcher.fetch_all([url, server.url("/blue.png")])[url] == png("red")
+
+    assert server.ok == {"/red.png": 1, "/blue.png": 1}
+    assert server.not_modified == {"/red.png": 2}
+
+
+def test_cached_copy_is_used_when_the_server_is_down(server: ImageServer, fetcher: ImageFetcher):
+    cached_url = server.url("/red.png")
+    assert fetcher.fetch(cached_url) == png("red")
+
+    server.shutdown()
+    server.server_close()
+
+    assert fetcher.fetch(cached_url) == png("red")
+    assert fetcher.fetch(server.url("/blue.png")) is None
+
+
+def test_error_status_raises_instead_of_using_the_cached_copy(server: ImageServer, fetcher: ImageFetcher):
+    removed_url = server.url("/red.png")
+    assert fetcher.fetch(removed_url) == png("red")
+
+    server.missing.update(["/red.png", "/blue.png"])
+
+    with pytest.raises(requests.HTTPError):
+        fetcher.fetch(removed_url)
+    with pytest.raises(requests.HTTPError):
+        fetcher.fetch_all([removed_url, server.url("/blue.png")])
+
+
+def test_least_recently_used_images_are_evicted(server: ImageServer, fetcher: ImageFetcher):
+    first, second, third = [server.url(f"/{color}.png") for color in ["red", "lime", "blue"]]
+    fetcher.fetch(first)
+    entry_size = os.path.getsize(cache_path(fetcher, first))
+    # room for two entries
+    fetcher.cache_size = entry_size * 2 + entry_size // 2
+
+    fetcher.fetch(second)
+    past = time.time() - 60
+    os.utime(cache_path(fetcher, first), (past, past))
+    os.utime(cache_path(fetcher, second), (past + 1, past + 1))
+    # the hit makes the first image the most recently used
+    assert fetcher.fetch(first) == png("red")
+    fetcher.fetch(third)
+
+    cached = sorted(os.listdir(fetcher.cache_dir))
+    assert cached == sorted(os.path.basename(cache_path(fetcher, url)) for url in [first, third])
+    assert server.not_modified["/red.png"] == 1
@@ -0,0 +1,83 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy import select, text
+
+from agent_scheduler.db import BlobManager, MemoryTaskManager, TaskStatus, create_memory_engine, metadata
+from agent_scheduler.db.blob import BlobTable
+from test_task_manager import make_task
+
+
+@pytest.fixture
+def blob_manager():
+    engine = create_memory_engine()
+    metadata.create_all(engine)
+    yield BlobManager(engine)
+    engine.dispose()
+
+
+def with_image(task, hash):
+    params = json.loads(task.params)
+    params["args"]["init_images"] = [{"cls": "Image", "size": [1, 1], "mode": "RGB", "blob": hash, "codec": "png"}]
+    return task.copy(update={"params": json.dumps(params)})
+
+
+def blob_ref_counts(blob_manager: BlobManager):
+    with blob_manager.engine.connect() as conn:
+        rows = conn.execute(select(BlobTable.hash, BlobTable.ref_count)).all()
+        return {hash: ref_count for hash, ref_count in rows}
+
+
+def test_memory_engine_is_shared_between_threads(blob_manager: BlobManager):
+    hash = blob_manager.put(b"image")
+    with ThreadPoolExecutor(1) as executor:
+        assert executor.submit(blob_manager.get, hash).result() == b"image"
+
+
+def test_memory_store_releases_blobs_of_removed_tasks(blob_manager: BlobManager):
+    store = MemoryTaskManager(blobs=blob_manager)
+    first = blob_manager.put(b"first")
+    second = blob_manager.put(b"second")
+
+    store.add_tasks([with_image(make_task(0, status=TaskStatus.PENDING), first)])
+    store.add_task(with_image(make_task(1, status=TaskStatus.DONE), first))
+    assert blob_ref_counts(blob_manager) == {first: 2, second: 0}
+
+    store.update_task(with_image(store.get_task("task-00000"), second))
+    assert blob_ref_counts(blob_manager) == {first: 1, second: 1}
+
+    store.delete_task("task-00000")
+    store.delete_tasks()
+    assert blob_ref_counts(blob_manager) == {first: 0, second: 0}
+
+    assert blob_manager.delete_unreferenced() == 2
+    assert blob_ref_counts(blob_manager) == {}
+
+
+def test_memory_engine_transactions_dont_interleave():
+    engine = create_memory_engine()
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE item (thread INTEGER, i INTEGER)"))
+
+    def write(thread: int):
+        try:
+            with engine.begin() as conn:
+                for i in range(5):
+                    conn.execute(text("INSERT INTO item VALUES (:thread, :i)"), {"thread": thread, "i": i})
+                    time.sleep(0.001)
+                if thread % 2:
+                    raise ValueError("roll back")
+        except ValueError:
+            pass
+
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(write, range(16)))
+
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT thread, COUNT(*) FROM item GROUP BY thread")).all()
+    engine.dispose()
+
+    # the rolled back threads left nothing, and took nothing of the others with them
+    assert dict(rows) == {thread: 5 for thread in range(0, 16, 2)}
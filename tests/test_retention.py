@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import create_engine, event, insert, text
+
+from agent_scheduler.db import incremental_vacuum
+from agent_scheduler.db.event import TaskEventLog, TaskEventTable
+
+
+def fill_and_empty(engine):
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE filler (data BLOB)"))
+        for _ in range(500):
+            conn.execute(text("INSERT INTO filler VALUES (randomblob(4096))"))
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM filler"))
+
+
+def test_incremental_vacuum_reclaims_free_pages(engine):
+    fill_and_empty(engine)
+
+    assert incremental_vacuum(engine, pause=0) > 0
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA freelist_count")).scalar() == 0
+
+
+def test_incremental_vacuum_skips_databases_without_auto_vacuum(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'plain.sqlite3'}")
+    fill_and_empty(engine)
+
+    # the free list never shrinks here, this used to spin forever
+    assert incremental_vacuum(engine, pause=0) == 0
+    engine.dispose()
+
+
+def test_delete_events_in_batches(engine):
+    now = datetime.now(timezone.utc)
+    ts = int(now.timestamp() * 1000)
+    events = [{"task_id": f"task-{i}", "event": "done", "ts": ts - (i + 1) * 60_000, "data": None} for i in range(25)]
+    with engine.begin() as conn:
+        conn.execute(insert(TaskEventTable.__table__), events)
+
+    deletes = []
+
+    def before_cursor_execute(_conn, _cursor, statement, *_):
+        if statement.lstrip().upper().startswith("DELETE"):
+            deletes.append(statement)
+
+    log = TaskEventLog(engine)
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        assert log.delete_events(before=now - timedelta(minutes=10, seconds=30), batch_size=4, pause=0) == 15
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+    assert len(deletes) == 4
+    assert [e.task_id for e in log.get_events()] == [f"task-{i}" for i in reversed(range(10))]
@@ -0,0 +1,73 @@
+import inspect
+import types
+
+import pytest
+from modules import scripts
+
+from agent_scheduler import task_helpers
+from agent_scheduler.task_helpers import arg_spec_cache, clear_task_args_caches, get_arg_spec, get_script_by_name
+
+
+class Script:
+    def __init__(self, title: str):
+        self.__title = title
+
+    def title(self):
+        return self.__title
+
+    def run(self, p, mode, prompt="", *args):
+        pass
+
+
+def script_runner(*titles: str):
+    return types.SimpleNamespace(
+        selectable_scripts=[Script(title) for title in titles],
+        alwayson_scripts=[Script(f"{title} always on") for title in titles],
+    )
+
+
+@pytest.fixture(autouse=True)
+def empty_caches():
+    clear_task_args_caches()
+    yield
+    clear_task_args_caches()
+
+
+def test_bound_methods_share_a_cache_entry():
+    first, second = Script("First"), Script("Second")
+
+    spec = get_arg_spec(first.run)
+
+    assert get_arg_spec(second.run) is spec
+    assert list(arg_spec_cache) == [Script.run]
+    assert spec == inspect.getfullargspec(second.run)
+
+
+def test_reloaded_script_runner_rebuilds_title_map(monkeypatch):
+    runner = script_runner("Prompt matrix", "X/Y/Z plot")
+    monkeypatch.setattr(scripts, "scripts_txt2img", runner, raising=False)
+    monkeypatch.setattr(scripts, "scripts_img2img", script_runner("Loopback"), raising=False)
+
+    assert get_script_by_name("x/y/z PLOT") is runner.selectable_scripts[1]
+    assert get_script_by_name("Loopback", is_img2img=True) is scripts.scripts_img2img.selectable_scripts[0]
+    assert get_script_by_name("prompt matrix always on", is_always_on=True) is runner.alwayson_scripts[0]
+
+    # a ui reload creates new runners
+    reloaded = script_runner("X/Y/Z plot", "Outpainting")
+    monkeypatch.setattr(scripts, "scripts_txt2img", reloaded)
+
+    assert get_script_by_name("X/Y/Z plot") is reloaded.selectable_scripts[0]
+    assert get_script_by_name("Outpainting") is reloaded.selectable_scripts[1]
+    assert get_script_by_name("Prompt matrix") is None
+
+
+def test_clear_caches_forgets_scripts_of_the_same_runner(monkeypatch):
+    runner = script_runner("Prompt matrix")
+    monkeypatch.setattr(scripts, "scripts_txt2img", runner, raising=False)
+    assert get_script_by_name("Outpainting") is None
+
+    runner.selectable_scripts.append(Script("Outpainting"))
+    clear_task_args_caches()
+
+    assert get_script_by_name("Outpainting") is runner.selectable_scripts[1]
+    assert task_helpers.scripts_by_name_cache[(False, False)][0] is runner
@@ -0,0 +1,281 @@
+import re
+import sys
+import json
+import socket
+import subprocess
+from contextlib import contextmanager
+from typing import List
+
+import pytest
+from sqlalchemy import event, text
+
+from agent_scheduler.db import Task, TaskStatus, TaskManager
+from agent_scheduler.db.task import history_statuses, encode_task_cursor, get_timestamp_ms, CLAIM_STALE_AFTER
+
+
+def make_task(i: int, status: str = TaskStatus.DONE, bookmarked: bool = False, **kwargs) -> Task:
+    params = {"args": {"prompt": f"prompt {i}"}, "checkpoint": None}
+    return Task(
+        id=f"task-{i:05d}",
+        type="txt2img",
+        params=json.dumps(params),
+        script_params=b"",
+        priority=1000 + i,
+        status=status,
+        bookmarked=bookmarked,
+        **kwargs,
+    )
+
+
+def listing_order(tasks: List[Task], order: str) -> List[str]:
+    # bookmarked ascending, then priority and id in the requested order
+    tasks = sorted(tasks, key=lambda t: (t.priority, t.id), reverse=order != "asc")
+    tasks.sort(key=lambda t: -1 if t.bookmarked is None else int(t.bookmarked))
+    return [task.id for task in tasks]
+
+
+@contextmanager
+def capture_task_queries(engine):
+    """Collect the statements reading the task table"""
+
+    statements = []
+
+    def before_cursor_execute(_conn, _cursor, statement, parameters, _context, _executemany):
+        if statement.lstrip().upper().startswith("SELECT") and re.search(r"\bFROM task\b", statement):
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def query_plans(engine, statements) -> List[str]:
+    with engine.connect() as conn:
+        return [
+            "\n".join(row[3] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters))
+            for statement, parameters in statements
+        ]
+
+
+@pytest.fixture
+def history(task_manager: TaskManager) -> List[Task]:
+    statuses = [TaskStatus.DONE, TaskStatus.FAILED, TaskStatus.INTERRUPTED, TaskStatus.PENDING]
+    tasks = [make_task(i, status=statuses[i % len(statuses)], bookmarked=i % 7 == 0) for i in range(200)]
+    task_manager.add_tasks(tasks)
+    return tasks
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {"status": history_statuses, "order": "desc"},
+        {"status": history_statuses, "order": "desc", "bookmarked": True},
+        {"status": TaskStatus.DONE, "order": "desc"},
+        {"status": TaskStatus.PENDING, "order": "asc"},
+    ],
+)
+def test_listing_is_read_in_index_order(engine, task_manager: TaskManager, history: List[Task], kwargs):
+    status = kwargs["status"]
+    statuses = status if isinstance(status, list) else [status]
+    expected = listing_order(
+        [t for t in history if t.status in statuses and (not kwargs.get("bookmarked") or t.bookmarked)],
+        kwargs["order"],
+    )
+
+    with capture_task_queries(engine) as statements:
+        tasks = task_manager.get_tasks(limit=20, load_payload=False, **kwargs)
+
+    assert [task.id for task in tasks] == expected[:20]
+    plans = query_plans(engine, statements)
+    assert len(plans) > 0
+    for plan in plans:
+        assert "TEMP B-TREE" not in plan, plan
+
+
+def test_history_uses_partial_index(engine, task_manager: TaskManager, history: List[Task]):
+    with capture_task_queries(engine) as statements:
+        task_manager.get_tasks(status=history_statuses, order="desc", limit=20, load_payload=False)
+
+    for plan in query_plans(engine, statements):
+        assert "ix_task_history_bookmarked_priority" in plan, plan
+
+
+def test_offset_pages_span_bookmarked_segments(task_manager: TaskManager, history: List[Task]):
+    expected = listing_order([t for t in history if t.status in history_statuses], "desc")
+
+    pages = []
+    for offset in range(0, len(expected) + 20, 20):
+        pages += [t.id for t in task_manager.get_tasks(status=history_statuses, order="desc", limit=20, offset=offset)]
+
+    assert pages == expected
+
+
+@pytest.mark.parametrize(
+    "status, order",
+    [(history_statuses, "desc"), (TaskStatus.PENDING, "asc")],
+)
+def test_cursor_pages_seek_the_index(engine, task_manager: TaskManager, history: List[Task], status, order):
+    statuses = status if isinstance(status, list) else [status]
+    expected = listing_order([t for t in history if t.status in statuses], order)
+
+    pages = []
+    cursor = None
+    with capture_task_queries(engine) as statements:
+        while True:
+            tasks = task_manager.get_tasks(status=status, order=order, limit=20, cursor=cursor, load_payload=False)
+            if len(tasks) == 0:
+                break
+            pages += [t.id for t in tasks]
+            cursor = encode_task_cursor(tasks[-1])
+
+    assert pages == expected
+    cursor_plans = [plan for plan in query_plans(engine, statements) if "(priority,id)" in plan]
+    assert len(cursor_plans) > 0
+    for plan in cursor_plans:
+        assert "TEMP B-TREE" not in plan, plan
+
+
+def set_claim(engine, id: str, claimed_by: str, heartbeat_at: int):
+    with engine.begin() as conn:
+        conn.execute(
+            text("UPDATE task SET status = 'running', claimed_by = :claimed_by, heartbeat_at = :heartbeat_at WHERE id = :id"),
+            {"id": id, "claimed_by": claimed_by, "heartbeat_at": heartbeat_at},
+        )
+
+
+def test_release_keeps_claims_of_live_runners(engine, task_manager: TaskManager):
+    task_manager.add_tasks([make_task(0, status=TaskStatus.PENDING), make_task(1, status=TaskStatus.PENDING)])
+    claimed = task_manager.claim_next_task()
+    assert task_manager.claim_heartbeat.beat() == 1
+    set_claim(engine, "task-00001", "other-host:1234:0123abcd", get_timestamp_ms())
+
+    assert task_manager.release_running_tasks() == 0
+    assert task_manager.get_task(claimed.id).status == TaskStatus.RUNNING
+    assert task_manager.get_task("task-00001").status == TaskStatus.RUNNING
+
+
+@pytest.mark.parametrize(
+    "claimed_by, heartbeat_age",
+    [
+        (None, None),
+        ("other-host:1234:0123abcd", CLAIM_STALE_AFTER + 1),
+    ],
+)
+def test_release_stale_claims(engine, task_manager: TaskManager, claimed_by, heartbeat_age):
+    task_manager.add_tasks([make_task(0, status=TaskStatus.PENDING)])
+    heartbeat_at = None if heartbeat_age is None else get_timestamp_ms() - heartbeat_age * 1000
+    set_claim(engine, "task-00000", claimed_by, heartbeat_at)
+
+    assert task_manager.release_running_tasks() == 1
+    assert task_manager.get_task("task-00000").status == TaskStatus.PENDING
+    assert task_manager.claim_next_task().id == "task-00000"
+
+
+def test_release_claims_of_exited_process(engine, task_manager: TaskManager):
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    task_manager.add_tasks([make_task(0, status=TaskStatus.PENDING)])
+    set_claim(engine, "task-00000", f"{socket.gethostname()}:{process.pid}:0123abcd", get_timestamp_ms())
+
+    assert task_manager.release_running_tasks() == 1
+
+
+def test_claim_sees_tasks_added_by_another_process(engine, task_manager: TaskManager):
+    other = TaskManager(engine=engine)
+    assert task_manager.claim_next_task() is None
+
+    # the other manager's writes don't reach this manager's pending index
+    other.add_tasks([make_task(0, status=TaskStatus.PENDING)])
+
+    assert task_manager.claim_next_task().id == "task-00000"
+
+
+def test_claim_falls_back_when_the_hint_was_claimed_elsewhere(engine, task_manager: TaskManager):
+    task_manager.add_tasks([make_task(i, status=TaskStatus.PENDING) for i in range(3)])
+    other = TaskManager(engine=engine)
+    assert task_manager.get_task_position("task-00000") == 0
+
+    assert other.claim_next_task().id == "task-00000"
+    assert task_manager.claim_next_task().id == "task-00001"
+    assert task_manager.get_task_position("task-00002") == 0
+    assert other.claim_next_task().id == "task-00002"
+    assert task_manager.claim_next_task() is None
+
+
+@pytest.mark.parametrize("memory", [False, True])
+def test_position_fallback_ranks_like_the_pending_index(task_manager: TaskManager, monkeypatch, memory):
+    from agent_scheduler.db import MemoryTaskManager
+
+    store = MemoryTaskManager() if memory else task_manager
+    tasks = [
+        make_task(0, status=TaskStatus.PENDING, bookmarked=True),
+        make_task(1, status=TaskStatus.PENDING),
+        make_task(2, status=TaskStatus.PENDING),
+        make_task(3, status=TaskStatus.PENDING).copy(update={"priority": 1001}),
+        make_task(4, status=TaskStatus.PENDING, bookmarked=True).copy(update={"priority": 1000}),
+    ]
+    store.add_tasks(tasks)
+    from_index = {task.id: store.get_task_position(task.id) for task in tasks}
+
+    monkeypatch.setattr(store.pending_index, "position", lambda id: None)
+    from_query = {task.id: store.get_task_position(task.id) for task in tasks}
+
+    assert from_index == from_query
+    # bookmarked last, equal priorities by id
+    assert sorted(from_index, key=from_index.get) == ["task-00001", "task-00003", "task-00002", "task-00000", "task-00004"]
+
+
+def search_ids(task_manager: TaskManager, q: str) -> List[str]:
+    return sorted(task.id for task in task_manager.get_tasks(q=q, load_payload=False))
+
+
+def test_search_survives_renumbered_rowids(engine, task_manager: TaskManager):
+    task_manager.add_tasks([make_task(i, status=TaskStatus.DONE) for i in range(10)])
+    # what VACUUM or a table rebuild may do to a table without an INTEGER PRIMARY KEY
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE task SET rowid = rowid + 1000"))
+
+    assert search_ids(task_manager, "prompt 3") == ["task-00003"]
+
+    task_manager.rename("task-00003", "renamed")
+    assert search_ids(task_manager, "renamed") == ["task-00003"]
+
+    task = task_manager.get_task("task-00005")
+    task.params = json.dumps({"args": {"prompt": "changed"}, "checkpoint": None})
+    task_manager.update_task(task)
+    assert search_ids(task_manager, "changed") == ["task-00005"]
+    assert search_ids(task_manager, "prompt 5") == []
+
+    task_manager.delete_task("task-00004")
+    assert search_ids(task_manager, "prompt 4") == []
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM task_fts_key")).scalar() == 9
+
+
+def test_listed_params_keep_all_plain_args(engine, task_manager: TaskManager):
+    from agent_scheduler.db.migrations import add_task_summary
+
+    args = {
+        "prompt": "a cat",
+        "denoising_strength": 0.5,
+        "styles": ["style"],
+        "init_images": [{"cls": "Image", "blob": "0" * 64}],
+        "alwayson_scripts": {"controlnet": {"args": []}},
+        "mask": "data",
+    }
+    params = json.dumps({"args": args, "checkpoint": "model.safetensors", "script_args": []})
+    task_manager.add_task(Task(id="task", type="img2img", params=params, script_params=b"", status=TaskStatus.DONE))
+    expected = {"prompt": "a cat", "denoising_strength": 0.5, "styles": ["style"], "checkpoint": "model.safetensors"}
+
+    [listed] = task_manager.get_tasks(load_payload=False)
+    assert json.loads(listed.summary) == expected
+
+    # rows stored before the summary column are summarized in sql by the migration
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE task SET summary = NULL"))
+        add_task_summary(conn)
+
+    [listed] = task_manager.get_tasks(load_payload=False)
+    assert json.loads(listed.summary) == expected
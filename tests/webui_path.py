@@ -0,0 +1,27 @@
+"""Make the webui `modules` package and this extension importable, for the tests and the benchmarks"""
+
+import os
+import sys
+
+# the extension is loaded by stable-diffusion-webui and imports its `modules` package: run from the installed
+# extension (<webui>/extensions/<this repo>) or point SD_WEBUI_DIR at a webui checkout
+extension_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+webui_dir = os.environ.get("SD_WEBUI_DIR", os.path.dirname(os.path.dirname(extension_dir)))
+
+
+def setup() -> bool:
+    """Put webui and the extension on sys.path, return False if webui can't be imported"""
+
+    for path in [webui_dir, extension_dir]:
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+    # webui parses the command line when modules.shared is imported, the test runner's arguments are not its own
+    os.environ.setdefault("IGNORE_CMD_ARGS_ERRORS", "1")
+
+    try:
+        from modules import shared  # noqa: F401
+    except ImportError:
+        return False
+
+    return True
@@ -1004,7 +1004,8 @@ function initHistoryTab() {
     defaultColDef: {
       ...sharedGridOptions.defaultColDef,
       sortable: true,
-      editable: ({ colDef }) => colDef?.field === 'name',
+      // archived tasks are read-only
+      editable: ({ colDef, data }) => colDef?.field === 'name' && data?.archived !== true,
     },
     // each entry here represents one column
     columnDefs: [
@@ -1015,22 +1016,22 @@ function initHistoryTab() {
         maxWidth: 55,
         pinned: 'left',
         sort: 'desc',
-        tooltipValueGetter: ({ value }: ITooltipParams<Task, boolean | undefined, any>) =>
-          value === true ? 'Unbookmark' : 'Bookmark',
-        cellClass: ({ value }: CellClassParams<Task, boolean | undefined>) => [
-          'cursor-pointer',
+        tooltipValueGetter: ({ value, data }: ITooltipParams<Task, boolean | undefined, any>) =>
+          data?.archived === true ? 'Archived' : value === true ? 'Unbookmark' : 'Bookmark',
+        cellClass: ({ value, data }: CellClassParams<Task, boolean | undefined>) => [
+          ...(data?.archived === true ? [] : ['cursor-pointer']),
           'pt-3',
           value === true ? 'ts-bookmarked' : 'ts-bookmark',
         ],
-        cellRenderer: ({ value }: ICellRendererParams<Task, boolean | undefined>) =>
-          value === true ? bookmarked : bookmark,
+        cellRenderer: ({ value, data }: ICellRendererParams<Task, boolean | undefined>) =>
+          data?.archived === true ? '' : value === true ? bookmarked : bookmark,
         onCellClicked: ({
           api,
           data,
           value,
           event,
         }: CellClickedEvent<Task, boolean | undefined>) => {
-          if (data == null) return;
+          if (data == null || data.archived === true) return;
 
           if (event != null) {
             event.stopPropagation();
@@ -1102,6 +1103,12 @@ function initHistoryTab() {
     ],
     rowSelection: 'single',
     suppressRowDeselection: true,
+    onPaginationChanged: ({ api }) => {
+      // fetch the next page of history once the last loaded page is reached
+      if (api.paginationGetCurrentPage() >= api.paginationGetTotalPages() - 1) {
+        store.loadMore();
+      }
+    },
     onColumnMoved: ({ api }) => {
       const colState = api.getColumnState();
       const colStateStr = JSON.stringify(colState);
@@ -1123,8 +1130,9 @@ function initHistoryTab() {
       searchInput.addEventListener(
         'keyup',
         debounce(function () {
-          api.updateGridOptions({ quickFilterText: this.value });
-        }, 200)
+          // searched on the server, the grid only holds the loaded pages
+          store.onSearch(this.value);
+        }, 300)
       );
 
       const updateRowData = (state: ReturnType<typeof store.getState>) => {
@@ -6,11 +6,15 @@ type HistoryTasksState = {
   total: number;
   tasks: Task[];
   status?: TaskStatus;
+  query?: string;
+  next_cursor?: string | null;
 };
 
 type HistoryTasksActions = {
-  refresh: (options?: { limit?: number; offset?: number }) => Promise<TaskHistoryResponse>;
+  refresh: (options?: { limit?: number }) => Promise<TaskHistoryResponse>;
+  loadMore: (options?: { limit?: number }) => Promise<TaskHistoryResponse | undefined>;
   onFilterStatus: (status?: TaskStatus) => void;
+  onSearch: (query?: string) => void;
   bookmarkTask: (id: string, bookmarked: boolean) => Promise<ResponseStatus>;
   renameTask: (id: string, name: string) => Promise<ResponseStatus>;
   requeueTask: (id: string) => Promise<ResponseStatus>;
@@ -23,23 +27,63 @@ export type HistoryTasksStore = ReturnType<typeof createHistoryTasksStore>;
 export const createHistoryTasksStore = (initialState: HistoryTasksState) => {
   const store = createStore<HistoryTasksState>()(() => initialState);
   const { getState, setState, subscribe } = store;
+  let loadingMore: Promise<TaskHistoryResponse | undefined> | undefined;
+  // bumped by every refresh, responses for an older listing are dropped
+  let generation = 0;
 
   const actions: HistoryTasksActions = {
     refresh: async options => {
-      const { limit = 1000, offset = 0 } = options ?? {};
-      const status = getState().status ?? '';
+      const { limit = 1000 } = options ?? {};
+      const { status = '', query = '' } = getState();
+      const q = encodeURIComponent(query);
+      const current = ++generation;
+      loadingMore = undefined;
 
-      return fetch(`/agent-scheduler/v1/history?status=${status}&limit=${limit}&offset=${offset}`)
+      return fetch(`/agent-scheduler/v1/history?status=${status}&limit=${limit}&q=${q}`)
         .then(response => response.json())
         .then((data: TaskHistoryResponse) => {
-          setState({ ...data });
+          if (current === generation) {
+            setState({ ...data });
+          }
           return data;
         });
     },
+    loadMore: async options => {
+      const { limit = 1000 } = options ?? {};
+      const { status = '', query = '', next_cursor } = getState();
+      if (next_cursor == null) return;
+      if (loadingMore != null) return loadingMore;
+
+      const current = generation;
+      const cursor = encodeURIComponent(next_cursor);
+      const q = encodeURIComponent(query);
+      const request: Promise<TaskHistoryResponse | undefined> = fetch(
+        `/agent-scheduler/v1/history?status=${status}&limit=${limit}&cursor=${cursor}&q=${q}`
+      )
+        .then(response => response.json())
+        .then((data: TaskHistoryResponse) => {
+          // the grid was reset while this page was loading, it belongs to the old listing
+          if (current !== generation) return undefined;
+
+          setState({ ...data, tasks: [...getState().tasks, ...data.tasks] });
+          return data;
+        })
+        .finally(() => {
+          if (loadingMore === request) {
+            loadingMore = undefined;
+          }
+        });
+      loadingMore = request;
+      return request;
+    },
     onFilterStatus: status => {
       setState({ status });
       actions.refresh();
     },
+    onSearch: query => {
+      setState({ query });
+      actions.refresh();
+    },
     bookmarkTask: async (id: string, bookmarked: boolean) => {
       return fetch(`/agent-scheduler/v1/task/${id}/${bookmarked ? 'bookmark' : 'unbookmark'}`, {
         method: 'POST',
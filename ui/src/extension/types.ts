@@ -10,6 +10,7 @@ export type Task = {
   priority: number;
   result: string;
   bookmarked?: boolean;
+  archived?: boolean;
   editing?: boolean;
   created_at: number;
   updated_at: number;
@@ -23,6 +24,7 @@ export type ResponseStatus = {
 export type TaskHistoryResponse = {
   tasks: Task[];
   total: number;
+  next_cursor: string | null;
 };
 
 export type ProgressResponse = {